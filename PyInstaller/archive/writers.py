@@ -21,6 +21,10 @@ files into the executable.
 # See pyi_carchive.py for a more general archive (contains anything)
 # that can be understood by a C program.
 
+import collections
+import fnmatch
+import hashlib
+import io
 import os
 import sys
 import struct
@@ -28,11 +32,145 @@ from types import CodeType
 import marshal
 import zlib
 
-from PyInstaller.building.utils import get_code_object, strip_paths_in_code
+from PyInstaller.building.utils import get_stripped_code_object, \
+    _run_threaded, _cpu_workers, copy_file_data, COPY_BUFSIZE
 from .readers import PYZ_TYPE_MODULE, PYZ_TYPE_PKG, PYZ_TYPE_DATA
 from ..compat import BYTECODE_MAGIC, is_py2
 
 
+# Extensions of files which are already compressed. Compressing them again
+# costs build time and startup time but gains nothing.
+INCOMPRESSIBLE_EXTENSIONS = frozenset([
+    '.7z', '.bz2', '.cab', '.docx', '.egg', '.flac', '.gif', '.gz', '.jar',
+    '.jpeg', '.jpg', '.lzma', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg',
+    '.pak', '.png', '.rar', '.tgz', '.webm', '.webp', '.whl', '.woff',
+    '.woff2', '.xlsx', '.xz', '.zip', '.zst',
+])
+# Size of the samples compressed to find out whether a file is compressible.
+PROBE_SAMPLE_SIZE = 64 * 1024
+# Files which do not compress better than this ratio are stored uncompressed.
+PROBE_MAX_RATIO = 0.95
+
+# Page size of the memory the archives are mapped into by the reader.
+try:
+    import mmap
+    PAGE_SIZE = mmap.PAGESIZE
+except ImportError:
+    PAGE_SIZE = 4096
+
+
+def pad_to_page(fh, start=0):
+    """
+    Write zeros to the file FH until its position, relative to START, is a
+    multiple of PAGE_SIZE.
+    """
+    fh.write(b'\0' * (-(fh.tell() - start) % PAGE_SIZE))
+
+
+def is_incompressible(name, fh):
+    """
+    Return True if the data of the entry NAME, readable from the seekable
+    file object FH, is not worth compressing.
+
+    Files with a well-known extension of a compressed format are
+    incompressible. For other files a few samples from the start, the middle
+    and the end of the file are compressed at the fastest level, which
+    catches e.g. UPX-packed binaries.
+    """
+    if os.path.splitext(name)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    fh.seek(0, os.SEEK_END)
+    size = fh.tell()
+    if size < PROBE_SAMPLE_SIZE:
+        # Small files are cheap to compress, just try it.
+        return False
+    sample_size = 0
+    compressed_size = 0
+    for pos in (0, (size - PROBE_SAMPLE_SIZE) // 2, size - PROBE_SAMPLE_SIZE):
+        fh.seek(pos)
+        sample = fh.read(PROBE_SAMPLE_SIZE)
+        sample_size += len(sample)
+        compressed_size += len(zlib.compress(sample, 1))
+    fh.seek(0)
+    return compressed_size > sample_size * PROBE_MAX_RATIO
+
+
+# zlib can not use more than the size of its window of a preset dictionary.
+ZDICT_SIZE = 32 * 1024
+# Length of the segments a preset dictionary is built from.
+ZDICT_SEGMENT_SIZE = 64
+# Share of the samples which may be added or removed before a saved
+# preset dictionary is trained again (see load_or_train_zdict()).
+ZDICT_MAX_CHANGE = 0.2
+
+
+def train_zdict(samples, size=ZDICT_SIZE):
+    """
+    Build a preset dictionary for zlib from SAMPLES, a sequence of byte
+    strings like marshalled code objects.
+
+    The dictionary is made of the segments of the samples which are shared
+    by most samples. Most common segments come last, as zlib encodes
+    references to the end of the dictionary most cheaply.
+    """
+    seglen = ZDICT_SEGMENT_SIZE
+    counts = collections.Counter()
+    for sample in samples:
+        # The start of the data is enough to find the common segments and
+        # keeps training fast for large modules.
+        sample = sample[:4096]
+        counts.update(set(sample[i:i + seglen]
+                          for i in range(0, len(sample) - seglen + 1, 16)))
+    segments = []
+    for segment, count in counts.most_common():
+        if count < 2 or (len(segments) + 1) * seglen > size:
+            break
+        # Skip segments overlapping much with recently chosen ones.
+        if any(segment in s for s in segments[-64:]):
+            continue
+        segments.append(segment)
+    segments.reverse()
+    return b''.join(segments)
+
+
+def load_or_train_zdict(filename, names, samples, max_change=ZDICT_MAX_CHANGE):
+    """
+    Return the preset dictionary saved in FILENAME by a previous build if
+    it was trained from about the same NAMES, else train one from SAMPLES,
+    the byte strings of NAMES, and save it there.
+
+    A new dictionary changes the compressed data of all entries, so it is
+    only trained again if more than MAX_CHANGE of the names were added or
+    removed. Delete FILENAME to train it again anyway.
+    """
+    try:
+        with open(filename, 'rb') as fh:
+            saved = marshal.load(fh)
+        saved_names, zdict = saved['names'], saved['zdict']
+    except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+        saved_names = None
+    if saved_names is not None:
+        changed = len(set(names).symmetric_difference(saved_names))
+        if changed <= max_change * len(names):
+            return zdict
+    zdict = train_zdict(samples)
+    with open(filename, 'wb') as fh:
+        marshal.dump({'names': sorted(names), 'zdict': zdict}, fh)
+    return zdict
+
+
+def compression_override(name, cpatterns):
+    """
+    Return the compression flag of the first (pattern, flag) pair in
+    CPATTERNS whose glob pattern matches NAME, or None if none matches.
+    """
+    name = name.replace(os.sep, '/')
+    for pattern, flag in cpatterns or ():
+        if fnmatch.fnmatchcase(name, pattern):
+            return flag
+    return None
+
+
 class ArchiveWriter(object):
     """
     A base class for a repository of python code objects.
@@ -172,14 +310,50 @@ class ZlibArchiveWriter(ArchiveWriter):
     HDRLEN = ArchiveWriter.HDRLEN + 5
     COMPRESSION_LEVEL = 6  # Default level of the 'zlib' module from Python.
 
-    def __init__(self, archive_path, logical_toc, code_dict=None, cipher=None):
+    def __init__(self, archive_path, logical_toc, code_dict=None, cipher=None,
+                 cpatterns=None, skip_incompressible=False, zdict=None,
+                 blob_cache=None, options=None, page_align=False):
         """
         code_dict      dict containing module code objects from ModuleGraph.
+        cpatterns      list of (glob pattern, flag) pairs forcing entries
+                       with a matching name to be compressed (flag 1) or
+                       stored (flag 0). The first matching pattern wins.
+        skip_incompressible
+                       store data files uncompressed if they do not compress
+                       (see is_incompressible()).
+        zdict          preset dictionary used to compress all entries
+                       (see train_zdict()).
+        blob_cache     dict with the compressed data of a previous build,
+                       as found in `new_blob_cache` after writing the
+                       archive. Data found there is not compressed again.
+                       None disables the cache.
+        options        dict of further options for the reader, like
+                       'cache_size' (see ZlibArchiveReader).
+        page_align     start entries stored uncompressed and unencrypted at
+                       a multiple of PAGE_SIZE, so the mapped archive is
+                       read from whole pages.
         """
         # Keep references to module code objects constructed by ModuleGraph
         # to avoid writting .pyc/pyo files to hdd.
         self.code_dict = code_dict or {}
         self.cipher = cipher or None
+        self.cpatterns = cpatterns or []
+        self.skip_incompressible = skip_incompressible
+        self.zdict = zdict
+        self.page_align = page_align
+        # (digest, compressed) -> (pos, length, compressed) of the data
+        # already written.
+        self._blobs = {}
+        self.blob_cache = blob_cache
+        self.new_blob_cache = {}
+        # Compressed data depends on the data and these settings.
+        self._compression_digest = hashlib.sha256(
+            struct.pack('!i', self.COMPRESSION_LEVEL) + (zdict or b'')).digest()
+        # Options for the reader, stored in front of the TOC.
+        self.options = dict(options or {})
+        self.options_pos = 0
+        if zdict:
+            self.options['zdict'] = zdict
 
         super(ZlibArchiveWriter, self).__init__(archive_path, logical_toc)
 
@@ -206,21 +380,65 @@ class ZlibArchiveWriter(ArchiveWriter):
             # No need to use forward slash as path-separator here since
             # pkg_resources on Windows back slash as path-separator.
 
-        obj = zlib.compress(data, self.COMPRESSION_LEVEL)
+        compressed = compression_override(name, self.cpatterns)
+        if compressed is None:
+            compressed = not (typ == PYZ_TYPE_DATA and self.skip_incompressible
+                              and is_incompressible(path, io.BytesIO(data)))
+
+        # Entries with the same content share the stored data.
+        key = (hashlib.sha256(data).digest(), compressed)
+        blob = self._blobs.get(key)
+        if blob:
+            self.toc.append((name, (typ,) + blob))
+            return
+
+        if compressed:
+            obj = self._compress_cached(data, key[0])
+            # Keep data which grows when compressed as it is.
+            compressed = len(obj) < len(data)
+        if not compressed:
+            obj = data
 
         # First compress then encrypt.
         if self.cipher:
             obj = self.cipher.encrypt(obj)
+        elif self.page_align and not compressed:
+            pad_to_page(self.lib)
 
-        self.toc.append((name, (typ, self.lib.tell(), len(obj))))
+        blob = (self.lib.tell(), len(obj), int(compressed))
+        self._blobs[key] = blob
+        self.toc.append((name, (typ,) + blob))
         self.lib.write(obj)
 
+    def _compress_cached(self, data, digest):
+        if self.blob_cache is None:
+            return self.compress(data)
+        cache_key = digest + self._compression_digest
+        obj = self.blob_cache.get(cache_key)
+        if obj is None:
+            obj = self.compress(data)
+        self.new_blob_cache[cache_key] = obj
+        return obj
+
+    def compress(self, data):
+        if self.zdict:
+            comprobj = zlib.compressobj(self.COMPRESSION_LEVEL, zdict=self.zdict)
+            return comprobj.compress(data) + comprobj.flush()
+        return zlib.compress(data, self.COMPRESSION_LEVEL)
+
+    def _finalize(self):
+        if self.options:
+            self.options_pos = self.lib.tell()
+            self.lib.write(marshal.dumps(self.options))
+        super(ZlibArchiveWriter, self)._finalize()
+
     def update_headers(self, tocpos):
         """
-        add level
+        add level and the position of the options
         """
         ArchiveWriter.update_headers(self, tocpos)
         self.lib.write(struct.pack('!B', self.cipher is not None))
+        self.lib.write(struct.pack('!i', self.options_pos))
 
 
 
@@ -300,6 +518,9 @@ class CArchiveWriter(ArchiveWriter):
     MAGIC = b'MEI\014\013\012\013\016'
     HDRLEN = 0
     LEVEL = 9
+    # Amount of (uncompressed) data compressed in parallel before it is
+    # written to the archive. Limits the memory used for compressed data.
+    PARALLEL_BATCH_SIZE = 64 * 1024 * 1024
 
     # Cookie - holds some information for the bootloader. C struct format
     # definition. '!' at the beginning means network byte order.
@@ -317,7 +538,8 @@ class CArchiveWriter(ArchiveWriter):
     _cookie_format = '!8siiii64s'
     _cookie_size = struct.calcsize(_cookie_format)
 
-    def __init__(self, archive_path, logical_toc, pylib_name):
+    def __init__(self, archive_path, logical_toc, pylib_name, blob_cache=None,
+                 previous_archive=None, page_align=False):
         """
         Constructor.
 
@@ -325,8 +547,22 @@ class CArchiveWriter(ArchiveWriter):
         start        is the seekposition within PATH.
         len          is the length of the CArchive (if 0, then read till EOF).
         pylib_name   name of Python DLL which bootloader will use.
+        blob_cache   `new_blob_cache` of the writer of PREVIOUS_ARCHIVE.
+                     Compressed files found there are copied from the
+                     previous archive instead of being compressed again.
+                     None disables the cache.
+        page_align   start the PYZ archives at a multiple of PAGE_SIZE,
+                     for PYZs written with page_align=True.
         """
         self._pylib_name = pylib_name
+        self.page_align = page_align
+        self.blob_cache = blob_cache
+        self.previous_archive = previous_archive
+        # pathnm -> (size, mtime, digest) of the files seen by this build.
+        self._stats = {}
+        # Digests of the files which were to be compressed but did not
+        # compress.
+        self._incompressible = set()
 
         # A CArchive created from scratch starts at 0, no leading bootloader.
         super(CArchiveWriter, self).__init__(archive_path, logical_toc)
@@ -338,6 +574,47 @@ class CArchiveWriter(ArchiveWriter):
         super(CArchiveWriter, self)._start_add_entries(path)
         # Override parents' toc {} with a class.
         self.toc = CTOC()
+        # (digest, flag) -> (dpos, dlen) of the data already written. Entries
+        # with the same content share the data.
+        self._blobs = {}
+        # Number of entries by file size, if known in advance. Files without
+        # another entry of the same size are not hashed to find duplicates.
+        self._size_counts = None
+
+    def _add_from_table_of_contents(self, toc):
+        """
+        Add entries from a logical TOC.
+
+        Entries are compressed in parallel in batches of PARALLEL_BATCH_SIZE
+        bytes and then written in TOC order, so the archive is the same
+        as one written by calling add() for every entry.
+        """
+        sizes = [self._entry_size(entry) for entry in toc]
+        self._size_counts = collections.Counter(sizes)
+        batch = []
+        batch_size = 0
+        for entry, size in zip(toc, sizes):
+            batch.append(entry)
+            batch_size += size
+            if batch_size >= self.PARALLEL_BATCH_SIZE:
+                self._add_batch(batch)
+                batch = []
+                batch_size = 0
+        self._add_batch(batch)
+
+    def _add_batch(self, entries):
+        prepared = _run_threaded(self._prepare_entry, entries, _cpu_workers())
+        for entry, data in zip(entries, prepared):
+            self._write_entry(entry, *data)
+
+    def _entry_size(self, entry):
+        (nm, pathnm, flag, typcd) = entry[:4]
+        if typcd in ('o', 'd') or not pathnm:
+            return 0
+        try:
+            return os.path.getsize(pathnm)
+        except OSError:
+            return 0
 
     def add(self, entry):
         """
@@ -357,6 +634,17 @@ class CArchiveWriter(ArchiveWriter):
                   W arg (warning option arg)
                   s  (meaning do site.py processing.
         """
+        self._write_entry(entry, *self._prepare_entry(entry))
+
+    def _prepare_entry(self, entry):
+        """
+        Do the expensive part of adding ENTRY: compile scripts and compress
+        data. This does not touch the archive and may run in a thread.
+
+        Return (ulen, flag, data, digest). `data` is None if the data is to
+        be copied from the file unchanged. `digest` is the SHA-256 digest of
+        the uncompressed data, or None if there is no data.
+        """
         (nm, pathnm, flag, typcd) = entry[:4]
         # FIXME Could we make the version 5 the default one?
         # Version 5 - allow type 'o' = runtime option.
@@ -370,9 +658,7 @@ class CArchiveWriter(ArchiveWriter):
                 # If it's a source code file, compile it to a code object and marshall
                 # the object so it can be unmarshalled by the bootloader.
 
-                code = get_code_object(nm, pathnm)
-                code = strip_paths_in_code(code)
-
+                code = get_stripped_code_object(nm, pathnm)
                 code_data = marshal.dumps(code)
                 ulen = len(code_data)
             else:
@@ -382,36 +668,129 @@ class CArchiveWriter(ArchiveWriter):
             print("Cannot find ('%s', '%s', %s, '%s')" % (nm, pathnm, flag, typcd))
             raise
 
-        where = self.lib.tell()
         assert flag in range(3)
-        if not fh and not code_data:
-            # no need to write anything
-            pass
-        elif flag == 1:
-            comprobj = zlib.compressobj(self.LEVEL)
-            if code_data is not None:
-                self.lib.write(comprobj.compress(code_data))
+        try:
+            if not fh and not code_data:
+                # no need to write anything
+                return ulen, flag, b'', None
+            digest = hashlib.sha256()
+            if flag == 1:
+                if code_data is None and self.blob_cache is not None:
+                    prepared = self._reuse_compressed(pathnm, fh)
+                    if prepared:
+                        return prepared
+                comprobj = zlib.compressobj(self.LEVEL)
+                if code_data is not None:
+                    digest.update(code_data)
+                    chunks = [comprobj.compress(code_data)]
+                else:
+                    chunks = []
+                    while 1:
+                        buf = fh.read(COPY_BUFSIZE)
+                        if not buf:
+                            break
+                        digest.update(buf)
+                        chunks.append(comprobj.compress(buf))
+                chunks.append(comprobj.flush())
+                data = b''.join(chunks)
+                if len(data) < ulen:
+                    return ulen, flag, data, digest.digest()
+                # Compression does not pay off, store the data as it is.
+                return ulen, 0, code_data, digest.digest()
+            elif code_data is not None:
+                digest.update(code_data)
+                return ulen, flag, code_data, digest.digest()
+            elif self._size_counts is not None and self._size_counts[ulen] < 2:
+                # Without another entry of this size there is no duplicate.
+                return ulen, flag, None, None
             else:
-                assert fh
                 while 1:
-                    buf = fh.read(16*1024)
+                    buf = fh.read(COPY_BUFSIZE)
                     if not buf:
                         break
-                    self.lib.write(comprobj.compress(buf))
-            self.lib.write(comprobj.flush())
+                    digest.update(buf)
+                return ulen, flag, None, digest.digest()
+        finally:
+            if fh:
+                fh.close()
+
+    def _reuse_compressed(self, pathnm, fh):
+        """
+        Look up the file PATHNM, opened as FH, in the blob cache.
 
+        Return the result of _prepare_entry() with the compressed data of
+        the file copied from the previous archive, or None if it is not
+        there. The digest of a file whose size and mtime did not change
+        is taken from the cache.
+        """
+        st = os.fstat(fh.fileno())
+        stat = (st.st_size, st.st_mtime)
+        cached = self.blob_cache['stats'].get(pathnm)
+        if cached and tuple(cached[:2]) == stat:
+            digest = cached[2]
         else:
-            if code_data is not None:
-                self.lib.write(code_data)
-            else:
-                assert fh
-                while 1:
-                    buf = fh.read(16*1024)
-                    if not buf:
-                        break
-                    self.lib.write(buf)
+            sha = hashlib.sha256()
+            while 1:
+                buf = fh.read(COPY_BUFSIZE)
+                if not buf:
+                    break
+                sha.update(buf)
+            fh.seek(0)
+            digest = sha.digest()
+        self._stats[pathnm] = stat + (digest,)
+
+        if digest in self.blob_cache['incompressible']:
+            # Compression did not pay off last time.
+            return st.st_size, 0, None, digest
+        blob = self.blob_cache['blobs'].get((digest, 1))
+        if blob and self.previous_archive:
+            dpos, dlen = blob
+            with open(self.previous_archive, 'rb') as prev:
+                prev.seek(dpos)
+                data = prev.read(dlen)
+            if len(data) == dlen:
+                return st.st_size, 1, data, digest
+        return None
+
+    @property
+    def new_blob_cache(self):
+        """
+        Positions of the compressed data in this archive, keyed by digest,
+        and the digests of the files, to be passed as `blob_cache` when
+        building the next version of this archive.
+        """
+        blobs = dict((key, blob) for key, blob in self._blobs.items()
+                     if key[1] == 1)
+        return {'blobs': blobs, 'stats': self._stats,
+                'incompressible': self._incompressible}
 
-        dlen = self.lib.tell() - where
+    def _write_entry(self, entry, ulen, flag, data, digest):
+        """
+        Write the prepared data of ENTRY to the archive and record it in
+        the CTOC. If data with the same digest was already written, the
+        entry refers to that data instead.
+        """
+        (nm, pathnm, _, typcd) = entry[:4]
+        blob = self._blobs.get((digest, flag)) if digest else None
+        if blob:
+            where, dlen = blob
+        else:
+            if typcd == 'z' and self.page_align:
+                # The PYZ is mapped into memory by the reader, see
+                # ZlibArchiveWriter.page_align.
+                pad_to_page(self.lib)
+            where = self.lib.tell()
+            if data is not None:
+                self.lib.write(data)
+            else:
+                with open(pathnm, 'rb') as fh:
+                    copy_file_data(fh, self.lib)
+
+            dlen = self.lib.tell() - where
+            if digest:
+                self._blobs[(digest, flag)] = (where, dlen)
+        if digest and entry[2] == 1 and flag == 0:
+            self._incompressible.add(digest)
         if typcd == 'm':
             if pathnm.find('.__init__.py') > -1:
                 typcd = 'M'
@@ -14,22 +14,28 @@ This module contains classes that are available for the .spec files.
 Spec file is generated by PyInstaller. The generated code from .spec file
 is a way how PyInstaller does the dependency analysis and creates executable.
 """
+import fnmatch
+import marshal
 import os
-import shutil
 import tempfile
 import pprint
 from operator import itemgetter
 
 from PyInstaller import is_win, is_darwin, is_linux, HOMEPATH, PLATFORM
-from PyInstaller.archive.writers import ZlibArchiveWriter, CArchiveWriter
+from PyInstaller.archive.writers import ZlibArchiveWriter, CArchiveWriter, \
+    compression_override, is_incompressible, pad_to_page, load_or_train_zdict, \
+    PAGE_SIZE
 from PyInstaller.building.utils import _check_guts_toc, add_suffix_to_extensions, \
-    checkCache, _check_path_overlap, _rmtree, strip_paths_in_code, get_code_object
-from PyInstaller.compat import is_cygwin, exec_command_all
+    checkCache, _check_path_overlap, _rmtree, strip_paths_in_code, get_code_object, \
+    file_digest, link_or_copy, LINK_MODES, _run_threaded, _io_workers, \
+    copy_file_data, load_import_order, sort_by_import_order, write_extension_index
+from PyInstaller.compat import is_cygwin, is_py2, is_py35
 from PyInstaller.depend import bindepend
 from PyInstaller.depend.analysis import get_bootstrap_modules
 from PyInstaller.depend.utils import is_path_to_egg
 from PyInstaller.building.datastruct import TOC, Target, logger, _check_guts_eq
-from PyInstaller.utils import misc
+from PyInstaller.utils import elf, misc
+from PyInstaller.utils.misc import load_py_data_struct, save_py_data_struct
 from .. import log as logging
 
 logger = logging.getLogger(__name__)
@@ -43,6 +49,19 @@ class PYZ(Target):
     Creates a ZlibArchive that contains all pure Python modules.
     """
     typ = 'PYZ'
+    _deferrable = True
+    # Modules never executed lazily, even if they match `lazy_modules`:
+    # the import system and the bootstrap use them, or other modules rely
+    # on the side effects of importing them.
+    NEVER_LAZY_MODULES = (
+        '__future__', '__main__', 'abc', 'atexit', 'codecs', 'copyreg',
+        'ctypes', 'ctypes.*', 'encodings', 'encodings.*', 'enum',
+        'genericpath', 'importlib', 'importlib.*', 'io', 'multiprocessing',
+        'multiprocessing.*', 'ntpath', 'os', 'pkg_resources',
+        'pkg_resources.*', 'posixpath', 'signal', 'site', 'sitecustomize',
+        'six', 'six.*', 'stat', 'threading', 'typing', 'warnings',
+        'zipimport',
+    )
 
     def __init__(self, *tocs, **kwargs):
         """
@@ -52,7 +71,8 @@ class PYZ(Target):
 
                 If this TOC has an attribute `_code_cache`, this is
                 expected to be a dict of module code objects from
-                ModuleGraph.
+                ModuleGraph, with the paths already stripped (see
+                strip_paths_in_code()).
 
         kwargs
             Possible keywork arguments:
@@ -62,6 +82,51 @@ class PYZ(Target):
                 name will do fine.
             cipher
                 The block cipher that will be used to encrypt Python bytecode.
+            cpatterns
+                A list of (pattern, flag) pairs. Entries whose name matches
+                the glob pattern are compressed (flag 1) or stored
+                uncompressed (flag 0). The first matching pattern wins.
+            skip_incompressible
+                If True (default), data files which do not compress are
+                stored uncompressed.
+            zdict
+                If True, build a preset dictionary from the modules and use
+                it to compress all entries. This makes the PYZ of apps with
+                many small modules smaller. The dictionary is kept in the
+                workpath and reused while the set of modules does not
+                change much. Requires Python 3.
+            cache_size
+                If set, the app keeps up to this many bytes of decompressed
+                modules and data files in memory, for entries read more than
+                once. Off by default.
+            import_profile
+                If set to 'report' or 'importtime', the app writes the time
+                spent importing modules to stderr at exit, see
+                :ref:`Profiling Imports`. Off by default.
+            import_order
+                The import order file recorded by running the app, see
+                :ref:`Ordering the Archives by Import Order`. Modules and
+                data files are stored in this order, the others follow
+                sorted by name.
+            lazy_modules
+                A list of glob patterns of modules which are executed on the
+                first access to one of their attributes instead of when
+                imported, see :ref:`Lazy Module Execution`. Modules in
+                NEVER_LAZY_MODULES are never executed lazily. Requires
+                Python 3.5.
+            preload
+                If True, the app decompresses the entries listed in
+                `import_order` in a background thread at startup. Off by
+                default.
+            compress
+                If False, modules and data files are stored uncompressed,
+                unless `cpatterns` say otherwise. Default is True.
+            page_align
+                If True, entries stored uncompressed start at a page
+                boundary, so the app reads them straight from the mapped
+                executable and concurrent processes of the app share the
+                pages, see :ref:`Uncompressed Page-Aligned PYZ`. Off by
+                default.
 
         """
 
@@ -69,6 +134,30 @@ class PYZ(Target):
         Target.__init__(self)
         name = kwargs.get('name', None)
         cipher = kwargs.get('cipher', None)
+        self.cpatterns = list(kwargs.get('cpatterns', None) or [])
+        if not kwargs.get('compress', True):
+            self.cpatterns.append(('*', 0))
+        self.skip_incompressible = kwargs.get('skip_incompressible', True)
+        self.page_align = bool(kwargs.get('page_align', False))
+        if self.page_align and cipher:
+            logger.warning('PYZ: page_align has no effect on encrypted modules')
+        self.zdict = kwargs.get('zdict', False)
+        if self.zdict and is_py2:
+            logger.warning('PYZ: zdict requires Python 3, ignored')
+            self.zdict = False
+        self.cache_size = kwargs.get('cache_size', 0)
+        self.import_profile = kwargs.get('import_profile', None)
+        self.import_order = []
+        if kwargs.get('import_order'):
+            self.import_order = load_import_order(kwargs['import_order'])
+        self.lazy_modules = list(kwargs.get('lazy_modules', None) or [])
+        if self.lazy_modules and not is_py35:
+            logger.warning('PYZ: lazy_modules requires Python 3.5, ignored')
+            self.lazy_modules = []
+        self.preload = bool(kwargs.get('preload', False))
+        if self.preload and not self.import_order:
+            logger.warning('PYZ: preload requires an import_order, ignored')
+            self.preload = False
         self.toc = TOC()
         # If available, use code objects directly from ModuleGraph to
         # speed up PyInstaller.
@@ -80,6 +169,10 @@ class PYZ(Target):
         self.name = name
         if name is None:
             self.name = os.path.splitext(self.tocfilename)[0] + '.pyz'
+        # Compressed modules of the previous build.
+        self.blob_cache_name = os.path.splitext(self.tocfilename)[0] + '.blobs'
+        # Preset dictionary trained by a previous build.
+        self.zdict_name = os.path.splitext(self.tocfilename)[0] + '.zdict'
         # PyInstaller bootstrapping modules.
         self.dependencies = get_bootstrap_modules()
         # Bundle the crypto key.
@@ -98,6 +191,15 @@ class PYZ(Target):
 
     _GUTS = (# input parameters
             ('name', _check_guts_eq),
+            ('cpatterns', _check_guts_eq),
+            ('skip_incompressible', _check_guts_eq),
+            ('zdict', _check_guts_eq),
+            ('cache_size', _check_guts_eq),
+            ('import_profile', _check_guts_eq),
+            ('import_order', _check_guts_eq),
+            ('lazy_modules', _check_guts_eq),
+            ('preload', _check_guts_eq),
+            ('page_align', _check_guts_eq),
             ('toc', _check_guts_toc),  # todo: pyc=1
             # no calculated/analysed values
             )
@@ -114,18 +216,74 @@ class PYZ(Target):
         for entry in toc:
             if not entry[0] in self.code_dict and entry[2] == 'PYMODULE':
                 # For some reason the code-object, modulegraph created
-                # is not available. Recreate it
-                self.code_dict[entry[0]] = get_code_object(entry[0], entry[1])
-        # sort content alphabetically to support reproducible builds
-        toc.sort()
+                # is not available. Recreate it and remove leading parts of
+                # paths in it.
+                self.code_dict[entry[0]] = strip_paths_in_code(
+                    get_code_object(entry[0], entry[1]))
+        # sort content alphabetically to support reproducible builds, with
+        # the modules imported at startup first if the order is known
+        toc = sort_by_import_order(toc, self.import_order)
+
+        zdict = None
+        if self.zdict:
+            names = [entry[0] for entry in toc if entry[2] == 'PYMODULE']
+            zdict = load_or_train_zdict(
+                self.zdict_name, names,
+                (marshal.dumps(self.code_dict[name]) for name in names))
+
+        pyz = ZlibArchiveWriter(self.name, toc, code_dict=self.code_dict, cipher=self.cipher,
+                                cpatterns=self.cpatterns,
+                                skip_incompressible=self.skip_incompressible,
+                                zdict=zdict, blob_cache=self._load_blob_cache(),
+                                options=self._reader_options(toc),
+                                page_align=self.page_align)
+        with open(self.blob_cache_name, 'wb') as fh:
+            marshal.dump(pyz.new_blob_cache, fh)
+
+    def _reader_options(self, toc):
+        options = {}
+        lazy_modules = self._lazy_module_names(toc)
+        if lazy_modules:
+            logger.info('PYZ: %d modules are executed lazily', len(lazy_modules))
+            options['lazy_modules'] = lazy_modules
+        if self.preload:
+            names = set(entry[0] for entry in toc)
+            options['preload'] = [name for name in self.import_order
+                                  if name in names]
+        if self.cache_size:
+            options['cache_size'] = int(self.cache_size)
+        if self.import_profile:
+            options['import_profile'] = str(self.import_profile)
+        return options
+
+    def _lazy_module_names(self, toc):
+        """
+        Return the names of the modules in `toc` to execute lazily.
+        """
+        def matches(name, patterns):
+            return any(fnmatch.fnmatchcase(name, p) for p in patterns)
 
-        # Remove leading parts of paths in code objects
-        self.code_dict = {
-            key: strip_paths_in_code(code)
-            for key, code in self.code_dict.items()
-        }
+        names = []
+        for name, path, typ in toc:
+            if typ != 'PYMODULE' or not matches(name, self.lazy_modules):
+                continue
+            if matches(name, self.NEVER_LAZY_MODULES):
+                logger.info('PYZ: not executing %s lazily', name)
+                continue
+            names.append(name)
+        return sorted(names)
 
-        pyz = ZlibArchiveWriter(self.name, toc, code_dict=self.code_dict, cipher=self.cipher)
+    def _load_blob_cache(self):
+        """
+        Return the compressed modules of the previous build, keyed by
+        content and compression settings.
+        """
+        try:
+            with open(self.blob_cache_name, 'rb') as fh:
+                cache = marshal.load(fh)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
 
 
 class PKG(Target):
@@ -145,9 +303,11 @@ class PKG(Target):
                  'ZIPFILE': 'Z',
                  'EXECUTABLE': 'b',
                  'DEPENDENCY': 'd'}
+    _deferrable = True
 
     def __init__(self, toc, name=None, cdict=None, exclude_binaries=0,
-                 strip_binaries=False, upx_binaries=False):
+                 strip_binaries=False, upx_binaries=False, cpatterns=None,
+                 skip_incompressible=True, import_order=None, page_align=False):
         """
         toc
                 A TOC (Table of Contents)
@@ -158,6 +318,21 @@ class PKG(Target):
                 PYZ is left uncompressed so that it can be accessed inside the
                 PKG. The default uses sensible values. If zlib is not available,
                 no compression is used.
+        cpatterns
+                A list of (pattern, flag) pairs overriding `cdict`. Entries
+                whose name matches the glob pattern are compressed (flag 1) or
+                stored uncompressed (flag 0). The first matching pattern wins.
+        skip_incompressible
+                If True, files which would be compressed but do not compress
+                (e.g. images, archives or UPX-packed binaries) are stored
+                uncompressed. This speeds up both building and unpacking.
+        import_order
+                The import order file recorded by running the app. The PYZ
+                archives and the C extension modules are stored first, the
+                latter in the order they were imported.
+        page_align
+                If True, the PYZ archives start at a page boundary. Required
+                for a PYZ built with page_align=True; EXE sets it then.
         exclude_binaries
                 If True, EXTENSIONs and BINARYs will be left out of the PKG,
                 and forwarded to its container (usually a COLLECT).
@@ -171,9 +346,17 @@ class PKG(Target):
         self.name = name
         if name is None:
             self.name = os.path.splitext(self.tocfilename)[0] + '.pkg'
+        # Positions of the compressed files in the previous build.
+        self.blob_cache_name = os.path.splitext(self.tocfilename)[0] + '.blobs'
         self.exclude_binaries = exclude_binaries
         self.strip_binaries = strip_binaries
         self.upx_binaries = upx_binaries
+        self.cpatterns = cpatterns or []
+        self.skip_incompressible = skip_incompressible
+        self.page_align = page_align
+        self.import_order = []
+        if import_order:
+            self.import_order = load_import_order(import_order)
         # This dict tells PyInstaller what items embedded in the executable should
         # be compressed.
         if self.cdict is None:
@@ -186,11 +369,24 @@ class PKG(Target):
                           # Do not compress PYZ as a whole. Single modules are
                           # compressed when creating PYZ archive.
                           'PYZ': UNCOMPRESSED}
+        if self.exclude_binaries:
+            # Forward the binaries to the container here, not in
+            # `assemble()`, as the container is set up before the PKG
+            # is assembled, if it is at all.
+            for inm, fnm, typ in add_suffix_to_extensions(self.toc):
+                if fnm and not os.path.isfile(fnm) and is_path_to_egg(fnm):
+                    continue
+                if typ in ('BINARY', 'EXTENSION'):
+                    self.dependencies.append((inm, fnm, typ))
         self.__postinit__()
 
     _GUTS = (# input parameters
             ('name', _check_guts_eq),
             ('cdict', _check_guts_eq),
+            ('cpatterns', _check_guts_eq),
+            ('skip_incompressible', _check_guts_eq),
+            ('import_order', _check_guts_eq),
+            ('page_align', _check_guts_eq),
             ('toc', _check_guts_toc),  # list unchanged and no newer files
             ('exclude_binaries', _check_guts_eq),
             ('strip_binaries', _check_guts_eq),
@@ -222,7 +418,8 @@ class PKG(Target):
                 continue
             if typ in ('BINARY', 'EXTENSION', 'DEPENDENCY'):
                 if self.exclude_binaries and typ != 'DEPENDENCY':
-                    self.dependencies.append((inm, fnm, typ))
+                    # Forwarded to the container, see `__init__()`.
+                    pass
                 else:
                     if typ == 'BINARY':
                         # Avoid importing the same binary extension twice. This might
@@ -265,17 +462,102 @@ class PKG(Target):
         # Bootloader has to know the name of Python library. Pass python libname to CArchive.
         pylib_name = os.path.basename(bindepend.get_python_library_path())
 
+        srctoc = self._set_compression(srctoc)
+        mytoc = self._set_compression(mytoc)
+        if not self.exclude_binaries:
+            # Else the container of the binaries writes the index.
+            inm, fnm, typ = write_extension_index(
+                toc, os.path.splitext(self.tocfilename)[0] + '.extensions')
+            mytoc.append((inm, fnm, UNCOMPRESSED, self.xformdict[typ]))
+
         # Sort content alphabetically by type and name to support
-        # reproducible builds.
-        mytoc.sort(key=itemgetter(3, 0))
+        # reproducible builds. If the import order is known, the PYZ and
+        # the extension modules the app uses are put first.
+        if self.import_order:
+            order = [e[0] for e in mytoc if e[3] == 'z'] + self.import_order
+            mytoc = sort_by_import_order(mytoc, order, key=itemgetter(3, 0))
+        else:
+            mytoc.sort(key=itemgetter(3, 0))
         # Do *not* sort modules and scripts, as their order is important.
         # TODO: Think about having all modules first and then all scripts.
-        archive = CArchiveWriter(self.name, srctoc + mytoc,
-                                 pylib_name=pylib_name)
+        blob_cache = self._load_blob_cache()
+        previous_archive = None
+        if blob_cache['blobs']:
+            # Keep the previous archive to copy compressed files from.
+            previous_archive = self.name + '.prev'
+            if os.path.exists(previous_archive):
+                os.remove(previous_archive)
+            os.rename(self.name, previous_archive)
+        try:
+            archive = CArchiveWriter(self.name, srctoc + mytoc,
+                                     pylib_name=pylib_name,
+                                     blob_cache=blob_cache,
+                                     previous_archive=previous_archive,
+                                     page_align=self.page_align)
+        finally:
+            if previous_archive:
+                os.remove(previous_archive)
+        blob_cache = archive.new_blob_cache
+        blob_cache['name'] = self.name
+        blob_cache['size'] = os.path.getsize(self.name)
+        with open(self.blob_cache_name, 'wb') as fh:
+            marshal.dump(blob_cache, fh)
 
         for item in trash:
             os.remove(item)
 
+    def _load_blob_cache(self):
+        """
+        Return the blob cache saved by the previous build of this PKG. Its
+        blobs are only used if the previous archive is still there.
+        """
+        empty = {'blobs': {}, 'stats': {}, 'incompressible': set()}
+        try:
+            with open(self.blob_cache_name, 'rb') as fh:
+                cache = marshal.load(fh)
+            if not isinstance(cache, dict) or not set(empty) <= set(cache):
+                return empty
+            if (cache.get('name') != self.name or not os.path.exists(self.name)
+                    or os.path.getsize(self.name) != cache.get('size')):
+                cache['blobs'] = {}
+            return cache
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return empty
+
+    def _set_compression(self, toc):
+        """
+        Apply `cpatterns` to the compression flags of a logical TOC and,
+        if `skip_incompressible` is set, clear the flag of files which do
+        not compress.
+        """
+        result = []
+        probe = []
+        for inm, fnm, flag, typcd in toc:
+            override = compression_override(inm, self.cpatterns)
+            if override is not None:
+                flag = override
+            elif (flag == COMPRESSED and self.skip_incompressible
+                  and typcd not in ('o', 'd', 's')):
+                probe.append(len(result))
+            result.append((inm, fnm, flag, typcd))
+        incompressible = _run_threaded(_is_incompressible_file,
+                                       [result[i][1] for i in probe],
+                                       _io_workers())
+        for i, skip in zip(probe, incompressible):
+            if skip:
+                inm, fnm, flag, typcd = result[i]
+                result[i] = (inm, fnm, UNCOMPRESSED, typcd)
+        return result
+
+
+def _is_incompressible_file(fnm):
+    try:
+        with open(fnm, 'rb') as fh:
+            return is_incompressible(fnm, fh)
+    except (IOError, OSError):
+        # Let CArchiveWriter report missing files.
+        return False
+
 
 class EXE(Target):
     """
@@ -283,6 +565,7 @@ class EXE(Target):
     This bundles all necessary files together.
     """
     typ = 'EXECUTABLE'
+    _deferrable = True
 
     def __init__(self, *args, **kwargs):
         """
@@ -303,6 +586,11 @@ class EXE(Target):
                 appended.
             exclude_binaries
                 Forwarded to the PKG the EXE builds.
+            cdict, cpatterns, skip_incompressible
+                Forwarded to the PKG the EXE builds. They control which
+                files are compressed.
+            import_order
+                Forwarded to the PKG the EXE builds.
             icon
                 Windows or OSX only. icon='myicon.ico' to use an icon file or
                 icon='notepad.exe,0' to grab an icon resource.
@@ -368,6 +656,9 @@ class EXE(Target):
         self.pkgname = base_name + '.pkg'
 
         self.toc = TOC()
+        # Whether a PYZ with page-aligned entries is bundled. Windows
+        # does not map the PYZ.
+        self.page_align = False
 
         for arg in args:
             if isinstance(arg, TOC):
@@ -375,6 +666,8 @@ class EXE(Target):
             elif isinstance(arg, Target):
                 self.toc.append((os.path.basename(arg.name), arg.name, arg.typ))
                 self.toc.extend(arg.dependencies)
+                if isinstance(arg, PYZ) and arg.page_align and not is_win:
+                    self.page_align = True
             else:
                 self.toc.extend(arg)
 
@@ -394,6 +687,10 @@ class EXE(Target):
                                  "", "OPTION"))
 
         self.pkg = PKG(self.toc, cdict=kwargs.get('cdict', None),
+                       cpatterns=kwargs.get('cpatterns', None),
+                       skip_incompressible=kwargs.get('skip_incompressible', True),
+                       import_order=kwargs.get('import_order', None),
+                       page_align=self.page_align,
                        exclude_binaries=self.exclude_binaries,
                        strip_binaries=self.strip, upx_binaries=self.upx,
                        )
@@ -417,6 +714,7 @@ class EXE(Target):
             ('uac_uiaccess', _check_guts_eq),
             ('manifest', _check_guts_eq),
             ('append_pkg', _check_guts_eq),
+            ('page_align', _check_guts_eq),
             # for the case the directory ius shared between platforms:
             ('pkgname', _check_guts_eq),
             ('toc', _check_guts_eq),
@@ -476,6 +774,9 @@ class EXE(Target):
         logger.info('Bootloader %s' % bootloader_file)
         return bootloader_file
 
+    def _input_files(self):
+        return Target._input_files(self) + [self.pkg.name]
+
     def assemble(self):
         logger.info("Building EXE from %s", self.tocbasename)
         trash = []
@@ -554,24 +855,22 @@ class EXE(Target):
         elif is_linux:
             self._copyfile(exe, self.name)
             logger.info("Appending archive to ELF section in EXE %s", self.name)
-            retcode, stdout, stderr = exec_command_all(
-                'objcopy', '--add-section', 'pydata=%s' % self.pkg.name,
-                self.name)
-            logger.debug("objcopy returned %i", retcode)
-            logger.debug(stdout)
-            logger.debug(stderr)
-            if retcode != 0:
-                raise SystemError("objcopy Failure: %s" % stderr)
+            elf.add_section(self.name, 'pydata', self.pkg.name,
+                            align=PAGE_SIZE if self.page_align else 1)
         else:
             # Fall back to just append on end of file
             logger.info("Appending archive to EXE %s", self.name)
             with open(self.name, 'wb') as outf:
                 # write the bootloader data
                 with open(exe, 'rb') as infh:
-                    shutil.copyfileobj(infh, outf, length=64*1024)
+                    copy_file_data(infh, outf)
+                if self.page_align:
+                    # Keep page-aligned PYZ entries aligned in the
+                    # mapped executable.
+                    pad_to_page(outf)
                 # write the archive data
                 with open(self.pkg.name, 'rb') as infh:
-                    shutil.copyfileobj(infh, outf, length=64*1024)
+                    copy_file_data(infh, outf)
 
         if is_darwin:
             # Fix Mach-O header for codesigning on OS X.
@@ -589,13 +888,15 @@ class EXE(Target):
     def _copyfile(self, infile, outfile):
         with open(infile, 'rb') as infh:
             with open(outfile, 'wb') as outfh:
-                shutil.copyfileobj(infh, outfh, length=64*1024)
+                copy_file_data(infh, outfh)
 
 
 class COLLECT(Target):
     """
     In one-dir mode creates the output folder with all necessary files.
     """
+    _deferrable = True
+
     def __init__(self, *args, **kws):
         """
         args
@@ -605,10 +906,33 @@ class COLLECT(Target):
 
                 name
                     The name of the directory to be built.
+                incremental
+                    If True, keep the output directory between builds and
+                    only copy files that are new or have changed since the
+                    last build. Files collected by the previous build which
+                    are no longer part of the TOC are removed.
+                link_mode
+                    How files are put into the output directory: 'copy'
+                    (default), 'hardlink', 'reflink' (share data blocks
+                    on copy-on-write filesystems like btrfs or xfs) or
+                    'copy_file_range' (copy within the kernel). If a mode
+                    is not supported for a file, e.g. because the source
+                    is on another filesystem, a plain copy is made.
+                    Files built by PyInstaller itself, like the EXE, are
+                    always copied instead of hard linked: the next build
+                    rewrites them in place.
         """
         from ..config import CONF
         Target.__init__(self)
         self.strip_binaries = kws.get('strip', False)
+        self.incremental = kws.get('incremental', False)
+        self.link_mode = kws.get('link_mode', 'copy')
+        if self.link_mode not in LINK_MODES:
+            raise ValueError("COLLECT: unknown link_mode %r, expected one of %s"
+                             % (self.link_mode, ', '.join(LINK_MODES)))
+        # Directories of the files built by PyInstaller.
+        self.build_dirs = [CONF[key] for key in ('workpath', 'cachedir')
+                           if CONF.get(key)]
 
         if CONF['hasUPX']:
             self.upx_binaries = kws.get('upx', False)
@@ -623,6 +947,8 @@ class COLLECT(Target):
         # The 'name' directory is created in DISTPATH and necessary files are
         # then collected to this directory.
         self.name = os.path.join(CONF['distpath'], os.path.basename(self.name))
+        # Files collected by the last build, used by incremental builds.
+        self.manifestname = os.path.splitext(self.tocfilename)[0] + '.manifest'
 
         self.toc = TOC()
         for arg in args:
@@ -648,14 +974,76 @@ class COLLECT(Target):
 
     def _check_guts(self, data, last_build):
         # COLLECT always needs to be executed, since it will clean the output
-        # directory anyway to make sure there is no existing cruft accumulating
+        # directory anyway to make sure there is no existing cruft accumulating.
+        # In incremental mode `assemble()` itself skips unchanged files.
         return 1
 
     def assemble(self):
-        if _check_path_overlap(self.name) and os.path.isdir(self.name):
-            _rmtree(self.name)
+        # Plan everything first, so nothing in the output directory is
+        # touched if the TOC is not acceptable.
+        plan = self._collect_plan()
+
+        old_files = None
+        if self.incremental:
+            old_files = self._load_manifest()
+        if old_files is None:
+            if _check_path_overlap(self.name) and os.path.isdir(self.name):
+                _rmtree(self.name)
+            old_files = {}
+        else:
+            _check_path_overlap(self.name)
         logger.info("Building COLLECT %s", self.tocbasename)
-        os.makedirs(self.name)
+
+        todirs = set([self.name])
+        for key, inm, fnm, tofnm, typ in plan:
+            todirs.add(os.path.dirname(tofnm))
+        for todir in sorted(todirs):
+            if not os.path.isdir(todir):
+                os.makedirs(todir)
+
+        jobs = [(fnm, tofnm, typ, self._link_mode(fnm), old_files.pop(key, None))
+                for key, inm, fnm, tofnm, typ in plan if typ != 'DEPENDENCY']
+        results = _run_threaded(_collect_file, jobs, _io_workers())
+        # Report errors in TOC order, independent of thread scheduling.
+        errors = [(job, result) for job, result in zip(jobs, results)
+                  if isinstance(result, Exception)]
+        for (fnm, tofnm, typ, link_mode, old), exc in errors:
+            logger.error("Cannot collect %s to %s: %s", fnm, tofnm, exc)
+        if errors:
+            raise errors[0][1]
+
+        new_files = {}
+        copied = 0
+        plan = [entry for entry in plan if entry[4] != 'DEPENDENCY']
+        for (key, inm, fnm, tofnm, typ), (was_copied, src_stat, dst_stat) in zip(plan, results):
+            copied += was_copied
+            new_files[key] = (inm, fnm, src_stat.st_size, src_stat.st_mtime,
+                              dst_stat.st_size, dst_stat.st_mtime)
+
+        # Remove files collected by the previous build which are gone now.
+        for inm in sorted(old[0] for old in old_files.values()):
+            tofnm = os.path.join(self.name, inm)
+            if os.path.isfile(tofnm):
+                logger.debug("Removing stale file %s", tofnm)
+                os.remove(tofnm)
+                _remove_empty_dirs(os.path.dirname(tofnm), self.name)
+
+        if self.incremental:
+            logger.info("COLLECT: %d files copied, %d unchanged, %d removed",
+                        copied, len(new_files) - copied, len(old_files))
+            save_py_data_struct(self.manifestname,
+                                {'name': self.name, 'files': new_files})
+
+    def _collect_plan(self):
+        """
+        Return a list of (key, inm, fnm, tofnm, typ) tuples describing
+        where each file of the TOC goes.
+
+        Binaries are processed (stripped, UPX'ed) here, so the file name
+        `fnm` is the name of the file to copy.
+        """
+        plan = []
+        seen = {}
         toc = add_suffix_to_extensions(self.toc)
         for inm, fnm, typ in toc:
             if not os.path.exists(fnm) or not os.path.isfile(fnm) and is_path_to_egg(fnm):
@@ -665,21 +1053,118 @@ class COLLECT(Target):
                 raise SystemExit('Security-Alert: try to store file outside '
                                  'of dist-directory. Aborting. %r' % inm)
             tofnm = os.path.join(self.name, inm)
-            todir = os.path.dirname(tofnm)
-            if not os.path.exists(todir):
-                os.makedirs(todir)
             if typ in ('EXTENSION', 'BINARY'):
                 fnm = checkCache(fnm, strip=self.strip_binaries,
                                  upx=(self.upx_binaries and (is_win or is_cygwin)),
                                  dist_nm=inm)
-            if typ != 'DEPENDENCY':
-                shutil.copy(fnm, tofnm)
-                try:
-                    shutil.copystat(fnm, tofnm)
-                except OSError:
-                    logger.warn("failed to copy flags of %s", fnm)
-            if typ in ('EXTENSION', 'BINARY'):
+            key = os.path.normcase(inm)
+            if key in seen and typ != 'DEPENDENCY':
+                # The same file in the output directory. The last one wins.
+                plan[seen[key]] = None
+            seen[key] = len(plan)
+            plan.append((key, inm, fnm, tofnm, typ))
+        if any(typ == 'EXECUTABLE' for inm, fnm, typ in toc):
+            # Files of DEPENDENCYs stay in the directory of another app.
+            inm, fnm, typ = write_extension_index(
+                [entry for entry in toc if entry[2] != 'DEPENDENCY'],
+                os.path.splitext(self.tocfilename)[0] + '.extensions')
+            plan.append((os.path.normcase(inm), inm, fnm,
+                         os.path.join(self.name, inm), typ))
+        return [entry for entry in plan if entry is not None]
+
+    def _link_mode(self, fnm):
+        """
+        Return the link mode to collect the file `fnm` with.
+
+        Files built by PyInstaller, like the EXE or the extension index,
+        are rewritten in place by the next build. A hard link to them would
+        be written through, or fail while the collected app is running.
+        """
+        if self.link_mode == 'hardlink':
+            path = os.path.normcase(os.path.abspath(fnm))
+            for build_dir in self.build_dirs:
+                build_dir = os.path.normcase(os.path.abspath(build_dir))
+                if path.startswith(os.path.join(build_dir, '')):
+                    return 'copy'
+        return self.link_mode
+
+    def _load_manifest(self):
+        """
+        Return the files collected into the output directory by the previous
+        build or None if they are not known.
+        """
+        if not os.path.isdir(self.name) or not os.path.exists(self.manifestname):
+            return None
+        try:
+            manifest = load_py_data_struct(self.manifestname)
+        except Exception:
+            logger.info("Rebuilding %s because %s is bad", self.name,
+                        os.path.basename(self.manifestname))
+            return None
+        if manifest.get('name') != self.name:
+            return None
+        return manifest['files']
+
+
+def _collect_file(job):
+    """
+    Put one file into the output directory of COLLECT unless the copy
+    made by the previous build is still up to date.
+
+    Return (copied, source stat, destination stat). Exceptions are
+    returned, not raised, so they can be reported in a defined order.
+    """
+    fnm, tofnm, typ, link_mode, old = job
+    try:
+        src_stat = os.stat(fnm)
+        copied = old is None or not _is_collected_file_unchanged(old, fnm, src_stat, tofnm)
+        if copied:
+            make_executable = typ in ('EXTENSION', 'BINARY') and \
+                src_stat.st_mode & 0o777 != 0o755
+            if make_executable and link_mode == 'hardlink':
+                # A hard link shares its mode with the source file.
+                link_mode = 'copy'
+            link_or_copy(fnm, tofnm, link_mode)
+            if make_executable:
                 os.chmod(tofnm, 0o755)
+        return copied, src_stat, os.stat(tofnm)
+    except Exception as e:
+        return e
+
+
+def _is_collected_file_unchanged(old, fnm, src_stat, tofnm):
+    """
+    Check if the file collected to `tofnm` by the previous build is still
+    an up-to-date copy of `fnm`.
+
+    `old` is the manifest record of the previous build: (inm, fnm, source
+    size, source mtime, destination size, destination mtime).
+    """
+    old_inm, old_fnm, src_size, src_mtime, dst_size, dst_mtime = old
+    try:
+        dst_stat = os.stat(tofnm)
+    except OSError:
+        return False
+    if (dst_stat.st_size, dst_stat.st_mtime) != (dst_size, dst_mtime):
+        # Modified or replaced in the output directory.
+        return False
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if old_fnm == fnm and src_stat.st_mtime == src_mtime:
+        return True
+    # Source file was touched or comes from a different place. Only the
+    # contents matter.
+    return file_digest(fnm) == file_digest(tofnm)
+
+
+def _remove_empty_dirs(path, top):
+    """
+    Remove directory `path` and its parents up to (not including) `top`
+    as long as they are empty.
+    """
+    while os.path.normcase(path) != os.path.normcase(top) and not os.listdir(path):
+        os.rmdir(path)
+        path = os.path.dirname(path)
 
 
 class MERGE(object):
@@ -733,17 +1218,18 @@ class MERGE(object):
         Synchronize the Analysis result with the needed dependencies.
         """
         for toc in (analysis.binaries, analysis.datas):
-            for i, tpl in enumerate(toc):
+            kept = []
+            for tpl in toc:
                 if not tpl[1] in self._dependencies:
                     logger.debug("Adding dependency %s located in %s" % (tpl[1], path))
                     self._dependencies[tpl[1]] = path
+                    kept.append(tpl)
                 else:
                     dep_path = self._get_relative_path(path, self._dependencies[tpl[1]])
                     logger.debug("Referencing %s to be a dependecy for %s, located in %s" % (tpl[1], path, dep_path))
                     analysis.dependencies.append((":".join((dep_path, tpl[0])), tpl[1], "DEPENDENCY"))
-                    toc[i] = (None, None, None)
-            # Clean the list
-            toc[:] = [tpl for tpl in toc if tpl != (None, None, None)]
+            # Remove the referenced files from the list in one go.
+            toc[:] = kept
 
     # TODO move this function to PyInstaller.compat module (probably improve
     #      function compat.relpath()
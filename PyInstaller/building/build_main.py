@@ -16,8 +16,10 @@ NOTE: All global variables, classes and imported modules create API
 """
 
 
+import copy
 import glob
 import os
+import time
 import pprint
 import shutil
 import sys
@@ -32,11 +34,12 @@ from ..compat import is_py2, is_win, PYDYLIB_NAMES, VALID_MODULE_TYPES
 from ..depend import bindepend
 from ..depend.analysis import initialize_modgraph
 from .api import PYZ, EXE, COLLECT, MERGE
-from .datastruct import TOC, Target, Tree, _check_guts_eq
+from .datastruct import TOC, Target, Tree, DeferredAssembly, _check_guts_eq
 from .imphook import AdditionalFilesCache, ModuleHookCache
 from .osx import BUNDLE
 from .toc_conversion import DependencyProcessor
-from .utils import _check_guts_toc_mtime, format_binaries_and_datas
+from .utils import _check_guts_toc_mtime, format_binaries_and_datas, \
+    strip_paths_in_code
 from ..depend.utils import create_py3_base_library, scan_code_for_ctypes
 from ..archive import pyz_crypto
 from ..utils.misc import get_path_to_toplevel_modules, get_unicode_modules, mtime
@@ -223,6 +226,10 @@ class Analysis(Target):
             for name, pth in format_binaries_and_datas(datas, workingdir=spec_dir):
                 self.binaries.append((name, pth, 'DATA'))
 
+        # Set by `--watch` to collect the paths to wait for changes of.
+        if CONF.get('watch_paths') is not None:
+            CONF['watch_paths'].update(self._watch_paths())
+
     _GUTS = (# input parameters
             ('inputs', _check_guts_eq),  # parameter `scripts`
             ('pathex', _check_guts_eq),
@@ -249,6 +256,30 @@ class Analysis(Target):
             ('binding_redirects', None),
             )
 
+    def _watch_paths(self):
+        """
+        Return the files and directories to watch for changes: the scripts,
+        all files found in `pathex` and the directories of `pathex`,
+        `hookspath` (including the directories of its pre_* hooks) and the
+        packages found there, where modules may be added.
+        """
+        paths = set(self.inputs)
+        paths.update(self.pathex)
+        for hook_dir in self.hookspath or []:
+            hook_dir = absnormpath(hook_dir)
+            paths.add(hook_dir)
+            for subdir in ('pre_safe_import_module', 'pre_find_module_path'):
+                if os.path.isdir(os.path.join(hook_dir, subdir)):
+                    paths.add(os.path.join(hook_dir, subdir))
+        prefixes = tuple(os.path.join(p, '') for p in self.pathex)
+        for toc in (self.pure, self.binaries, self.datas):
+            for inm, fnm, typ in toc:
+                if fnm and absnormpath(fnm).startswith(prefixes):
+                    paths.add(absnormpath(fnm))
+                    if typ == 'PYMODULE':
+                        paths.add(os.path.dirname(absnormpath(fnm)))
+        return paths
+
     def _extend_pathex(self, spec_pathex, scripts):
         """
         Normalize additional paths where PyInstaller will look for modules and
@@ -310,6 +341,16 @@ class Analysis(Target):
         if 'tests_modgraph' in CONF and not self.excludes:
             logger.info('Reusing basic module graph object.')
             self.graph = CONF['tests_modgraph']
+        elif 'modgraph_cache' in CONF:
+            # `--watch` keeps the basic module graph, including the hooks
+            # it has loaded, between builds.
+            key = (tuple(self.excludes), tuple(self.hookspath or ()))
+            if key in CONF['modgraph_cache']:
+                logger.info('Reusing basic module graph object.')
+            else:
+                CONF['modgraph_cache'][key] = initialize_modgraph(
+                    excludes=self.excludes, user_hook_dirs=self.hookspath)
+            self.graph = copy.deepcopy(CONF['modgraph_cache'][key])
         else:
             for m in self.excludes:
                 logger.debug("Excluding module '%s'" % m)
@@ -525,8 +566,11 @@ class Analysis(Target):
         assert len(self.pure) == 0
         self.pure = self.graph.make_pure_toc()
         # And get references to module code objects constructed by ModuleGraph
-        # to avoid writing .pyc/pyo files to hdd.
-        self.pure._code_cache = self.graph.get_code_objects()
+        # to avoid writing .pyc/pyo files to hdd. Remove leading parts of
+        # paths in them once for all PYZ using them.
+        self.pure._code_cache = dict(
+            (name, strip_paths_in_code(code))
+            for name, code in self.graph.get_code_objects().items())
 
         # Add remaining binary dependencies - analyze Python C-extensions and what
         # DLLs they depend on.
@@ -731,7 +775,88 @@ def build(spec, distpath, workpath, clean_build):
     # Executing the specfile.
     with open(spec, 'r') as f:
         text = f.read()
-    exec(text, spec_namespace)
+    # Deferring the assembly breaks spec files working with the built
+    # targets, so it is only done on request.
+    jobs = CONF.get('jobs') or 1
+    if jobs > 1:
+        # Assemble the targets once the spec file is executed, independent
+        # ones in parallel.
+        with DeferredAssembly(jobs) as deferred:
+            exec(text, spec_namespace)
+        deferred.run()
+    else:
+        exec(text, spec_namespace)
+
+
+def _reset_target_counters(cls=Target):
+    # Targets count their instances to name their .toc files. Every build
+    # has to start from zero to find the files of the previous one.
+    for subclass in cls.__subclasses__():
+        subclass.invcnum = 0
+        _reset_target_counters(subclass)
+
+
+def _drop_stale_modgraphs(modgraph_cache, changed):
+    """
+    Remove the basic module graphs from `modgraph_cache` whose `hookspath`
+    contains one of the `changed` paths. The graph keeps the pre_* hooks
+    found there when it was created.
+    """
+    changed = [os.path.join(path, '') for path in changed]
+    for key in list(modgraph_cache):
+        hook_dirs = tuple(os.path.join(absnormpath(p), '') for p in key[1])
+        if hook_dirs and any(path.startswith(hook_dirs) for path in changed):
+            del modgraph_cache[key]
+
+
+def build_watching(spec, distpath, workpath, clean_build):
+    """
+    Build the executable according to the SPEC file, then build it again
+    whenever the spec file, the scripts or the modules and hooks found in
+    `pathex` and `hookspath` change.
+
+    This process stays resident, keeping the basic module graph, the .toc
+    files and the binary cache index in memory. As usual, only targets
+    whose input changed are rebuilt.
+    """
+    from ..config import CONF
+    from .watch import changed_since, create_watcher
+
+    CONF['modgraph_cache'] = {}
+    while True:
+        started = time.time()
+        CONF['watch_paths'] = set([absnormpath(spec)])
+        _reset_target_counters()
+        try:
+            build(spec, distpath, workpath, clean_build)
+        except SystemExit as e:
+            logger.error('Build failed: %s', e)
+        except Exception:
+            logger.exception('Build failed')
+        else:
+            logger.info('Build complete')
+        # Clean the cache only once.
+        clean_build = False
+
+        # Ignore files written by the build itself, like the module with
+        # the key for encrypting bytecode.
+        outputs = tuple(os.path.join(absnormpath(CONF[key]), '')
+                        for key in ('workpath', 'distpath') if key in CONF)
+        paths = set(p for p in CONF['watch_paths']
+                    if not os.path.join(p, '').startswith(outputs))
+        watcher = create_watcher(paths)
+        try:
+            # Changes while building are missed by the watcher.
+            changed = changed_since(paths, started)
+            if not changed:
+                logger.info('Watching %d files and directories for changes. '
+                            'Press Ctrl+C to stop.', len(paths))
+                changed = watcher.wait()
+        finally:
+            watcher.close()
+        logger.info('Rebuilding because of changes in:\n%s',
+                    pprint.pformat(changed))
+        _drop_stale_modgraphs(CONF['modgraph_cache'], changed)
 
 
 def __add_options(parser):
@@ -756,6 +881,17 @@ def __add_options(parser):
                         default=False,
                         help='Clean PyInstaller cache and remove temporary '
                         'files before building.')
+    parser.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                        help='Build up to N targets of the spec file (PYZ, '
+                        'EXE, COLLECT, ...) in parallel, after executing the '
+                        'spec file. Only use this if the spec file does not '
+                        'use the built files (default: 1, build each target '
+                        'while executing the spec file)')
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='After building, stay running and build again '
+                        'whenever the spec file, the scripts or the modules '
+                        'in their paths or hooks paths change. Stop with '
+                        'Ctrl+C.')
 
 
 def main(pyi_config, specfile, noconfirm, ascii=False, **kw):
@@ -784,5 +920,10 @@ def main(pyi_config, specfile, noconfirm, ascii=False, **kw):
 
     CONF['ui_admin'] = kw.get('ui_admin', False)
     CONF['ui_access'] = kw.get('ui_uiaccess', False)
+    CONF['jobs'] = kw.get('jobs')
 
-    build(specfile, kw.get('distpath'), kw.get('workpath'), kw.get('clean_build'))
+    if kw.get('watch'):
+        build_watching(specfile, kw.get('distpath'), kw.get('workpath'),
+                       kw.get('clean_build'))
+    else:
+        build(specfile, kw.get('distpath'), kw.get('workpath'), kw.get('clean_build'))
@@ -9,13 +9,14 @@
 
 
 import os
+import threading
 
 from PyInstaller.utils import misc
 from PyInstaller.utils.misc import load_py_data_struct, save_py_data_struct
 from .. import log as logging
+from ..compat import is_py2
 from .utils import _check_guts_eq
 
-from collections import MutableSet
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +40,16 @@ def unique_name(entry):
     return name
 
 
+def _checked_unique_name(entry):
+    """
+    Return the unique name of `entry`, raise TypeError if it is no TOC entry.
+    """
+    if not isinstance(entry, tuple):
+        logger.info("TOC found a %s, not a tuple", entry)
+        raise TypeError("Expected tuple, not %s." % type(entry).__name__)
+    return unique_name(entry)
+
+
 class TOC(list):
     # TODO Simplify the representation and use directly Modulegraph objects.
     """
@@ -57,35 +68,76 @@ class TOC(list):
 
     A TOC contains various types of files. A TOC contains no duplicates and preserves order.
     PyInstaller uses TOC data type to collect necessary files bundle them into an executable.
+
+    Besides the list of entries a TOC keeps an index mapping every entry to
+    its unique name (see `unique_name()`). The index makes checks for
+    duplicates and membership tests O(1) and lets TOCs combined with other
+    TOCs reuse the already normalized names instead of computing them again.
+
+    Like `append()` and `extend()`, `+=` skips entries whose unique name is
+    already in the TOC. Assigning an entry whose unique name another entry
+    has raises ValueError.
     """
     def __init__(self, initlist=None):
-        super(TOC, self).__init__(self)
+        super(TOC, self).__init__()
+        # Unique names of all entries.
         self.filenames = set()
+        # Cache of unique names: entry -> unique_name(entry).
+        self._uniques = {}
         if initlist:
-            for entry in initlist:
-                self.append(entry)
+            self.extend(initlist)
 
-    def append(self, entry):
-        if not isinstance(entry, tuple):
-            logger.info("TOC found a %s, not a tuple", entry)
-            raise TypeError("Expected tuple, not %s." % type(entry).__name__)
+    @classmethod
+    def _from_entries(cls, entries, uniques):
+        """
+        Create a TOC from entries which are already known to be unique.
+
+        `uniques` maps every entry to its unique name.
+        """
+        result = cls()
+        list.extend(result, entries)
+        result._uniques = dict((entry, uniques[entry]) for entry in entries)
+        result.filenames = set(result._uniques.values())
+        return result
+
+    def _pairs(self, other):
+        """
+        Yield (entry, unique name) pairs for all entries in `other`.
+
+        For TOCs the cached unique names are reused.
+        """
+        if isinstance(other, TOC):
+            uniques = other._uniques
+            for entry in other:
+                yield entry, uniques[entry]
+        else:
+            for entry in other:
+                yield entry, _checked_unique_name(entry)
 
-        unique = unique_name(entry)
+
+    def append(self, entry):
+        unique = _checked_unique_name(entry)
 
         if unique not in self.filenames:
             self.filenames.add(unique)
+            self._uniques[entry] = unique
             super(TOC, self).append(entry)
 
     def insert(self, pos, entry):
-        if not isinstance(entry, tuple):
-            logger.info("TOC found a %s, not a tuple", entry)
-            raise TypeError("Expected tuple, not %s." % type(entry).__name__)
-        unique = unique_name(entry)
+        unique = _checked_unique_name(entry)
 
         if unique not in self.filenames:
             self.filenames.add(unique)
+            self._uniques[entry] = unique
             super(TOC, self).insert(pos, entry)
 
+    def __contains__(self, entry):
+        try:
+            return entry in self._uniques
+        except TypeError:
+            # Unhashable objects are never part of a TOC.
+            return False
+
     def __add__(self, other):
         result = TOC(self)
         result.extend(other)
@@ -96,30 +148,98 @@ class TOC(list):
         result.extend(self)
         return result
 
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
     def extend(self, other):
-        # TODO: look if this can be done more efficient with out the
-        # loop, e.g. by not using a list as base at all
-        for entry in other:
-            self.append(entry)
+        filenames = self.filenames
+        uniques = self._uniques
+        new_entries = []
+        for entry, unique in self._pairs(other):
+            if unique not in filenames:
+                filenames.add(unique)
+                uniques[entry] = unique
+                new_entries.append(entry)
+        super(TOC, self).extend(new_entries)
 
     def __sub__(self, other):
-        other = TOC(other)
-        filenames = self.filenames - other.filenames
-        result = TOC()
-        for entry in self:
-            unique = unique_name(entry)
-
-            if unique in filenames:
-                super(TOC, result).append(entry)
-        return result
+        if isinstance(other, TOC):
+            other_filenames = other.filenames
+        else:
+            other_filenames = set(unique for entry, unique in self._pairs(other))
+        uniques = self._uniques
+        return TOC._from_entries(
+            [entry for entry in self if uniques[entry] not in other_filenames],
+            uniques)
 
     def __rsub__(self, other):
         result = TOC(other)
         return result.__sub__(self)
 
+    # Methods changing the list in place have to keep the index in sync.
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            self._set_slice(key, value)
+            return
+        old = list.__getitem__(self, key)
+        old_unique = self._uniques[old]
+        unique = _checked_unique_name(value)
+        if unique != old_unique and unique in self.filenames:
+            raise ValueError("TOC already contains an entry named %r" % unique)
+        super(TOC, self).__setitem__(key, value)
+        del self._uniques[old]
+        self.filenames.discard(old_unique)
+        self._uniques[value] = unique
+        self.filenames.add(unique)
+
+    def _set_slice(self, key, entries):
+        entries = list(entries)
+        # Check the result before changing anything.
+        result = list(self)
+        result[key] = entries
+        uniques = dict(self._pairs(entries))
+        uniques.update((entry, self._uniques[entry]) for entry in result
+                       if entry not in uniques)
+        filenames = set(uniques[entry] for entry in result)
+        if len(filenames) != len(result):
+            raise ValueError("TOC entries with the same name assigned")
+        super(TOC, self).__setitem__(key, entries)
+        self._uniques = dict((entry, uniques[entry]) for entry in result)
+        self.filenames = filenames
+
+    def __delitem__(self, key):
+        removed = list.__getitem__(self, key)
+        super(TOC, self).__delitem__(key)
+        if not isinstance(key, slice):
+            removed = [removed]
+        for entry in removed:
+            self.filenames.discard(self._uniques.pop(entry))
+
+    if is_py2:
+        # Python 2 uses these for simple slices like `toc[:] = ...`.
+        def __setslice__(self, i, j, sequence):
+            self.__setitem__(slice(max(0, i), max(0, j)), sequence)
+
+        def __delslice__(self, i, j):
+            self.__delitem__(slice(max(0, i), max(0, j)))
+
+    def remove(self, entry):
+        super(TOC, self).remove(entry)
+        self.filenames.discard(self._uniques.pop(entry))
+
+    def pop(self, *args):
+        entry = super(TOC, self).pop(*args)
+        self.filenames.discard(self._uniques.pop(entry))
+        return entry
+
 
 class Target(object):
     invcnum = 0
+    # Targets whose results are not used by the spec file itself can have
+    # their assembly deferred, see `DeferredAssembly`.
+    _deferrable = False
 
     def __init__(self):
         from ..config import CONF
@@ -143,23 +263,33 @@ class Target(object):
         required and in case calls `assemble()`
         """
         logger.info("checking %s", self.__class__.__name__)
+        deferred = _deferred_assembly if self._deferrable else None
+        # Deferred targets this one consumes the output of. Their output
+        # is still the one of the last build, so checking it is pointless.
+        requires = deferred.requires(self) if deferred else []
         data = None
         last_build = misc.mtime(self.tocfilename)
-        if last_build == 0:
+        if requires:
+            logger.info("Building %s because it depends on targets to be "
+                        "built", self.tocbasename)
+        elif last_build == 0:
             logger.info("Building %s because %s is non existent",
                         self.__class__.__name__, self.tocbasename)
         else:
             try:
-                data = load_py_data_struct(self.tocfilename)
+                data = _load_guts(self.tocfilename)
             except:
                 logger.info("Building because %s is bad", self.tocbasename)
             else:
                 # create a dict for easier access
                 data = dict(zip((g[0] for g in self._GUTS), data))
         # assemble if previous data was not found or is outdated
-        if not data or self._check_guts(data, last_build):
-            self.assemble()
-            self._save_guts()
+        if requires or not data or self._check_guts(data, last_build):
+            if deferred:
+                deferred.add(self, requires)
+            else:
+                self.assemble()
+                self._save_guts()
 
     _GUTS = []
 
@@ -185,6 +315,178 @@ class Target(object):
         """
         data = tuple(getattr(self, g[0]) for g in self._GUTS)
         save_py_data_struct(self.tocfilename, data)
+        _guts_cache.pop(self.tocfilename, None)
+
+    def _input_files(self):
+        """
+        Return the filenames this target reads when assembled.
+        """
+        return [fnm for inm, fnm, typ in getattr(self, 'toc', [])]
+
+
+# Data of the .toc files read by this process and the modification time
+# and size of the files when read. Repeated builds in one process, like
+# with `--watch`, only read changed files again.
+_guts_cache = {}
+
+
+def _load_guts(filename):
+    st = os.stat(filename)
+    key = (st.st_mtime, st.st_size)
+    cached = _guts_cache.get(filename)
+    if cached is None or cached[0] != key:
+        cached = _guts_cache[filename] = (key, load_py_data_struct(filename))
+    return cached[1]
+
+
+# The `DeferredAssembly` in effect while executing a spec file.
+_deferred_assembly = None
+
+
+class DeferredAssembly(object):
+    """
+    Assemble the targets of a spec file concurrently.
+
+    While used as context manager, targets needing a rebuild are queued
+    instead of being assembled right away. `run()` then assembles up to
+    `workers` targets at a time, each one once the targets producing its
+    input files are done. Log records of the targets are held back and
+    emitted in the order the targets were defined, so the log reads like
+    the one of a serial build.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.targets = []
+        self.dependencies = []
+        # Index of the queued target producing a file.
+        self._producers = {}
+
+    def __enter__(self):
+        global _deferred_assembly
+        _deferred_assembly = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _deferred_assembly
+        _deferred_assembly = None
+
+    def requires(self, target):
+        """
+        Return the indexes of the queued targets producing input files of
+        `target`.
+        """
+        producers = self._producers
+        return sorted(set(producers[fnm] for fnm in target._input_files()
+                          if fnm in producers))
+
+    def add(self, target, requires):
+        self._producers[target.name] = len(self.targets)
+        self.targets.append(target)
+        self.dependencies.append(requires)
+
+    def run(self):
+        """
+        Assemble the queued targets.
+
+        If assembling a target fails, no further targets are started and
+        the exception of the first failed target is raised once the running
+        ones are done.
+        """
+        count = len(self.targets)
+        if not count:
+            return
+        from multiprocessing.pool import ThreadPool
+        # None for waiting targets, True for running ones and a tuple of
+        # log records and exception for finished ones.
+        states = [None] * count
+        condition = threading.Condition()
+        capture = _LogCapture()
+        handlers = logging.getLogger().handlers
+        for handler in handlers:
+            handler.addFilter(capture)
+
+        def assemble(index):
+            target = self.targets[index]
+            error = None
+            capture.start()
+            try:
+                target.assemble()
+                target._save_guts()
+            except BaseException as e:
+                error = e
+            records = capture.stop()
+            with condition:
+                states[index] = (records, error)
+                condition.notify()
+
+        def finished(index):
+            return isinstance(states[index], tuple)
+
+        def failed(index):
+            return finished(index) and states[index][1] is not None
+
+        pool = ThreadPool(min(self.workers, count))
+        emitted = 0
+        try:
+            with condition:
+                while True:
+                    if not any(failed(i) for i in range(count)):
+                        for index in range(count):
+                            if states[index] is None and all(
+                                    finished(i) for i in self.dependencies[index]):
+                                states[index] = True
+                                pool.apply_async(assemble, (index,))
+                    if True not in states:
+                        break
+                    condition.wait()
+                    # Log in spec order, as far as targets are finished.
+                    while emitted < count and finished(emitted):
+                        _emit(handlers, states[emitted][0])
+                        emitted += 1
+        finally:
+            pool.close()
+            pool.join()
+            for handler in handlers:
+                handler.removeFilter(capture)
+        for index in range(emitted, count):
+            if finished(index):
+                _emit(handlers, states[index][0])
+        for index in range(count):
+            if failed(index):
+                raise states[index][1]
+
+
+class _LogCapture(object):
+    """
+    Log filter holding back the records logged by threads between `start()`
+    and `stop()`.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.records = []
+
+    def stop(self):
+        records = self._local.records
+        self._local.records = None
+        return records
+
+    def filter(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return True
+        # The filter is called by every handler.
+        if not records or records[-1] is not record:
+            records.append(record)
+        return False
+
+
+def _emit(handlers, records):
+    for record in records:
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
 
 
 class Tree(Target, TOC):
@@ -17,6 +17,8 @@ from .utils import _check_path_overlap, _rmtree, add_suffix_to_extensions, check
 
 
 class BUNDLE(Target):
+    _deferrable = True
+
     def __init__(self, *args, **kws):
         from ..config import CONF
 
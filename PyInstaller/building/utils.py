@@ -12,14 +12,17 @@
 #--- functions for checking guts ---
 # NOTE: By GUTS it is meant intermediate files and data structures that
 # PyInstaller creates for bundling files and creating final executable.
+import errno
 import glob
 import hashlib
+import marshal
 import os
 import os.path
 import pkgutil
 import platform
 import shutil
 import sys
+import threading
 
 from PyInstaller.config import CONF
 from .. import compat
@@ -110,6 +113,77 @@ def add_suffix_to_extensions(toc):
         new_toc.append((inm, fnm, typ))
     return new_toc
 
+# Name of the index of the C extension modules in the directory of the
+# app, see pyimod03_importers.CExtensionImporter.
+EXTENSION_INDEX_NAME = 'pyi-extension-index'
+
+def extension_index(toc):
+    """
+    Return the index of the C extension modules of an app with the files
+    in TOC: a dict mapping module names to the names of the files in the
+    top directory of the app which the modules are loaded from.
+
+    Like CExtensionImporter does without an index, any file there whose
+    name ends with an extension suffix counts, whatever its type in TOC.
+    """
+    index = {}
+    names = []
+    for inm, fnm, typ in add_suffix_to_extensions(toc):
+        if typ == 'DEPENDENCY':
+            # Extracted from another executable of a MERGE.
+            inm = inm.split(':', 1)[-1]
+        elif typ not in ('EXTENSION', 'BINARY', 'DATA'):
+            continue
+        if os.sep not in inm and '/' not in inm:
+            names.append(inm)
+    # Earlier suffixes win, like when probing them in this order.
+    for ext in reversed(EXTENSION_SUFFIXES):
+        for name in names:
+            if name.endswith(ext):
+                index[name[:-len(ext)]] = name
+    return index
+
+def write_extension_index(toc, filename):
+    """
+    Write the index of the C extension modules of an app with the files in
+    TOC to FILENAME, and return the TOC entry for putting it into the app.
+    """
+    with open(filename, 'wb') as fh:
+        marshal.dump(extension_index(toc), fh)
+    return (EXTENSION_INDEX_NAME, filename, 'DATA')
+
+def load_import_order(filename):
+    """
+    Return the entry names in the import order file FILENAME, written by
+    an app run with the environment variable PYINSTALLER_IMPORT_ORDER.
+
+    A missing file is not an error, it is only there after the app built
+    without it has run.
+    """
+    try:
+        with open(filename) as fp:
+            names = [line.strip() for line in fp]
+    except (IOError, OSError) as e:
+        logger.warning('Cannot read import order file %s: %s', filename, e)
+        return []
+    return [name for name in names if name and not name.startswith('#')]
+
+
+def sort_by_import_order(entries, order, key=None):
+    """
+    Return ENTRIES with the ones named in the import order ORDER first, in
+    that order, followed by the others sorted by KEY to support
+    reproducible builds. The name of an entry is its first item.
+    """
+    positions = {}
+    for name in order:
+        positions.setdefault(name, len(positions))
+    ordered = sorted((e for e in entries if e[0] in positions),
+                     key=lambda e: positions[e[0]])
+    others = sorted((e for e in entries if e[0] not in positions), key=key)
+    return ordered + others
+
+
 def applyRedirects(manifest, redirects):
     """
     Apply the binding redirects specified by 'redirects' to the dependent assemblies
@@ -129,6 +203,34 @@ def applyRedirects(manifest, redirects):
                             binding.name, dep.version, binding.newVersion)
                 dep.version = binding.newVersion
 
+# Targets of a spec file may be assembled in parallel and share the cache
+# directories and their index.
+_cache_lock = threading.RLock()
+
+
+# Cache indexes read or written by this process, with the modification
+# time and size of the index file at that time.
+_cache_indexes = {}
+
+
+def _load_cache_index(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return {}
+    key = (st.st_mtime, st.st_size)
+    cached = _cache_indexes.get(filename)
+    if cached is None or cached[0] != key:
+        cached = _cache_indexes[filename] = (key, load_py_data_struct(filename))
+    return cached[1]
+
+
+def _save_cache_index(filename, cache_index):
+    save_py_data_struct(filename, cache_index)
+    st = os.stat(filename)
+    _cache_indexes[filename] = ((st.st_mtime, st.st_size), cache_index)
+
+
 def checkCache(fnm, strip=False, upx=False, dist_nm=None):
     """
     Cache prevents preprocessing binary files again and again.
@@ -137,6 +239,11 @@ def checkCache(fnm, strip=False, upx=False, dist_nm=None):
                to determine level of paths for @loader_path like
                '@loader_path/../../' for qt4 plugins.
     """
+    with _cache_lock:
+        return _checkCache(fnm, strip, upx, dist_nm)
+
+
+def _checkCache(fnm, strip, upx, dist_nm):
     from ..config import CONF
     # On darwin a cache is required anyway to keep the libaries
     # with relative install names. Caching on darwin does not work
@@ -169,10 +276,7 @@ def checkCache(fnm, strip=False, upx=False, dist_nm=None):
     if not os.path.exists(cachedir):
         os.makedirs(cachedir)
     cacheindexfn = os.path.join(cachedir, "index.dat")
-    if os.path.exists(cacheindexfn):
-        cache_index = load_py_data_struct(cacheindexfn)
-    else:
-        cache_index = {}
+    cache_index = _load_cache_index(cacheindexfn)
 
     # Verify if the file we're looking for is present in the cache.
     # Use the dist_mn if given to avoid different extension modules
@@ -320,7 +424,7 @@ def checkCache(fnm, strip=False, upx=False, dist_nm=None):
 
     # update cache index
     cache_index[basenm] = digest
-    save_py_data_struct(cacheindexfn, cache_index)
+    _save_cache_index(cacheindexfn, cache_index)
 
     # On Mac OS X we need relative paths to dll dependencies
     # starting with @executable_path
@@ -338,6 +442,243 @@ def cacheDigest(fnm, redirects):
     return digest
 
 
+def file_digest(fnm, blocksize=1024*1024):
+    """
+    Return the MD5 digest of the contents of file `fnm`.
+
+    The file is read in blocks, so this works for large files, too.
+    """
+    hasher = hashlib.md5()
+    with open(fnm, 'rb') as fh:
+        while True:
+            block = fh.read(blocksize)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.digest()
+
+
+# Ways how `link_or_copy()` can put a file into the output directory.
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'copy_file_range')
+
+# Linux ioctl request to share the data blocks of two files (btrfs, xfs, ...).
+_FICLONE = 0x40049409
+
+# Link modes known to fail for a pair of devices: (link_mode, src dev, dst dev).
+_unsupported_link_modes = set()
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, 'rb') as infh:
+        with open(dst, 'wb') as outfh:
+            fcntl.ioctl(outfh.fileno(), _FICLONE, infh.fileno())
+
+
+def _kernel_copy_function():
+    """
+    Return a function (infd, outfd, count) copying data between files within
+    the kernel, or None if there is none.
+    """
+    # os.copy_file_range() is available in Python 3.8+. Older versions can
+    # copy file to file in the kernel with os.sendfile() on Linux.
+    copy_range = getattr(os, 'copy_file_range', None)
+    if copy_range is None and compat.is_linux and hasattr(os, 'sendfile'):
+        copy_range = lambda infd, outfd, count: os.sendfile(outfd, infd, None, count)
+    return copy_range
+
+
+# Errors telling that the kernel can not copy between the given files.
+_KERNEL_COPY_ERRNOS = set(getattr(errno, name) for name in
+                          ('ENOSYS', 'EXDEV', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP',
+                           'EBADF', 'ETXTBSY')
+                          if hasattr(errno, name))
+
+# Size of the buffer used to copy file data in Python.
+COPY_BUFSIZE = 1024 * 1024
+
+
+def copy_file_data(infh, outfh, length=None):
+    """
+    Copy `length` bytes (default: all remaining data) from the current
+    position of the binary file object `infh` to the current position of
+    the binary file object `outfh`.
+
+    The data is copied within the kernel (copy_file_range() or sendfile())
+    where possible, without passing it through Python, and in large chunks
+    otherwise. Return the number of bytes copied.
+    """
+    outfh.flush()
+    infd, outfd = infh.fileno(), outfh.fileno()
+    in_pos, out_pos = infh.tell(), outfh.tell()
+    if length is None:
+        length = max(os.fstat(infd).st_size - in_pos, 0)
+    copied = 0
+    copy_range = _kernel_copy_function()
+    if copy_range is not None:
+        # The file objects may have read ahead, the kernel copies from and
+        # to the positions of the file descriptors. Restore these afterwards,
+        # the file objects rely on them.
+        in_raw_pos = os.lseek(infd, 0, os.SEEK_CUR)
+        out_raw_pos = os.lseek(outfd, 0, os.SEEK_CUR)
+        os.lseek(infd, in_pos, os.SEEK_SET)
+        os.lseek(outfd, out_pos, os.SEEK_SET)
+        try:
+            while copied < length:
+                sent = copy_range(infd, outfd, min(length - copied, 1024*1024*1024))
+                if not sent:
+                    break
+                copied += sent
+        except OSError as e:
+            if e.errno not in _KERNEL_COPY_ERRNOS:
+                raise
+            # Copy the rest in Python.
+        finally:
+            os.lseek(infd, in_raw_pos, os.SEEK_SET)
+            os.lseek(outfd, out_raw_pos, os.SEEK_SET)
+    infh.seek(in_pos + copied)
+    outfh.seek(out_pos + copied)
+    while copied < length:
+        buf = infh.read(min(COPY_BUFSIZE, length - copied))
+        if not buf:
+            break
+        outfh.write(buf)
+        copied += len(buf)
+    return copied
+
+
+def _copy_file_range(src, dst):
+    copy_range = _kernel_copy_function()
+    if copy_range is None:
+        raise OSError(errno.ENOSYS, 'copy_file_range not available')
+    with open(src, 'rb') as infh:
+        with open(dst, 'wb') as outfh:
+            infd, outfd = infh.fileno(), outfh.fileno()
+            remaining = os.fstat(infd).st_size
+            while remaining > 0:
+                sent = copy_range(infd, outfd, min(remaining, 1024*1024*1024))
+                if sent == 0:
+                    break
+                remaining -= sent
+
+
+_LINK_FUNCTIONS = {
+    'hardlink': _hardlink,
+    'reflink': _reflink,
+    'copy_file_range': _copy_file_range,
+}
+
+# Modes to try if a link mode is not supported.
+_LINK_FALLBACKS = {
+    'hardlink': ['copy'],
+    'reflink': ['copy_file_range', 'copy'],
+    'copy_file_range': ['copy'],
+    'copy': [],
+}
+
+
+def link_or_copy(src, dst, link_mode='copy'):
+    """
+    Put the file `src` to `dst` using `link_mode` (see LINK_MODES).
+
+    If the link mode is not supported for `src` and `dst` (e.g. they are
+    on different filesystems) fall back to a cheaper mode and finally to
+    a plain copy. An existing `dst` is removed first, so a file linked
+    by a previous build is never written through.
+
+    Return the link mode actually used.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link_mode != 'copy':
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(dst)).st_dev)
+    for mode in [link_mode] + _LINK_FALLBACKS[link_mode]:
+        if mode == 'copy':
+            break
+        if (mode, ) + devices in _unsupported_link_modes:
+            continue
+        if mode == 'hardlink' and devices[0] != devices[1]:
+            continue
+        try:
+            _LINK_FUNCTIONS[mode](src, dst)
+        except (OSError, IOError, ImportError, AttributeError) as e:
+            logger.debug("Cannot %s %s: %s", mode, src, e)
+            _unsupported_link_modes.add((mode, ) + devices)
+            if os.path.lexists(dst):
+                os.remove(dst)
+            continue
+        if mode != 'hardlink':
+            _copystat(src, dst)
+        return mode
+    shutil.copy(src, dst)
+    _copystat(src, dst)
+    return 'copy'
+
+
+def _copystat(src, dst):
+    try:
+        shutil.copystat(src, dst)
+    except OSError:
+        logger.warn("failed to copy flags of %s", src)
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def _io_workers():
+    """
+    Number of threads to use for I/O bound jobs like copying files.
+    """
+    return min(32, _cpu_count() + 4)
+
+
+def _cpu_workers():
+    """
+    Number of threads to use for jobs spending their time in C code that
+    releases the GIL, like zlib compression.
+    """
+    return _cpu_count()
+
+
+def _run_threaded(func, jobs, workers):
+    """
+    Call `func` for every item of `jobs` in a pool of `workers` threads.
+
+    Return the list of results in the order of `jobs`. If calls raised
+    exceptions, the one of the first job in `jobs` is raised once all
+    jobs are done.
+    """
+    if len(jobs) < 2 or workers < 2:
+        return [func(job) for job in jobs]
+
+    def call(job):
+        try:
+            return True, func(job)
+        except Exception as e:
+            return False, e
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(jobs)))
+    try:
+        results = pool.map(call, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    for success, value in results:
+        if not success:
+            raise value
+    return [value for success, value in results]
+
+
 def _check_path_overlap(path):
     """
     Check that path does not overlap with WORKPATH or SPECPATH (i.e.
@@ -545,6 +886,24 @@ def _load_code(modname, filename):
             source = f.read()
         return compile(source, filename, 'exec')
 
+# (modname, filename, mtime) -> path stripped code object of the scripts
+# compiled in this build, shared by all targets.
+_script_code_cache = {}
+
+
+def get_stripped_code_object(modname, filename):
+    """
+    Get the code object for a script with the paths stripped (see
+    strip_paths_in_code()), compiled only once per build.
+    """
+    key = (modname, filename, os.path.getmtime(filename))
+    code = _script_code_cache.get(key)
+    if code is None:
+        code = strip_paths_in_code(get_code_object(modname, filename))
+        _script_code_cache[key] = code
+    return code
+
+
 def get_code_object(modname, filename):
     """
     Get the code-object for a module.
@@ -575,21 +934,48 @@ def get_code_object(modname, filename):
         raise
 
 
-def strip_paths_in_code(co, new_filename=None):
+# (path entries, prefixes) of the last call to _path_prefixes().
+_path_prefixes_cache = [None, None]
 
-    # Paths to remove from filenames embedded in code objects
-    replace_paths = sys.path + CONF['pathex']
-    # Make sure paths end with os.sep
-    replace_paths = [os.path.join(f, '') for f in replace_paths]
 
-    if new_filename is None:
-        original_filename = os.path.normpath(co.co_filename)
-        for f in replace_paths:
-            if original_filename.startswith(f):
-                new_filename = original_filename[len(f):]
-                break
+def _path_prefixes():
+    """
+    Return the set of paths to remove from filenames embedded in code
+    objects: sys.path and pathex.
+    """
+    paths = tuple(sys.path) + tuple(CONF['pathex'])
+    if _path_prefixes_cache[0] != paths:
+        prefixes = frozenset(os.path.normpath(p) for p in paths if p)
+        _path_prefixes_cache[:] = [paths, prefixes]
+    return _path_prefixes_cache[1]
 
-        else:
+
+def _strip_path_prefix(filename):
+    """
+    Return FILENAME relative to the longest of the paths to remove it
+    starts with, or None if there is none.
+
+    Looking up each parent directory of the file in a set costs the depth
+    of the file instead of the number of paths.
+    """
+    prefixes = _path_prefixes()
+    directory = os.path.dirname(filename)
+    while directory not in prefixes:
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+    return filename[len(os.path.join(directory, '')):]
+
+
+def strip_paths_in_code(co, new_filename=None):
+    """
+    Return the code object CO with the filename made relative to the
+    path it was found in, recursively for all code objects in it.
+    """
+    if new_filename is None:
+        new_filename = _strip_path_prefix(os.path.normpath(co.co_filename))
+        if new_filename is None:
             return co
 
     code_func = type(co)
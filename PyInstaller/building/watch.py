@@ -0,0 +1,264 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+
+"""
+Waiting for changes of the input files of a build, used by `--watch`.
+
+Paths to watch are either files or directories. For a directory, adding,
+changing or removing any Python module in it is a change.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from .. import log as logging
+from ..compat import is_linux, is_py2
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds between two scans of the watched paths when polling.
+POLL_INTERVAL = 0.5
+# Seconds without further changes before a change is reported. Editors
+# often write a file in several steps.
+SETTLE_TIME = 0.2
+MODULE_SUFFIXES = ('.py', '.pyw')
+
+
+def is_module(name):
+    return name.endswith(MODULE_SUFFIXES)
+
+
+def changed_since(paths, since):
+    """
+    Return the paths of `paths` changed after the time `since`.
+    """
+    changed = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in _listdir(path)
+                     if is_module(name)]
+        else:
+            files = [path]
+        changed.extend(fnm for fnm in files if _mtime(fnm) > since)
+    return sorted(changed)
+
+
+def create_watcher(paths):
+    """
+    Return a watcher for `paths`, using inotify if available.
+    """
+    if is_linux:
+        try:
+            return InotifyWatcher(paths)
+        except OSError as e:
+            logger.info('Cannot use inotify (%s), polling for changes', e)
+    return PollingWatcher(paths)
+
+
+class PollingWatcher(object):
+    """
+    Watch paths by comparing their modification times and sizes.
+    """
+    def __init__(self, paths, interval=POLL_INTERVAL):
+        self.paths = sorted(paths)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                for name in _listdir(path):
+                    if is_module(name):
+                        fnm = os.path.join(path, name)
+                        snapshot[fnm] = _stat(fnm)
+            else:
+                snapshot[path] = _stat(path)
+        return snapshot
+
+    def wait(self, timeout=None):
+        """
+        Wait for changes and return the list of changed paths. An empty
+        list is returned if `timeout` seconds pass without changes.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        changed = []
+        while True:
+            snapshot = self._scan()
+            now_changed = sorted(
+                path for path in set(snapshot) | set(self._snapshot)
+                if snapshot.get(path) != self._snapshot.get(path))
+            self._snapshot = snapshot
+            if now_changed:
+                changed = sorted(set(changed) | set(now_changed))
+            elif changed:
+                return changed
+            if deadline is not None and not changed and time.time() >= deadline:
+                return []
+            time.sleep(self.interval if not changed else SETTLE_TIME)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Watch paths using the inotify API of Linux.
+
+    Directories are watched, not files, so files replaced by editors
+    (written to a new file and renamed) are not lost.
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_CLOEXEC = 0o2000000
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+            IN_MOVE_SELF)
+    # struct inotify_event without the name
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = libc
+        self._fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        # Watched directory and the names of the watched files in it, or
+        # None if all modules in the directory are watched.
+        self._dirs = {}
+        self._wds = {}
+        try:
+            for path in sorted(paths):
+                if os.path.isdir(path):
+                    self._add_watch(path, None)
+                else:
+                    self._add_watch(os.path.dirname(path),
+                                    os.path.basename(path))
+        except:
+            self.close()
+            raise
+
+    def _add_watch(self, dirname, name):
+        if dirname in self._wds:
+            wd = self._wds[dirname]
+            names = self._dirs[wd][1]
+            if names is not None:
+                if name is None:
+                    self._dirs[wd] = (dirname, None)
+                else:
+                    names.add(name)
+            return
+        if not os.path.isdir(dirname):
+            # Watching the parents of removed directories is not worth
+            # the effort, the build reports the missing files anyway.
+            return
+        if not is_py2:
+            dirname_bytes = dirname.encode(sys.getfilesystemencoding())
+        else:
+            dirname_bytes = dirname
+        wd = self._libc.inotify_add_watch(self._fd, dirname_bytes, self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()),
+                          dirname)
+        self._wds[dirname] = wd
+        self._dirs[wd] = (dirname, None if name is None else set([name]))
+
+    def _read_events(self, timeout):
+        """
+        Return the paths changed according to the next events, or None if
+        there are none within `timeout` seconds.
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return None
+        data = os.read(self._fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            if not is_py2:
+                name = name.decode(sys.getfilesystemencoding())
+            offset += length
+            if wd not in self._dirs:
+                continue
+            dirname, names = self._dirs[wd]
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                changed.append(dirname)
+            elif names is None and is_module(name) or \
+                    names is not None and name in names:
+                changed.append(os.path.join(dirname, name))
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Wait for changes and return the list of changed paths. An empty
+        list is returned if `timeout` seconds pass without changes.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        changed = set()
+        while True:
+            if changed:
+                # Waiting for SETTLE_TIME after the last relevant change.
+                deadline = settle_deadline
+            if deadline is None:
+                wait_time = None
+            else:
+                wait_time = max(0, deadline - time.time())
+            events = self._read_events(wait_time)
+            if events is None:
+                # Timed out, waiting either for further changes or at all.
+                return sorted(changed)
+            # Events of unwatched files in watched directories are ignored
+            # and do not delay reporting the changes.
+            if events:
+                changed.update(events)
+                settle_deadline = time.time() + SETTLE_TIME
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _mtime(path):
+    st = _stat(path)
+    return st[0] if st else 0
@@ -579,6 +579,15 @@ def get_bootstrap_modules():
         mod = __import__(mod_name)  # C extension.
         if hasattr(mod, '__file__'):
             loader_mods.append((mod_name, os.path.abspath(mod.__file__), 'EXTENSION'))
+    # Optional: 'mmap' maps the PYZ archive into memory and 'time' is used
+    # by the import profiler.
+    for mod_name in ['mmap', 'time']:
+        try:
+            mod = __import__(mod_name)  # C extension.
+        except ImportError:
+            continue
+        if hasattr(mod, '__file__'):
+            loader_mods.append((mod_name, os.path.abspath(mod.__file__), 'EXTENSION'))
     # NOTE:These modules should be kept simple without any complicated dependencies.
     loader_mods +=[
         ('struct', os.path.abspath(mod_struct.__file__), 'PYMODULE'),
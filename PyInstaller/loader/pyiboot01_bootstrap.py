@@ -190,3 +190,21 @@ d = os.path.join(sys._MEIPASS, d)
 if os.path.isdir(d):
     for fn in os.listdir(d):
         sys.path.append(os.path.join(d, fn))
+
+
+# Time the runtime hooks and write the import profile and order at exit,
+# if the import profiler is enabled.
+if pyimod03_importers.profiler is not None:
+    profiler = pyimod03_importers.profiler
+    if profiler.order_file:
+        # The app might change the working directory.
+        profiler.order_file = os.path.abspath(profiler.order_file)
+    try:
+        import atexit
+        atexit.register(profiler.at_exit)
+    except ImportError:
+        # 'atexit' is not a built-in module in Python 2 and might not
+        # be bundled. Python 2 runs 'sys.exitfunc' at exit.
+        sys.exitfunc = profiler.at_exit
+    profiler.time_runtime_hooks()
+    del profiler
@@ -32,6 +32,8 @@ if sys.version_info[0] == 2:
     import thread
 else:
     import _thread as thread
+    # Built in on Python 3 only.
+    import _io
 
 
 # For decrypting Python modules.
@@ -298,6 +300,129 @@ class Cipher(object):
         return self.__create_cipher(data[:CRYPT_BLOCK_SIZE]).decrypt(data[CRYPT_BLOCK_SIZE:])
 
 
+class LRUCache(object):
+    """
+    Cache of byte strings. If their total size exceeds `max_size` bytes,
+    the least recently used ones are dropped.
+
+    The number of lookups finding (`hits`) and not finding (`misses`) an
+    entry are counted for diagnostics.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._links = {}
+        # Circular doubly linked list of [prev, next, key, value] links,
+        # the least recently used one first. As in functools.lru_cache(),
+        # which is not available during bootstrap.
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = thread.allocate_lock()
+
+    def __len__(self):
+        return len(self._links)
+
+    def get(self, key):
+        """
+        Return the value for `key` or None.
+        """
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Move the link to the end of the list.
+            link_prev, link_next = link[0], link[1]
+            link_prev[1] = link_next
+            link_next[0] = link_prev
+            last = self._root[0]
+            last[1] = self._root[0] = link
+            link[0] = last
+            link[1] = self._root
+            return link[3]
+
+    def put(self, key, value):
+        if len(value) > self.max_size:
+            return
+        with self._lock:
+            if key in self._links:
+                return
+            root = self._root
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self._links[key] = link
+            self.size += len(value)
+            while self.size > self.max_size:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._links[oldest[2]]
+                self.size -= len(oldest[3])
+
+
+if sys.version_info[0] > 2:
+    class EntryStream(_io._RawIOBase):
+        """
+        Raw binary stream of the data of an entry of a ZlibArchiveReader,
+        read and decompressed in chunks of up to CHUNK_SIZE bytes. Python 3
+        only.
+        """
+        CHUNK_SIZE = 64 * 1024
+
+        def __init__(self, archive, pos, length, compressed):
+            _io._RawIOBase.__init__(self)
+            self._archive = archive
+            self._pos = pos
+            self._end = pos + length
+            self._decompressor = None
+            if compressed:
+                if archive.zdict:
+                    self._decompressor = zlib.decompressobj(zdict=archive.zdict)
+                else:
+                    self._decompressor = zlib.decompressobj()
+            # Data read but not returned yet, from `_offset` on.
+            self._pending = b''
+            self._offset = 0
+
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            while self._offset == len(self._pending):
+                data = self._next_chunk()
+                if data is None:
+                    return 0
+                self._pending = data
+                self._offset = 0
+            n = min(len(b), len(self._pending) - self._offset)
+            b[:n] = self._pending[self._offset:self._offset + n]
+            self._offset += n
+            return n
+
+        def _next_chunk(self):
+            """
+            Return the next chunk of data, or None at the end of the entry.
+            """
+            decompressor = self._decompressor
+            if decompressor is not None and decompressor.unconsumed_tail:
+                return decompressor.decompress(decompressor.unconsumed_tail,
+                                               self.CHUNK_SIZE)
+            if self._pos < self._end:
+                length = min(self.CHUNK_SIZE, self._end - self._pos)
+                data = bytes(self._archive._read_raw(self._pos, length))
+                self._pos += length
+                if decompressor is not None:
+                    data = decompressor.decompress(data, self.CHUNK_SIZE)
+                return data
+            if decompressor is not None:
+                self._decompressor = None
+                return decompressor.flush()
+            return None
+
+
 class ZlibArchiveReader(ArchiveReader):
     """
     ZlibArchive - an archive with compressed entries. Archive is read
@@ -310,6 +435,7 @@ class ZlibArchiveReader(ArchiveReader):
     """
     MAGIC = b'PYZ\0'
     TOCPOS = 8
+    OPTPOS = 13
     HDRLEN = ArchiveReader.HDRLEN + 5
 
     def __init__(self, path=None, offset=None):
@@ -329,8 +455,27 @@ class ZlibArchiveReader(ArchiveReader):
             else:
                 offset = 0
 
+        # Options stored by the ZlibArchiveWriter, see loadtoc().
+        self.options = {}
+        self.zdict = None
+        # The archive file mapped into memory, see _map_file().
+        self._mmap = self._map_file(path)
+        if self._mmap is not None and sys.version_info[0] > 2:
+            self._view = memoryview(self._mmap)
+
         super(ZlibArchiveReader, self).__init__(path, offset)
 
+        # Cache of decrypted and decompressed entries, keyed by position.
+        # Code objects are not cached to not keep them alive.
+        cache_size = self.options.get('cache_size')
+        self.cache = LRUCache(cache_size) if cache_size else None
+        # Set by the import profiler to time reading the entries, see
+        # pyimod03_importers.ImportProfiler.
+        self.profiler = None
+        # Entries read in the background, see start_preload().
+        self._preloaded = None
+        self._preload_taken = None
+
         # Try to import the key module. If the key module is not available
         # then it means that encryption is disabled.
         try:
@@ -339,19 +484,192 @@ class ZlibArchiveReader(ArchiveReader):
         except ImportError:
             self.cipher = None
 
+    def _map_file(self, path):
+        """
+        Map the archive file into memory, so extracting modules needs no
+        system calls. Return None if that is not possible.
+
+        On Windows the file is not mapped, but opened for every access to
+        avoid keeping it locked.
+        """
+        if path is None or sys.platform.startswith('win'):
+            return None
+        try:
+            import mmap
+        except ImportError:
+            return None
+        try:
+            with open(path, 'rb') as fp:
+                return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            # E.g. an empty file or a file system not supporting mmap.
+            return None
+
+    def _mapped(self, pos, length=None):
+        """
+        Return a view of `length` bytes of the mapped archive at `pos`,
+        up to the end of the file if `length` is None.
+        """
+        pos += self.start
+        if length is None:
+            length = len(self._mmap) - pos
+        if sys.version_info[0] == 2:
+            return buffer(self._mmap, pos, length)
+        return self._view[pos:pos + length]
+
+    def loadtoc(self):
+        """
+        Load the TOC and the options. The options are a marshalled dict
+        in front of the TOC, their position follows the cipher flag in
+        the header (0 if there are no options).
+        """
+        if self._mmap is not None:
+            (toc_pos,) = struct.unpack('!i', self._mapped(self.TOCPOS, 4))
+            (options_pos,) = struct.unpack('!i', self._mapped(self.OPTPOS, 4))
+            self.toc = dict(marshal.loads(self._mapped(toc_pos)))
+            if options_pos:
+                self.options = marshal.loads(
+                    self._mapped(options_pos, toc_pos - options_pos))
+            self.zdict = self.options.get('zdict')
+            return
+        super(ZlibArchiveReader, self).loadtoc()
+        self.lib.seek(self.start + self.TOCPOS)
+        (toc_pos,) = struct.unpack('!i', self.lib.read(4))
+        self.lib.seek(self.start + self.OPTPOS)
+        (options_pos,) = struct.unpack('!i', self.lib.read(4))
+        if options_pos:
+            self.lib.seek(self.start + options_pos)
+            self.options = marshal.loads(self.lib.read(toc_pos - options_pos))
+        self.zdict = self.options.get('zdict')
+
+    def decompress(self, data):
+        if self.zdict:
+            decomprobj = zlib.decompressobj(zdict=self.zdict)
+            return decomprobj.decompress(data) + decomprobj.flush()
+        return zlib.decompress(data)
+
     def extract(self, name):
-        (typ, pos, length) = self.toc.get(name, (0, None, 0))
+        (typ, pos, length, compressed) = self.toc.get(name, (0, None, 0, 0))
         if pos is None:
             return None
-        with self.lib:
-            self.lib.seek(self.start + pos)
-            obj = self.lib.read(length)
+        # Entries stored as they are gain nothing from the cache.
+        cache = self.cache if compressed or self.cipher else None
+        obj = cache.get(pos) if cache is not None else None
         try:
-            if self.cipher:
-                obj = self.cipher.decrypt(obj)
-            obj = zlib.decompress(obj)
+            if obj is None:
+                obj = self._take_preloaded(name)
+                if obj is None:
+                    obj = self._read(name, pos, length, compressed)
+                if cache is not None:
+                    cache.put(pos, obj)
             if typ in (PYZ_TYPE_MODULE, PYZ_TYPE_PKG):
-                obj = marshal.loads(obj)
+                obj = self._timed(name, 'unmarshal', marshal.loads, obj)
+            else:
+                obj = bytes(obj)
         except EOFError:
             raise ImportError("PYZ entry '%s' failed to unmarshal" % name)
         return typ, obj
+
+    def open_entry(self, name):
+        """
+        Return a binary file object reading the data of the entry `name`,
+        decompressing it while reading, or None if there is no such entry.
+        """
+        (typ, pos, length, compressed) = self.toc.get(name, (0, None, 0, 0))
+        if pos is None:
+            return None
+        if sys.version_info[0] == 2:
+            # There is no built-in _io module to stream the data with.
+            # The FrozenImporter is installed by now, so 'io' can be
+            # imported.
+            import io
+            return io.BytesIO(self._read(name, pos, length, compressed))
+        if self.cipher:
+            # The cipher needs the whole entry.
+            return _io.BytesIO(self._read(name, pos, length, compressed))
+        if self.profiler is not None:
+            self.profiler.used(name)
+        return _io.BufferedReader(EntryStream(self, pos, length, compressed))
+
+    def start_preload(self):
+        """
+        Start reading the entries listed in the option `preload`, the
+        modules the app imports at startup, in a background thread.
+
+        zlib releases the GIL while decompressing, so on multi-core
+        machines the entries are decompressed while the app executes the
+        modules imported before them. Entries the app needs before they
+        are read in the background are read by extract() as usual.
+        """
+        names = []
+        for name in self.options.get('preload', ()):
+            typ, pos, length, compressed = self.toc.get(name, (0, None, 0, 0))
+            # Entries stored as they are gain nothing.
+            if pos is not None and (compressed or self.cipher):
+                names.append(name)
+        if not names:
+            return
+        self._preloaded = {}
+        self._preload_taken = set()
+        thread.start_new_thread(self._preload, (names,))
+
+    def _preload(self, names):
+        for name in names:
+            if name in self._preload_taken:
+                continue
+            typ, pos, length, compressed = self.toc[name]
+            try:
+                # Not timed by the profiler, that is for the main thread.
+                obj = self._decode(self._read_raw(pos, length), compressed)
+            except Exception:
+                # extract() reports the error when reading it again.
+                return
+            # Keep it only if extract() has not read it meanwhile.
+            if name not in self._preload_taken:
+                self._preloaded[name] = obj
+
+    def _take_preloaded(self, name):
+        """
+        Return the data of the entry `name` if read in the background,
+        else None. The background thread does not read it afterwards.
+        """
+        if self._preloaded is None:
+            return None
+        self._preload_taken.add(name)
+        obj = self._preloaded.pop(name, None)
+        if obj is not None and self.profiler is not None:
+            self.profiler.used(name)
+        return obj
+
+    def _read(self, name, pos, length, compressed):
+        """
+        Return the decrypted and decompressed data of the entry `name`.
+        """
+        obj = self._timed(name, 'read', self._read_raw, pos, length)
+        if self.cipher or compressed:
+            obj = self._timed(name, 'decompress', self._decode, obj,
+                              compressed)
+        return obj
+
+    def _read_raw(self, pos, length):
+        if self._mmap is not None:
+            return self._mapped(pos, length)
+        with self.lib:
+            self.lib.seek(self.start + pos)
+            return self.lib.read(length)
+
+    def _decode(self, obj, compressed):
+        if self.cipher:
+            obj = self.cipher.decrypt(bytes(obj))
+        if compressed:
+            obj = self.decompress(obj)
+        return obj
+
+    def _timed(self, name, phase, func, *args):
+        """
+        Return `func(*args)`, timed as `phase` of reading the entry `name`
+        if the import profiler is enabled.
+        """
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.timed(name, phase, func, *args)
@@ -8,7 +8,7 @@
 #-----------------------------------------------------------------------------
 
 """
-PEP-302 importers for frozen applications.
+PEP-302 and PEP-451 importers for frozen applications.
 """
 
 
@@ -18,10 +18,12 @@ PEP-302 importers for frozen applications.
 
 
 
+import marshal
 import sys
 import pyimod01_os_path as pyi_os_path
 
-from pyimod02_archive import ArchiveReadError, ZlibArchiveReader
+from pyimod02_archive import ArchiveReadError, ZlibArchiveReader, \
+    PYZ_TYPE_PKG, PYZ_TYPE_DATA
 
 
 SYS_PREFIX = sys._MEIPASS
@@ -32,6 +34,7 @@ SYS_PREFIXLEN = len(SYS_PREFIX)
 if sys.version_info[0:2] < (3, 3):
     # TODO Implement this for Python 3.2 - 'imp' is not a built-in module anymore.
     import imp
+    from thread import get_ident
     imp_lock = imp.acquire_lock
     imp_unlock = imp.release_lock
     # Find the platform specific extension suffixes.
@@ -45,6 +48,7 @@ else:
     def imp_lock(): pass
     def imp_unlock(): pass
     import _frozen_importlib
+    from _thread import get_ident, RLock
     if sys.version_info[1] <= 4:
         # Python 3.3, 3.4
         EXTENSION_SUFFIXES = _frozen_importlib.EXTENSION_SUFFIXES
@@ -67,6 +71,9 @@ else:
     def trace(msg, *a):
         pass
 
+# The import profiler if enabled, see ImportProfiler.
+profiler = None
+
 # TODO Do we still need BuiltintImporter for Python 3 built-in modules?
 class BuiltinImporter(object):
     """
@@ -158,6 +165,27 @@ class FrozenPackageImporter(object):
         return self._importer.load_module(fullname, self._fullname)
 
 
+class FrozenPathEntryFinder(object):
+    """
+    Path entry finder returned by the ``sys.path_hooks`` processor of
+    FrozenImporter for a directory of a package in the archive.
+
+    Path entry finders are called with other arguments than the finders on
+    ``sys.meta_path``: find_spec(fullname, target) and find_module(fullname).
+    This class passes them on to the FrozenImporter with the directory as
+    the search path.
+    """
+    def __init__(self, importer, path):
+        self._importer = importer
+        self._path = path
+
+    def find_module(self, fullname, path=None):
+        return self._importer.find_module(fullname, [self._path])
+
+    def find_spec(self, fullname, target=None):
+        return self._importer.find_spec(fullname, [self._path])
+
+
 class FrozenImporter(object):
     """
     Load bytecode of Python modules from the executable created by PyInstaller.
@@ -175,6 +203,16 @@ class FrozenImporter(object):
     class with method load_module(). Both these methods are implemented
     in one class.
 
+    On Python 3.4+ the import machinery uses the PEP-451 methods
+    find_spec(), create_module() and exec_module() instead. Finding a
+    module, like is_package() and get_filename(), only looks at the TOC
+    of the archive; the module is extracted by exec_module().
+
+    On Python 3.5+ the modules listed in the option `lazy_modules` of the
+    archive are executed lazily, like with importlib.util.LazyLoader:
+    exec_module() turns the module into a _LazyModule, which is executed
+    on the first access to one of its attributes.
+
 
     To use this class just call
 
@@ -208,6 +246,18 @@ class FrozenImporter(object):
                 # Some runtime hook might need access to the list of available
                 # frozen module. Let's make them accessible as a set().
                 self.toc = set(self._pyz_archive.toc.keys())
+                # Modules executed lazily, see exec_module(), and the
+                # state of those not executed yet, by name.
+                self._lazy_modules = set()
+                if sys.version_info[0:2] >= (3, 5):
+                    self._lazy_modules.update(
+                        self._pyz_archive.options.get('lazy_modules', ()))
+                self._lazy_states = {}
+                # Directory index of the data files, see _resource_dirs().
+                self._resource_index = None
+                # Decompress the modules imported at startup in the
+                # background, if enabled.
+                self._pyz_archive.start_preload()
                 # Return - no error was raised.
                 trace("# PyInstaller: FrozenImporter(%s)", pyz_filepath)
                 return
@@ -230,13 +280,13 @@ class FrozenImporter(object):
 
         sys.path_hook is a list of callables, which will be checked in
         sequence to determine if they can handle a given path item.
+        Return a FrozenPathEntryFinder for the directory of a package.
         """
 
         if path.startswith(SYS_PREFIX):
             fullname = path[SYS_PREFIXLEN+1:].replace(pyi_os_path.os_sep, '.')
-            loader = self.find_module(fullname)
-            if loader is not None:
-                return loader
+            if self.find_module(fullname) is not None:
+                return FrozenPathEntryFinder(self, path)
         raise ImportError(path)
 
 
@@ -255,11 +305,26 @@ class FrozenImporter(object):
         # importing modules.
 
         imp_lock()
-        module_loader = None  # None means - no module found in this importer.
+        real_fullname = self._find(fullname, path)
+        # Release the interpreter's import lock.
+        imp_unlock()
+        if real_fullname is None:
+            return None
+        elif real_fullname == fullname:
+            # Tell the import machinery to use self.load_module() to load the module.
+            return self
+        else:
+            return FrozenPackageImporter(self, real_fullname)
+
+    def _find(self, fullname, path):
+        """
+        Return the name of the module `fullname` in the archive, or None if
+        the archive does not contain it.
+        """
+        real_fullname = None
 
         if fullname in self.toc:
-            # Tell the import machinery to use self.load_module() to load the module.
-            module_loader = self
+            real_fullname = fullname
             trace("import %s # PyInstaller PYZ", fullname)
         elif path is not None:
             # Try to handle module.__path__ modifications by the modules themselves
@@ -275,17 +340,134 @@ class FrozenImporter(object):
                 if not parts[0]:
                     parts = parts[1:]
                 parts.append(modname)
-                real_fullname = ".".join(parts)
-                if real_fullname in self.toc:
-                    module_loader = FrozenPackageImporter(self, real_fullname)
+                candidate = ".".join(parts)
+                if candidate in self.toc:
+                    real_fullname = candidate
                     trace("import %s as %s # PyInstaller PYZ (__path__ override: %s)",
                           real_fullname, fullname, p)
                     break
-        # Release the interpreter's import lock.
-        imp_unlock()
-        if module_loader is None:
+        if real_fullname is None:
             trace("# %s not found in PYZ", fullname)
-        return module_loader
+        return real_fullname
+
+    def _is_pkg(self, real_fullname):
+        return self._pyz_archive.toc[real_fullname][0] == PYZ_TYPE_PKG
+
+    def _filename(self, fullname, is_pkg):
+        """
+        Return the __file__ of module `fullname`: relative to the executable,
+        so that data files can be found, with the suffix of a package or
+        a module.
+        """
+        if is_pkg:
+            return pyi_os_path.os_path_join(pyi_os_path.os_path_join(SYS_PREFIX,
+                fullname.replace('.', pyi_os_path.os_sep)), '__init__.pyc')
+        else:
+            return pyi_os_path.os_path_join(SYS_PREFIX,
+                fullname.replace('.', pyi_os_path.os_sep) + '.pyc')
+
+    def find_spec(self, fullname, path=None, target=None):
+        """
+        PEP-451 finder.find_spec() method for the ``sys.meta_path`` hook.
+        Python 3.4+ only.
+
+        fullname     fully qualified name of the module
+        path         None for a top-level module, or package.__path__ for submodules or subpackages.
+        target       module object being reloaded, or None.
+
+        Return a module spec if the module was found, or None if it wasn't.
+        The spec is made from the TOC of the archive only.
+        """
+        real_fullname = self._find(fullname, path)
+        if real_fullname is None:
+            return None
+        is_pkg = self._is_pkg(real_fullname)
+        spec = _frozen_importlib.ModuleSpec(
+            fullname, self, origin=self._filename(fullname, is_pkg),
+            is_package=is_pkg)
+        # Set __file__ of the module from the origin.
+        spec.has_location = True
+        # The name of the module in the archive, if found by a __path__
+        # override.
+        spec.loader_state = real_fullname
+        if is_pkg:
+            # See the comments on __path__ in load_module().
+            spec.submodule_search_locations = [
+                pyi_os_path.os_path_dirname(spec.origin)]
+        return spec
+
+    def create_module(self, spec):
+        """
+        PEP-451 loader.create_module() method. Python 3.4+ only.
+
+        Return None to let the import machinery create the module.
+        """
+        return None
+
+    def exec_module(self, module):
+        """
+        PEP-451 loader.exec_module() method. Python 3.4+ only.
+
+        Extract the code of the module from the archive and run it in the
+        namespace of the module, or for a lazy module only when one of its
+        attributes is accessed.
+        """
+        spec = module.__spec__
+        real_fullname = spec.loader_state or spec.name
+        if real_fullname in self._lazy_modules:
+            # The attributes set by the import machinery, to tell them
+            # from those set before the module is executed.
+            self._lazy_states[spec.name] = {
+                '__dict__': module.__dict__.copy(), 'lock': RLock(),
+                'is_loading': False}
+            module.__class__ = _LazyModule
+            return
+        self._exec_module(module, real_fullname)
+
+    def _exec_lazy_module(self, module):
+        """
+        Execute the lazy `module` on the first access to an attribute,
+        like importlib.util._LazyModule.__getattribute__() does. Return
+        False if the module is being executed already.
+        """
+        spec = object.__getattribute__(module, '__spec__')
+        state = self._lazy_states[spec.name]
+        with state['lock']:
+            if object.__getattribute__(module, '__class__') is not _LazyModule:
+                # Executed by another thread meanwhile.
+                return True
+            if state['is_loading']:
+                # Accessed by the code of the module itself.
+                return False
+            state['is_loading'] = True
+            attrs_then = state['__dict__']
+            attrs_now = object.__getattribute__(module, '__dict__')
+            attrs_updated = {}
+            for key, value in attrs_now.items():
+                if key not in attrs_then or attrs_then[key] is not value:
+                    attrs_updated[key] = value
+            try:
+                self._exec_module(module, spec.loader_state or spec.name)
+            except:
+                state['is_loading'] = False
+                raise
+            if spec.name in sys.modules and sys.modules[spec.name] is not module:
+                raise ValueError('module object for %r substituted in '
+                                 'sys.modules during a lazy load' % spec.name)
+            attrs_now.update(attrs_updated)
+            module.__class__ = imp_new_module
+            del self._lazy_states[spec.name]
+        return True
+
+    def _exec_module(self, module, real_fullname):
+        if profiler is not None:
+            profiler.begin(real_fullname)
+        try:
+            bytecode = self._pyz_archive.extract(real_fullname)[1]
+            exec(bytecode, module.__dict__)
+        finally:
+            if profiler is not None:
+                profiler.end()
 
     def load_module(self, fullname, real_fullname=None):
         """
@@ -302,6 +484,7 @@ class FrozenImporter(object):
         # Acquire the interpreter's import lock.
         imp_lock()
         module = None
+        profiling = False
         if real_fullname is None:
             real_fullname=fullname
         try:
@@ -311,6 +494,9 @@ class FrozenImporter(object):
 
             # Module not in sys.modules - load it and it to sys.modules.
             if module is None:
+                if profiler is not None:
+                    profiler.begin(real_fullname)
+                    profiling = True
                 # Load code object from the bundled ZIP archive.
                 is_pkg, bytecode = self._pyz_archive.extract(real_fullname)
                 # Create new empty 'module' object.
@@ -324,13 +510,7 @@ class FrozenImporter(object):
                 # so that data files can be found. The absolute absolute path
                 # to the executable is taken from sys.prefix. In onefile mode it
                 # points to the temp directory where files are unpacked by PyInstaller.
-                # Then, append the appropriate suffix (__init__.pyc for a package, or just .pyc for a module).
-                if is_pkg:
-                    module.__file__ = pyi_os_path.os_path_join(pyi_os_path.os_path_join(SYS_PREFIX,
-                        fullname.replace('.', pyi_os_path.os_sep)), '__init__.pyc')
-                else:
-                    module.__file__ = pyi_os_path.os_path_join(SYS_PREFIX,
-                        fullname.replace('.', pyi_os_path.os_sep) + '.pyc')
+                module.__file__ = self._filename(fullname, is_pkg)
 
                 ### Set __path__  if 'fullname' is a package.
                 # Python has modules and packages. A Python package is container
@@ -401,6 +581,8 @@ class FrozenImporter(object):
             raise
 
         finally:
+            if profiling:
+                profiler.end()
             # Release the interpreter's import lock.
             imp_unlock()
 
@@ -412,14 +594,11 @@ class FrozenImporter(object):
 
     def is_package(self, fullname):
         """
-        Return always False since built-in modules are never packages.
+        Return True if the module `fullname` is a package. The TOC of the
+        archive tells, the module is not extracted.
         """
         if fullname in self.toc:
-            try:
-                is_pkg, bytecode = self._pyz_archive.extract(fullname)
-                return bool(is_pkg)
-            except Exception:
-                raise ImportError('Loader FrozenImporter cannot handle module ' + fullname)
+            return self._is_pkg(fullname)
         else:
             raise ImportError('Loader FrozenImporter cannot handle module ' + fullname)
 
@@ -481,15 +660,87 @@ class FrozenImporter(object):
         if the named module was loaded. If the module is not found, then
         ImportError should be raised.
         """
-        # Then, append the appropriate suffix (__init__.pyc for a package, or just .pyc for a module).
         # Method is_package() will raise ImportError if module not found.
-        if self.is_package(fullname):
-            filename = pyi_os_path.os_path_join(pyi_os_path.os_path_join(SYS_PREFIX,
-                fullname.replace('.', pyi_os_path.os_sep)), '__init__.pyc')
-        else:
-            filename = pyi_os_path.os_path_join(SYS_PREFIX,
-                fullname.replace('.', pyi_os_path.os_sep) + '.pyc')
-        return filename
+        return self._filename(fullname, self.is_package(fullname))
+
+    def get_resource_reader(self, fullname):
+        """
+        Return a PyzResourceReader for the package `fullname`, used by
+        importlib.resources in Python 3.7 and later. Return None if the
+        module is not a package.
+        """
+        if fullname in self.toc and self._is_pkg(fullname):
+            return PyzResourceReader(self, fullname)
+        return None
+
+    ### Resources, used by PyzResourceReader and pyi_rth_pkgres
+
+    def _data_name(self, path):
+        """
+        Return the name of the data file in the archive at `path`, or None
+        if there is none.
+        """
+        if not path.startswith(SYS_PREFIX + pyi_os_path.os_sep):
+            return None
+        name = path[SYS_PREFIXLEN+1:]
+        if self._pyz_archive.toc.get(name, (None,))[0] == PYZ_TYPE_DATA:
+            return name
+        return None
+
+    def _resource_dirs(self):
+        """
+        Return the directory index of the data files in the archive: the
+        names of the files and directories in each directory, by its path
+        relative to sys.prefix. It is built from the TOC on first use.
+        """
+        if self._resource_index is None:
+            sep = pyi_os_path.os_sep
+            index = {}
+            for name, entry in self._pyz_archive.toc.items():
+                if entry[0] != PYZ_TYPE_DATA:
+                    continue
+                while sep in name:
+                    dirname, basename = name.rsplit(sep, 1)
+                    names = index.get(dirname)
+                    if names is not None:
+                        # The parent directories are known already.
+                        names.add(basename)
+                        break
+                    index[dirname] = set([basename])
+                    name = dirname
+            self._resource_index = index
+        return self._resource_index
+
+    def _is_resource_dir(self, path):
+        """
+        Return True if `path` is a directory of data files in the archive.
+        """
+        return (path.startswith(SYS_PREFIX + pyi_os_path.os_sep) and
+                path[SYS_PREFIXLEN+1:] in self._resource_dirs())
+
+    def _list_resources(self, path):
+        """
+        Return the sorted names of the files and directories in the
+        directory `path`, in the archive and in the file system.
+        """
+        names = set()
+        if path.startswith(SYS_PREFIX + pyi_os_path.os_sep):
+            names.update(self._resource_dirs().get(path[SYS_PREFIXLEN+1:], ()))
+        try:
+            names.update(pyi_os_path.os_listdir(path))
+        except OSError:
+            pass
+        return sorted(names)
+
+    def _open_resource(self, path):
+        """
+        Return a binary file object reading the file at `path`, from the
+        archive if it is there. Raise IOError if there is no such file.
+        """
+        name = self._data_name(path)
+        if name is not None:
+            return self._pyz_archive.open_entry(name)
+        return open(path, 'rb')
 
 
 class CExtensionImporter(object):
@@ -502,32 +753,62 @@ class CExtensionImporter(object):
         full.module.name.so
         full.module.name.cpython-33m.so
         full.module.name.abi3.so
+
+    The extension modules are looked up in the index mapping their names
+    to their filenames, written to EXTENSION_INDEX_NAME in sys.prefix at
+    build time. Without it, sys.prefix is listed once to build the index.
     """
+    # See PyInstaller.building.utils.write_extension_index().
+    EXTENSION_INDEX_NAME = 'pyi-extension-index'
+
     def __init__(self):
-        # Cache directory content for faster module lookup without
-        # file system access.
+        extensions = self._load_extensions()
+        if extensions is None:
+            extensions = self._scan_extensions()
+        # Module name -> filename relative to sys.prefix, for module lookup
+        # without file system access.
+        self._extensions = extensions
+
+    @classmethod
+    def _load_extensions(cls):
+        try:
+            with open(pyi_os_path.os_path_join(SYS_PREFIX,
+                                               cls.EXTENSION_INDEX_NAME),
+                      'rb') as fp:
+                extensions = marshal.load(fp)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        return extensions if isinstance(extensions, dict) else None
+
+    @staticmethod
+    def _scan_extensions():
+        extensions = {}
         files = pyi_os_path.os_listdir(SYS_PREFIX)
-        self._file_cache = set(files)
+        # Earlier suffixes win, like when probing them in this order.
+        for ext in reversed(list(EXTENSION_SUFFIXES)):
+            for filename in files:
+                if filename.endswith(ext):
+                    extensions[filename[:-len(ext)]] = filename
+        return extensions
 
     def find_module(self, fullname, path=None):
-        imp_lock()
-        module_loader = None  # None means - no module found by this importer.
-
-        # Look in the file list of sys.prefix path (alias PYTHONHOME).
-        for ext in EXTENSION_SUFFIXES:
-            if fullname + ext in self._file_cache:
-                module_loader = self
-                break
-
-        imp_unlock()
-        return module_loader
+        # None means - no module found by this importer.
+        if fullname in self._extensions:
+            return self
+        return None
 
     def load_module(self, fullname, path=None):
         imp_lock()
 
         module = None
+        profiling = False
 
         try:
+            if profiler is not None and fullname not in sys.modules:
+                profiler.used(pyi_os_path.os_path_basename(
+                    self.get_filename(fullname)))
+                profiler.begin(fullname)
+                profiling = True
             if sys.version_info[0] == 2:
                 # Python 2 implementation - TODO drop or improve it. 'imp' module is no longer built-in.
                 # PEP302 If there is an existing module object named 'fullname'
@@ -535,13 +816,10 @@ class CExtensionImporter(object):
                 module = sys.modules.get(fullname)
 
                 if module is None:
-                    # Need to search for the filename again, since to
-                    # be thread-safe we can't store it in find_module().
+                    filename = self.get_filename(fullname)
                     for ext, ext_tuple in EXTENSION_SUFFIXES.iteritems():
-                        filename = fullname + ext
-                        if filename in self._file_cache:
+                        if filename.endswith(ext):
                             break
-                    filename = pyi_os_path.os_path_join(SYS_PREFIX, filename)
                     fp = open(filename, 'rb')
                     module = imp.load_module(fullname, fp, filename, ext_tuple)
                     # Set __file__ attribute.
@@ -557,20 +835,8 @@ class CExtensionImporter(object):
                 module = sys.modules.get(fullname)
                 if module is None:
                     # Python 3 implementation.
-                    for ext in EXTENSION_SUFFIXES:
-                        filename = pyi_os_path.os_path_join(SYS_PREFIX, fullname + ext)
-                        # Test if a file exists.
-                        # Cannot use os.path.exists. Use workaround with function open().
-                        # No exception means that a file exists.
-                        try:
-                            with open(filename):
-                                pass
-                        except IOError:
-                            # Continue trying new suffix.
-                            continue
-                        # Load module.
-                        loader = EXTENSION_LOADER(fullname, filename)
-                        module = loader.load_module(fullname)
+                    loader = EXTENSION_LOADER(fullname, self.get_filename(fullname))
+                    module = loader.load_module(fullname)
 
         except Exception:
             # Remove 'fullname' from sys.modules if it was appended there.
@@ -579,6 +845,8 @@ class CExtensionImporter(object):
             raise  # Raise the same exception again.
 
         finally:
+            if profiling:
+                profiler.end()
             # Release the interpreter's import lock.
             imp_unlock()
 
@@ -596,9 +864,8 @@ class CExtensionImporter(object):
         """
         Return None for a C extension module.
         """
-        for ext in EXTENSION_SUFFIXES:
-            if fullname + ext in self._file_cache:
-                return None
+        if fullname in self._extensions:
+            return None
         # If module was not found then function still continues.
         # ImportError should be raised if module not found.
         raise ImportError('No module named ' + fullname)
@@ -631,13 +898,291 @@ class CExtensionImporter(object):
         if the named module was loaded. If the module is not found, then
         ImportError should be raised.
         """
-        for ext in EXTENSION_SUFFIXES:
-            if fullname + ext in self._file_cache:
-                return pyi_os_path.os_path_join(SYS_PREFIX, fullname + ext)
+        if fullname in self._extensions:
+            return pyi_os_path.os_path_join(SYS_PREFIX, self._extensions[fullname])
         # ImportError should be raised if module not found.
         raise ImportError('No module named ' + fullname)
 
 
+class PyzResourceReader(object):
+    """
+    importlib.abc.ResourceReader for a package imported by FrozenImporter.
+
+    The data files in the PYZ archive are looked up in the directory index
+    of the archive and decompressed while reading them. Other resources
+    are files in the directory of the package.
+    """
+    def __init__(self, importer, fullname):
+        self.importer = importer
+        self.path = pyi_os_path.os_path_join(
+            SYS_PREFIX, fullname.replace('.', pyi_os_path.os_sep))
+
+    def _path(self, resource):
+        return pyi_os_path.os_path_join(self.path, resource)
+
+    def open_resource(self, resource):
+        return self.importer._open_resource(self._path(resource))
+
+    def resource_path(self, resource):
+        path = self._path(resource)
+        # Files in the archive have no path, importlib.resources.path()
+        # copies them to a temporary file.
+        if self.importer._data_name(path) is None and self.is_resource(resource):
+            return path
+        raise FileNotFoundError(path)
+
+    def is_resource(self, name):
+        path = self._path(name)
+        if self.importer._data_name(path) is not None:
+            return True
+        if self.importer._is_resource_dir(path):
+            return False
+        try:
+            open(path, 'rb').close()
+        except IOError:
+            # Missing, or a directory.
+            return False
+        return True
+
+    def contents(self):
+        return iter(self.importer._list_resources(self.path))
+
+
+class _LazyModule(type(sys)):
+    """
+    A module executed by FrozenImporter on the first access to one of its
+    attributes.
+
+    Derived from the module type, not imp_new_module, which is a function
+    on Python 2.
+    """
+    def __getattribute__(self, attr):
+        spec = object.__getattribute__(self, '__spec__')
+        if spec.loader._exec_lazy_module(self):
+            return getattr(self, attr)
+        return object.__getattribute__(self, attr)
+
+    def __delattr__(self, attr):
+        self.__getattribute__(attr)
+        if object.__getattribute__(self, '__class__') is _LazyModule:
+            # Deleted by the code of the module itself.
+            object.__delattr__(self, attr)
+        else:
+            delattr(self, attr)
+
+
+class _MainModule(type(sys)):
+    """
+    Class of the __main__ module while the runtime hooks run, see
+    ImportProfiler.time_runtime_hooks().
+    """
+    def __setattr__(self, attr, value):
+        type(sys).__setattr__(self, attr, value)
+        if attr == '__file__':
+            profiler.script_started(self, value)
+
+
+class ImportProfiler(object):
+    """
+    Record the time spent importing modules of the frozen application and
+    running its runtime hooks, and write a report at exit.
+
+    The profiler is enabled by the environment variable
+    PYINSTALLER_IMPORT_PROFILE or else by the option `import_profile` of
+    the PYZ archive. With the value 'importtime' the report is written in
+    the format of `python -X importtime`, with any other value (but '0')
+    as a table of the imported modules, sorted by their cumulative import
+    time and split into reading, decompressing (and decrypting),
+    unmarshalling and executing the module. Loading C extension modules
+    counts as executing them.
+
+    If the environment variable PYINSTALLER_IMPORT_ORDER is set to a file
+    name, the names of the entries of the PYZ archive and the C extension
+    modules are written to that file in the order they were first used,
+    for building the app with the option `import_order`.
+    """
+    ENV_VAR = 'PYINSTALLER_IMPORT_PROFILE'
+    ORDER_ENV_VAR = 'PYINSTALLER_IMPORT_ORDER'
+    PHASES = ('read', 'decompress', 'unmarshal')
+
+    def __init__(self, mode, clock, order_file=None):
+        self.mode = mode
+        self.clock = clock
+        self.order_file = order_file
+        # Names of the entries used, in the order they were first used.
+        self.order = []
+        self._used = set()
+        # Seconds spent in the PHASES of reading modules, by module name.
+        self.phases = {}
+        # (depth, name, self seconds, cumulative seconds) of the imports,
+        # in the order they finished, like `-X importtime` reports them.
+        self.imports = []
+        # (name, seconds) of the runtime hooks.
+        self.runtime_hooks = []
+        # Stacks of [name, start, seconds in nested imports] of the
+        # imports in progress, by thread.
+        self._stacks = {}
+        self._hook = None
+
+    @classmethod
+    def create(cls, options):
+        """
+        Return a profiler if profiling or recording the import order is
+        enabled by the environment or the archive `options`, else None.
+        """
+        mode = _getenv(cls.ENV_VAR)
+        if mode is None:
+            mode = options.get('import_profile')
+        if mode == '0':
+            mode = None
+        order_file = _getenv(cls.ORDER_ENV_VAR) or None
+        if not mode and not order_file:
+            return None
+        try:
+            # 'time' is not a built-in module in Python 2.
+            import time
+        except ImportError:
+            trace("# PyInstaller: cannot profile imports without 'time'")
+            return None
+        clock = getattr(time, 'perf_counter', None)
+        if clock is None:
+            if sys.platform.startswith('win'):
+                clock = time.clock
+            else:
+                clock = time.time
+        return cls(mode, clock, order_file)
+
+    def used(self, name):
+        """
+        Record the use of the entry `name` for the import order.
+        """
+        if name not in self._used:
+            self._used.add(name)
+            self.order.append(name)
+
+    def timed(self, name, phase, func, *args):
+        """
+        Return `func(*args)` and add the time it took to `phase` of
+        reading the entry `name`.
+        """
+        if phase == 'read':
+            self.used(name)
+        start = self.clock()
+        try:
+            return func(*args)
+        finally:
+            phases = self.phases.setdefault(name, {})
+            phases[phase] = phases.get(phase, 0.0) + self.clock() - start
+
+    def begin(self, name):
+        """
+        Start timing the import of the module `name`.
+        """
+        stack = self._stacks.setdefault(get_ident(), [])
+        stack.append([name, self.clock(), 0.0])
+
+    def end(self):
+        """
+        Stop timing the innermost import started by begin().
+        """
+        stack = self._stacks[get_ident()]
+        name, start, nested = stack.pop()
+        cumulative = self.clock() - start
+        if stack:
+            stack[-1][2] += cumulative
+        self.imports.append((len(stack), name, cumulative - nested, cumulative))
+
+    def time_runtime_hooks(self):
+        """
+        Time the runtime hooks, the scripts run by the bootloader after the
+        bootstrap script, until the first script which is not a runtime
+        hook of PyInstaller starts.
+
+        The bootloader sets __main__.__file__ right before it runs each
+        script, so a hook runs from one assignment to the next. Until then
+        __main__ is a _MainModule, which reports the assignments. Python
+        3.5+ only, older versions cannot change the class of a module.
+        """
+        try:
+            sys.modules['__main__'].__class__ = _MainModule
+        except TypeError:
+            trace("# PyInstaller: cannot time the runtime hooks")
+
+    def script_started(self, module, filename):
+        """
+        Called by _MainModule when the bootloader is about to run the
+        script `filename` in `module`.
+        """
+        if self._hook is not None:
+            name, start = self._hook
+            self.runtime_hooks.append((name, self.clock() - start))
+            self._hook = None
+        # The bootloader sets __file__ to the name of the script in the
+        # CArchive and '.py'.
+        name = filename[:-3]
+        if name.startswith('pyi_rth_'):
+            self._hook = (name, self.clock())
+        else:
+            module.__class__ = type(sys)
+
+    def at_exit(self):
+        """
+        Write the report and the import order, as enabled.
+        """
+        if self.mode:
+            self.dump()
+        if self.order_file:
+            self.write_order(self.order_file)
+
+    def write_order(self, filename):
+        with open(filename, 'w') as fp:
+            for name in self.order:
+                fp.write(name + '\n')
+
+    def dump(self, stream=None):
+        """
+        Write the report to `stream`, sys.stderr by default.
+        """
+        if stream is None:
+            stream = sys.stderr
+        if self.mode == 'importtime':
+            stream.write('import time: self [us] | cumulative | imported package\n')
+            for depth, name, self_time, cumulative in self.imports:
+                stream.write('import time: %9d | %10d | %s%s\n' % (
+                    self_time * 1e6, cumulative * 1e6, '  ' * depth, name))
+            for name, seconds in self.runtime_hooks:
+                stream.write('runtime hook time: %9d | %s\n' % (seconds * 1e6, name))
+            return
+        stream.write('# PyInstaller import profile, times in milliseconds\n')
+        stream.write('#%9s %10s %10s %10s %10s  %s\n' % (
+            self.PHASES + ('exec', 'cumulative', 'module')))
+        for depth, name, self_time, cumulative in sorted(
+                self.imports, key=lambda i: (-i[3], i[1])):
+            phases = self.phases.get(name, {})
+            times = [phases.get(phase, 0.0) for phase in self.PHASES]
+            times.append(self_time - sum(times))
+            times.append(cumulative)
+            stream.write(' %9.3f %10.3f %10.3f %10.3f %10.3f  %s\n' % tuple(
+                [t * 1e3 for t in times] + [name]))
+        if self.runtime_hooks:
+            stream.write('# runtime hooks\n')
+            for name, seconds in self.runtime_hooks:
+                stream.write(' %9.3f  %s\n' % (seconds * 1e3, name))
+
+
+def _getenv(name):
+    """
+    Return the value of the environment variable `name` or None.
+    """
+    environ = pyi_os_path.os_environ
+    if name in environ:
+        return environ[name]
+    # On Python 3 posix.environ has bytes keys and values.
+    if sys.version_info[0] > 2 and name.encode('ascii') in environ:
+        return environ[name.encode('ascii')].decode('ascii', 'replace')
+    return None
+
+
 def install():
     """
     Install FrozenImporter class and other classes into the import machinery.
@@ -663,6 +1208,9 @@ def install():
     # other places.
     fimp = FrozenImporter()
     sys.meta_path.append(fimp)
+    global profiler
+    profiler = ImportProfiler.create(fimp._pyz_archive.options)
+    fimp._pyz_archive.profiler = profiler
     # Add the FrozenImporter to `sys.path_hook`, too, since
     # `pkgutil.get_loader()` does not use `sys.meta_path`. See issue
     # #1689.
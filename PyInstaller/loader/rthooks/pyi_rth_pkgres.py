@@ -8,6 +8,8 @@
 #-----------------------------------------------------------------------------
 
 
+import os
+
 import pkg_resources as res
 from pyimod03_importers import FrozenImporter
 
@@ -17,4 +19,25 @@ from pyimod03_importers import FrozenImporter
 # and other stuff. 'pkg_resources.NullProvider' is dedicated to PEP302
 # import hooks like FrozenImporter is. It uses method __loader__.get_data() in
 # methods pkg_resources.resource_string() and pkg_resources.resource_stream()
-res.register_loader_type(FrozenImporter, res.NullProvider)
+class PyiFrozenProvider(res.NullProvider):
+    """
+    Provider finding and listing resources in the directory index of the
+    PYZ archive and in the file system, and streaming the ones in the
+    archive instead of reading them as a whole.
+    """
+    def _has(self, path):
+        return (self.loader._data_name(path) is not None or
+                self.loader._is_resource_dir(path) or os.path.exists(path))
+
+    def _isdir(self, path):
+        return self.loader._is_resource_dir(path) or os.path.isdir(path)
+
+    def _listdir(self, path):
+        return self.loader._list_resources(path)
+
+    def get_resource_stream(self, manager, resource_name):
+        return self.loader._open_resource(
+            self._fn(self.module_path, resource_name))
+
+
+res.register_loader_type(FrozenImporter, PyiFrozenProvider)
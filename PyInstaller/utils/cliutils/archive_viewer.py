@@ -18,7 +18,6 @@ import argparse
 import os
 import pprint
 import tempfile
-import zlib
 
 from PyInstaller.loader import pyimod02_archive
 from PyInstaller.archive.readers import CArchiveReader, NotAnArchiveError
@@ -147,12 +146,15 @@ def get_archive(name):
 
 def get_data(name, arch):
     if isinstance(arch.toc, dict):
-        (ispkg, pos, length) = arch.toc.get(name, (0, None, 0))
+        (ispkg, pos, length, compressed) = arch.toc.get(name, (0, None, 0, 0))
         if pos is None:
             return None
         with arch.lib:
             arch.lib.seek(arch.start + pos)
-            return zlib.decompress(arch.lib.read(length))
+            data = arch.lib.read(length)
+        if compressed:
+            data = arch.decompress(data)
+        return data
     ndx = arch.toc.find(name)
     dpos, dlen, ulen, flag, typcd, name = arch.toc[ndx]
     x, data = arch.extract(ndx)
@@ -161,7 +163,7 @@ def get_data(name, arch):
 
 def show(name, arch):
     if isinstance(arch.toc, dict):
-        print(" Name: (ispkg, pos, len)")
+        print(" Name: (ispkg, pos, len, iscompressed)")
         toc = arch.toc
     else:
         print(" pos, length, uncompressed, iscompressed, type, name")
@@ -0,0 +1,125 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+
+"""
+Utils for ELF executables (Linux and other Unix systems).
+"""
+
+import struct
+
+from ..building.utils import copy_file_data
+
+
+ELF_MAGIC = b'\x7fELF'
+
+# Values of e_ident[EI_CLASS] and e_ident[EI_DATA].
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+SHT_PROGBITS = 1
+SHN_XINDEX = 0xffff
+
+# ELF header and section header formats without the byte order, indexed by
+# the ELF class.
+_EHDR_FORMAT = {
+    ELFCLASS32: '16sHHIIIIIHHHHHH',
+    ELFCLASS64: '16sHHIQQQIHHHHHH',
+}
+_SHDR_FORMAT = {
+    ELFCLASS32: 'IIIIIIIIII',
+    ELFCLASS64: 'IIQQQQIIQQ',
+}
+
+# The bootloader searches for the cookie at the end of the CArchive only
+# in the last 4096 bytes of the executable, so the section headers written
+# after the CArchive must fit in there.
+MAX_TRAILER_SIZE = 4096 - 100
+
+
+def add_section(filename, section_name, data_filename, align=1):
+    """
+    Add a section named SECTION_NAME containing the data of the file
+    DATA_FILENAME to the ELF executable FILENAME, like
+    `objcopy --add-section` does, but without rewriting the executable.
+
+    The file is changed in place: a new section name string table, the
+    section data and a new section header table are appended and the ELF
+    header is updated to refer to them. The data of the new section is
+    directly followed by the section header table. The data starts at a
+    multiple of ALIGN in the file.
+    """
+    with open(filename, 'r+b') as fp:
+        ident = fp.read(16)
+        if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+            raise ValueError('%s is not an ELF file' % filename)
+        elf_class = _byte(ident, 4)
+        byte_order = {ELFDATA2LSB: '<', ELFDATA2MSB: '>'}.get(_byte(ident, 5))
+        if elf_class not in _EHDR_FORMAT or byte_order is None:
+            raise ValueError('%s has an unsupported ELF class or byte order'
+                             % filename)
+        ehdr_format = byte_order + _EHDR_FORMAT[elf_class]
+        shdr_format = byte_order + _SHDR_FORMAT[elf_class]
+        shdr_size = struct.calcsize(shdr_format)
+
+        fp.seek(0)
+        ehdr = list(struct.unpack(ehdr_format,
+                                  fp.read(struct.calcsize(ehdr_format))))
+        # e_shoff, e_shentsize, e_shnum, e_shstrndx
+        shoff, shentsize, shnum, shstrndx = ehdr[6], ehdr[11], ehdr[12], ehdr[13]
+        if not shoff or not shnum or shstrndx in (0, SHN_XINDEX) \
+                or shstrndx >= shnum or shentsize != shdr_size:
+            raise ValueError('%s has no usable section header table'
+                             % filename)
+        if (shnum + 1) * shdr_size > MAX_TRAILER_SIZE:
+            raise ValueError('%s has too many sections' % filename)
+
+        # Read the section headers and the section name string table.
+        fp.seek(shoff)
+        sections = [list(struct.unpack(shdr_format, fp.read(shdr_size)))
+                    for i in range(shnum)]
+        shstrtab = sections[shstrndx]
+        fp.seek(shstrtab[4])
+        strings = fp.read(shstrtab[5])
+
+        # Append the extended string table.
+        fp.seek(0, 2)
+        name_offset = len(strings)
+        strings += section_name.encode('ascii') + b'\0'
+        shstrtab[4] = fp.tell()
+        shstrtab[5] = len(strings)
+        fp.write(strings)
+
+        # Append the section data.
+        fp.write(b'\0' * (-fp.tell() % align))
+        data_offset = fp.tell()
+        with open(data_filename, 'rb') as data:
+            data_size = copy_file_data(data, fp)
+
+        # Append the section header table, aligned as required.
+        shdr_align = 8 if elf_class == ELFCLASS64 else 4
+        fp.write(b'\0' * (-fp.tell() % shdr_align))
+        new_shoff = fp.tell()
+        sections.append([name_offset, SHT_PROGBITS, 0, 0, data_offset,
+                         data_size, 0, 0, align, 0])
+        for section in sections:
+            fp.write(struct.pack(shdr_format, *section))
+
+        # Refer to the new section header table.
+        ehdr[6] = new_shoff
+        ehdr[12] = len(sections)
+        fp.seek(0)
+        fp.write(struct.pack(ehdr_format, *ehdr))
+
+
+def _byte(data, index):
+    # Indexing bytes returns str on Python 2 and int on Python 3.
+    return bytearray(data[index:index + 1])[0]
@@ -12,7 +12,10 @@
 Decorators for skipping PyInstaller tests when specific requirements are not met.
 """
 
+import os
+import shutil
 import sys
+import tempfile
 import traceback
 import distutils.ccompiler
 
@@ -48,7 +51,17 @@ else:
     #   Users\bjones\AppData\Local\Temp\a.out.exe.manifest : general error
     #   c1010070: Failed to load and parse the manifest. The system cannot find
     #   the file specified.
-    has_compiler = cc.has_function('clock', includes=['time.h'])
+    #
+    # The test program and its object file are written to the current
+    # directory, so run it in a temporary one.
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        os.chdir(tmpdir)
+        has_compiler = cc.has_function('clock', includes=['time.h'])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmpdir, ignore_errors=True)
 del cc
 skipif_no_compiler = skipif(not has_compiler, reason="Requires a C compiler")
 
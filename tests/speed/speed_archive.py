@@ -0,0 +1,76 @@
+"""
+    speed_archive
+
+    Measure the throughput of writing large uncompressed CArchive entries
+    and of appending the archive to the bootloader.
+
+    Usage: python speed_archive.py [size in MiB, default 2048]
+"""
+import os
+import shutil
+import sys
+import time
+
+from os.path import join
+from tempfile import mkdtemp
+
+from PyInstaller import log
+from PyInstaller.archive.writers import CArchiveWriter
+from PyInstaller.building import utils
+from PyInstaller.building.utils import copy_file_data
+
+logger = log.getLogger(__name__)
+
+
+def _report(what, size, duration):
+    logger.warn("%s: %.2f s, %.0f MiB/s", what, duration,
+                size / 1024.0 / 1024.0 / max(duration, 1e-6))
+
+
+def _python_copy_file_data(infh, outfh, length=None):
+    # What copy_file_data() used to be.
+    shutil.copyfileobj(infh, outfh, length=64*1024)
+
+
+def speed_archive(size_mib=2048):
+    log.logging.basicConfig(level=log.DEBUG)
+
+    tempdir = mkdtemp("speed_archive")
+    try:
+        # Create a few large incompressible files of different size.
+        chunk = os.urandom(1024 * 1024)
+        toc = []
+        for i in range(4):
+            name = join(tempdir, 'data%d.bin' % i)
+            with open(name, 'wb') as fh:
+                fh.write(os.urandom(i + 1))
+                for j in range(size_mib // 4):
+                    fh.write(chunk)
+            toc.append(('data%d.bin' % i, name, 0, 'x'))
+        size = sum(os.path.getsize(entry[1]) for entry in toc)
+        pkg = join(tempdir, 'test.pkg')
+        exe = join(tempdir, 'test.exe')
+
+        for label, copy_function in (('python', _python_copy_file_data),
+                                     ('zero-copy', copy_file_data)):
+            # Patch the function the writer uses.
+            import PyInstaller.archive.writers as writers
+            writers.copy_file_data = copy_function
+
+            start = time.time()
+            CArchiveWriter(pkg, toc, pylib_name='libpython.so')
+            _report("CArchive (%s)" % label, size, time.time() - start)
+
+            start = time.time()
+            with open(exe, 'wb') as outf:
+                with open(pkg, 'rb') as infh:
+                    copy_function(infh, outf)
+            _report("Append to EXE (%s)" % label, size, time.time() - start)
+            os.remove(pkg)
+            os.remove(exe)
+        writers.copy_file_data = utils.copy_file_data
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    speed_archive(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,195 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2005-2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+# This contains tests for the class:``COLLECT``.
+
+import marshal
+import os
+
+import pytest
+
+from PyInstaller.building.api import COLLECT
+from PyInstaller.building.utils import EXTENSION_INDEX_NAME
+from PyInstaller.compat import EXTENSION_SUFFIXES
+from PyInstaller.config import CONF
+
+
+@pytest.fixture
+def build_conf(tmpdir, monkeypatch):
+    workpath = tmpdir.join('build').ensure(dir=True)
+    distpath = tmpdir.join('dist').ensure(dir=True)
+    for key, value in (('workpath', workpath.strpath),
+                       ('distpath', distpath.strpath),
+                       ('specpath', tmpdir.join('spec').strpath),
+                       ('spec', tmpdir.join('spec', 'test.spec').strpath),
+                       ('hasUPX', False),
+                       ('noconfirm', True)):
+        monkeypatch.setitem(CONF, key, value)
+    return tmpdir
+
+
+def _collect(toc, **kwargs):
+    # Each build starts counting targets from zero. This keeps the names
+    # of the .toc and .manifest files the same for every build.
+    COLLECT.invcnum = 0
+    return COLLECT(toc, name='app', **kwargs)
+
+
+def _make_files(srcdir, names):
+    toc = []
+    for name in names:
+        src = srcdir.join(name)
+        src.write('content of %s' % name, ensure=True)
+        toc.append((name, src.strpath, 'DATA'))
+    return toc
+
+
+def _collected(distdir):
+    return sorted(os.path.relpath(os.path.join(root, f), distdir)
+                  for root, dirs, files in os.walk(distdir) for f in files)
+
+
+def test_collect(build_conf):
+    toc = _make_files(build_conf.join('src'), ['a.txt', os.path.join('sub', 'b.txt')])
+    _collect(toc)
+    distdir = build_conf.join('dist', 'app')
+    assert _collected(distdir.strpath) == ['a.txt', os.path.join('sub', 'b.txt')]
+    assert distdir.join('sub', 'b.txt').read() == 'content of %s' % os.path.join('sub', 'b.txt')
+
+
+def test_collect_incremental(build_conf):
+    srcdir = build_conf.join('src')
+    distdir = build_conf.join('dist', 'app')
+    toc = _make_files(srcdir, ['a.txt', 'b.txt', os.path.join('sub', 'c.txt')])
+    _collect(toc, incremental=True)
+    a_mtime = distdir.join('a.txt').mtime()
+    # Unchanged contents are not copied again, even if touched.
+    os.utime(srcdir.join('a.txt').strpath, (a_mtime + 100, a_mtime + 100))
+    _collect(toc, incremental=True)
+    assert distdir.join('a.txt').mtime() == a_mtime
+
+    # Change one file, drop another one.
+    srcdir.join('b.txt').write('changed')
+    toc = [entry for entry in toc if entry[0] != os.path.join('sub', 'c.txt')]
+    _collect(toc, incremental=True)
+    assert _collected(distdir.strpath) == ['a.txt', 'b.txt']
+    assert not distdir.join('sub').check()
+    assert distdir.join('b.txt').read() == 'changed'
+    assert distdir.join('a.txt').mtime() == a_mtime
+
+
+def test_collect_incremental_restores_modified_output(build_conf):
+    distdir = build_conf.join('dist', 'app')
+    toc = _make_files(build_conf.join('src'), ['a.txt'])
+    _collect(toc, incremental=True)
+    distdir.join('a.txt').write('modified in dist')
+    _collect(toc, incremental=True)
+    assert distdir.join('a.txt').read() == 'content of a.txt'
+
+
+@pytest.mark.parametrize('link_mode', ['copy', 'hardlink', 'reflink', 'copy_file_range'])
+def test_collect_link_mode(build_conf, link_mode):
+    toc = _make_files(build_conf.join('src'), ['a.txt', os.path.join('sub', 'b.txt')])
+    _collect(toc, link_mode=link_mode)
+    distdir = build_conf.join('dist', 'app')
+    assert _collected(distdir.strpath) == ['a.txt', os.path.join('sub', 'b.txt')]
+    assert distdir.join('a.txt').read() == 'content of a.txt'
+    # Unsupported modes fall back to copying.
+    assert distdir.join('a.txt').mtime() == build_conf.join('src', 'a.txt').mtime()
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='requires hard links')
+def test_collect_hardlink_not_written_through(build_conf):
+    srcdir = build_conf.join('src')
+    distdir = build_conf.join('dist', 'app')
+    toc = _make_files(srcdir, ['a.txt'])
+    _collect(toc, incremental=True, link_mode='hardlink')
+    assert os.path.samefile(srcdir.join('a.txt').strpath, distdir.join('a.txt').strpath)
+    # Rebuilding with copies replaces the link instead of writing through it.
+    srcdir.join('a.txt').write('new content')
+    _collect(toc, incremental=True)
+    assert not os.path.samefile(srcdir.join('a.txt').strpath, distdir.join('a.txt').strpath)
+    assert srcdir.join('a.txt').read() == 'new content'
+    assert distdir.join('a.txt').read() == 'new content'
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='requires hard links')
+def test_collect_hardlink_build_files(build_conf):
+    srcdir = build_conf.join('src')
+    distdir = build_conf.join('dist', 'app')
+    toc = _make_files(srcdir, ['a.txt'])
+    exe = build_conf.join('build', 'app')
+    exe.write('exe')
+    toc.append(('app', exe.strpath, 'EXECUTABLE'))
+    _collect(toc, incremental=True, link_mode='hardlink')
+    assert os.path.samefile(srcdir.join('a.txt').strpath, distdir.join('a.txt').strpath)
+    # Files in the workpath are rewritten by the next build.
+    assert not os.path.samefile(exe.strpath, distdir.join('app').strpath)
+    exe.write('new exe')
+    assert distdir.join('app').read() == 'exe'
+    index = distdir.join(EXTENSION_INDEX_NAME)
+    index_mtime = index.mtime()
+    _collect(toc, incremental=True, link_mode='hardlink')
+    assert distdir.join('app').read() == 'new exe'
+    # The unchanged extension index is not copied again.
+    assert index.mtime() == index_mtime
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='requires hard links')
+def test_collect_hardlink_binary_mode(build_conf):
+    srcdir = build_conf.join('src')
+    distdir = build_conf.join('dist', 'app')
+    src = srcdir.join('libfoo.so')
+    src.write('binary', ensure=True)
+    src.chmod(0o644)
+    _collect([('libfoo.so', src.strpath, 'BINARY')], link_mode='hardlink')
+    # The mode of the binary is changed on a copy, not on the source file.
+    assert not os.path.samefile(src.strpath, distdir.join('libfoo.so').strpath)
+    assert src.stat().mode & 0o777 == 0o644
+    assert distdir.join('libfoo.so').stat().mode & 0o777 == 0o755
+
+
+def test_collect_unknown_link_mode(build_conf):
+    with pytest.raises(ValueError):
+        _collect([], link_mode='symlink')
+
+
+def test_collect_outside_dist_dir(build_conf):
+    distdir = build_conf.join('dist', 'app')
+    toc = _make_files(build_conf.join('src'), ['a.txt'])
+    _collect(toc)
+    bad = _make_files(build_conf.join('src'), ['b.txt'])
+    bad = [(os.path.join(os.pardir, 'b.txt'), bad[0][1], 'DATA')]
+    # The whole TOC is checked before the output directory is touched.
+    with pytest.raises(SystemExit):
+        _collect(toc + bad)
+    assert _collected(distdir.strpath) == ['a.txt']
+
+
+def test_collect_many_files(build_conf):
+    names = [os.path.join('d%d' % (i % 7), 'f%03d.txt' % i) for i in range(100)]
+    toc = _make_files(build_conf.join('src'), names)
+    _collect(toc)
+    distdir = build_conf.join('dist', 'app')
+    assert _collected(distdir.strpath) == sorted(names)
+    for name in names:
+        assert distdir.join(name).read() == 'content of %s' % name
+
+
+def test_collect_extension_index(build_conf):
+    srcdir = build_conf.join('src')
+    toc = _make_files(srcdir, ['app', 'fast' + EXTENSION_SUFFIXES[0]])
+    toc = [(toc[0][0], toc[0][1], 'EXECUTABLE'),
+           ('pkg.fast', toc[1][1], 'EXTENSION')]
+    _collect(toc)
+    distdir = build_conf.join('dist', 'app')
+    fast = 'pkg.fast' + os.path.splitext(EXTENSION_SUFFIXES[0])[1]
+    assert _collected(distdir.strpath) == sorted(['app', fast, EXTENSION_INDEX_NAME])
+    with open(distdir.join(EXTENSION_INDEX_NAME).strpath, 'rb') as fh:
+        assert marshal.load(fh) == {'pkg.fast': fast}
@@ -258,6 +258,87 @@ def test_rsub_non_existing():
     assert result == expected
 
 
+def test_contains():
+    toc = TOC(ELEMS1)
+    assert ELEMS1[0] in toc
+    assert ELEMS2[0] not in toc
+    # Only the exact entry is a member, not one with the same name.
+    assert ('encodings', '/elsewhere/encodings.py', 'PYMODULE') not in toc
+    assert ['encodings', '/usr/lib/python2.7/encodings/__init__.py','PYMODULE'] not in toc
+
+
+def test_iadd():
+    toc = TOC(ELEMS1)
+    alias = toc
+    toc += list(ELEMS2) + list(ELEMS1)
+    assert toc is alias
+    assert isinstance(toc, TOC)
+    expected = list(ELEMS1) + list(ELEMS2)
+    assert toc == expected
+
+
+def test_setitem_keeps_index():
+    toc = TOC(ELEMS1)
+    toc[0] = ELEMS2[0]
+    assert ELEMS1[0] not in toc
+    # The replaced entry can be added again, the new one not.
+    toc.append(ELEMS1[0])
+    toc.append(ELEMS2[0])
+    expected = [ELEMS2[0]] + list(ELEMS1[1:]) + [ELEMS1[0]]
+    assert toc == expected
+
+
+def test_setitem_rejects_duplicates():
+    toc = TOC(ELEMS1)
+    with pytest.raises(ValueError):
+        toc[0] = ELEMS1[1]
+    # An entry with the same name may replace the one in its slot.
+    toc[0] = ('encodings', '/elsewhere/encodings.py', 'PYMODULE')
+    with pytest.raises(ValueError):
+        toc[:] = [ELEMS1[1], ELEMS1[1]]
+    expected = [('encodings', '/elsewhere/encodings.py', 'PYMODULE')] + list(ELEMS1[1:])
+    assert toc == expected
+    del toc[1:]
+    toc.extend(ELEMS1)
+    expected = expected[:1] + list(ELEMS1[1:])
+    assert toc == expected
+
+
+def test_from_entries_class():
+    class SubTOC(TOC):
+        pass
+    assert TOC._from_entries([], {}).__class__ is TOC
+    assert SubTOC._from_entries([], {}).__class__ is SubTOC
+
+
+def test_slice_assignment_keeps_index():
+    toc = TOC(ELEMS1)
+    toc[:] = ELEMS2
+    assert toc == list(ELEMS2)
+    toc.extend(ELEMS1 + ELEMS2)
+    expected = list(ELEMS2) + list(ELEMS1)
+    assert toc == expected
+
+
+def test_remove_and_pop_keep_index():
+    toc = TOC(ELEMS1)
+    toc.remove(ELEMS1[0])
+    last = toc.pop()
+    assert last == ELEMS1[-1]
+    assert toc == [ELEMS1[1]]
+    toc.extend(ELEMS1)
+    expected = [ELEMS1[1], ELEMS1[0], ELEMS1[2]]
+    assert toc == expected
+
+
+def test_append_non_tuple():
+    toc = TOC()
+    with pytest.raises(TypeError):
+        toc.append(list(ELEMS1[0]))
+    with pytest.raises(TypeError):
+        toc.extend([list(ELEMS1[0])])
+
+
 # The following tests verify that case-insensitive comparisons are used on Windows
 # and only for appropriate TOC entry types
 
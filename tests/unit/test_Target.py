@@ -0,0 +1,123 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2005-2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+# This contains tests for the class:``Target`` and the deferred assembly of
+# targets.
+
+import logging
+import threading
+
+import pytest
+
+from PyInstaller.building.datastruct import Target, DeferredAssembly
+from PyInstaller.config import CONF
+
+
+class Concat(Target):
+    """
+    Target concatenating the files in its TOC.
+    """
+    _deferrable = True
+    _GUTS = (('toc', None),)
+
+    def __init__(self, name, toc, events, wait_for=None, signal=None):
+        Target.__init__(self)
+        self.name = name
+        self.toc = toc
+        self.events = events
+        self.wait_for = wait_for
+        self.signal = signal
+        self.__postinit__()
+
+    def _check_guts(self, data, last_build):
+        return True
+
+    def assemble(self):
+        logging.getLogger('PyInstaller').info('assembling %s', self.name)
+        self.events.append(('start', self.name))
+        if self.signal:
+            self.signal.set()
+        if self.wait_for:
+            assert self.wait_for.wait(10)
+        with open(self.name, 'w') as fp:
+            for inm, fnm, typ in self.toc:
+                with open(fnm) as src:
+                    fp.write(src.read())
+        self.events.append(('end', self.name))
+
+
+class Fail(Concat):
+    def assemble(self):
+        self.events.append(('start', self.name))
+        raise SystemExit('cannot assemble %s' % self.name)
+
+
+@pytest.fixture
+def build_conf(tmpdir, monkeypatch):
+    monkeypatch.setitem(CONF, 'workpath', tmpdir.strpath)
+    tmpdir.join('src').write('src')
+    return tmpdir
+
+
+def _entry(path):
+    return (path.basename, path.strpath, 'DATA')
+
+
+def test_assemble_immediately(build_conf):
+    events = []
+    Concat(build_conf.join('a').strpath, [_entry(build_conf.join('src'))], events)
+    assert events == [('start', build_conf.join('a').strpath),
+                      ('end', build_conf.join('a').strpath)]
+
+
+def test_deferred_assembly(build_conf):
+    events = []
+    a, b, c = [build_conf.join(n) for n in 'abc']
+    started = threading.Event()
+    with DeferredAssembly(4) as deferred:
+        # `a` only finishes if `b` runs at the same time.
+        Concat(a.strpath, [_entry(build_conf.join('src'))], events,
+               wait_for=started)
+        Concat(b.strpath, [_entry(build_conf.join('src'))], events,
+               signal=started)
+        Concat(c.strpath, [_entry(a), _entry(b)], events)
+        assert events == []
+    deferred.run()
+    assert c.read() == 'srcsrc'
+    assert events.index(('start', c.strpath)) > events.index(('end', a.strpath))
+    assert events.index(('start', c.strpath)) > events.index(('end', b.strpath))
+    assert deferred.dependencies == [[], [], [0, 1]]
+
+
+def test_deferred_assembly_log_order(build_conf, caplog):
+    a, b = [build_conf.join(n) for n in 'ab']
+    started = threading.Event()
+    with caplog.at_level(logging.INFO):
+        with DeferredAssembly(4) as deferred:
+            # `a` finishes after `b`, but is logged first.
+            Concat(a.strpath, [_entry(build_conf.join('src'))], [],
+                   wait_for=started)
+            Concat(b.strpath, [_entry(build_conf.join('src'))], [])
+        threading.Timer(0.2, started.set).start()
+        deferred.run()
+    messages = [r.getMessage() for r in caplog.records
+                if r.getMessage().startswith('assembling')]
+    assert messages == ['assembling %s' % a.strpath, 'assembling %s' % b.strpath]
+
+
+def test_deferred_assembly_failure(build_conf):
+    events = []
+    a, b = [build_conf.join(n) for n in 'ab']
+    with DeferredAssembly(4) as deferred:
+        Fail(a.strpath, [_entry(build_conf.join('src'))], events)
+        Concat(b.strpath, [_entry(a)], events)
+    with pytest.raises(SystemExit):
+        deferred.run()
+    # Targets depending on a failed one are not started.
+    assert events == [('start', a.strpath)]
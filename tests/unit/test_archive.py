@@ -0,0 +1,409 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2005-2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+# This contains tests for the archive writers and readers.
+
+import io
+import os
+import time
+
+import pytest
+
+from PyInstaller.archive.readers import CArchiveReader
+from PyInstaller.archive.writers import CArchiveWriter, ZlibArchiveWriter, \
+    is_incompressible, compression_override, train_zdict, load_or_train_zdict, \
+    ZDICT_SIZE, PAGE_SIZE
+from PyInstaller.compat import is_py2, is_win
+from PyInstaller.loader import pyimod02_archive
+from PyInstaller.loader.pyimod02_archive import ZlibArchiveReader, \
+    LRUCache, PYZ_TYPE_DATA, PYZ_TYPE_MODULE
+
+
+class SerialCArchiveWriter(CArchiveWriter):
+    # Add entries one by one without any threads.
+    def _add_from_table_of_contents(self, toc):
+        for entry in toc:
+            self.add(entry)
+
+
+@pytest.fixture
+def carchive_toc(tmpdir):
+    toc = []
+    for i in range(20):
+        path = tmpdir.join('data', 'file%02d.dat' % i)
+        if i % 3:
+            content = os.urandom(1000 * i)
+        else:
+            content = b'compressible ' * 1000 * i
+        path.write_binary(content, ensure=True)
+        toc.append(('file%02d.dat' % i, path.strpath, i % 2, 'x'))
+    toc.append(('v', '', 0, 'o'))
+    return toc
+
+
+def test_carchive_parallel_is_identical(tmpdir, carchive_toc, monkeypatch):
+    # Force several batches.
+    monkeypatch.setattr(CArchiveWriter, 'PARALLEL_BATCH_SIZE', 20000)
+    parallel = tmpdir.join('parallel.pkg')
+    serial = tmpdir.join('serial.pkg')
+    CArchiveWriter(parallel.strpath, carchive_toc, pylib_name='libpython.so')
+    SerialCArchiveWriter(serial.strpath, carchive_toc, pylib_name='libpython.so')
+    assert parallel.read_binary() == serial.read_binary()
+
+
+def test_carchive_roundtrip(tmpdir, carchive_toc):
+    pkg = tmpdir.join('test.pkg')
+    CArchiveWriter(pkg.strpath, carchive_toc, pylib_name='libpython.so')
+    reader = CArchiveReader(pkg.strpath)
+    assert reader.contents() == [entry[0] for entry in carchive_toc]
+    for nm, path, flag, typcd in carchive_toc:
+        if typcd == 'o':
+            continue
+        with open(path, 'rb') as fh:
+            assert reader.extract(nm) == (False, fh.read())
+
+
+def test_is_incompressible():
+    assert is_incompressible('image.png', io.BytesIO(b'a' * 100))
+    assert is_incompressible('random.bin', io.BytesIO(os.urandom(300000)))
+    assert not is_incompressible('text.txt', io.BytesIO(b'abc ' * 100000))
+    # Small files are always compressed.
+    assert not is_incompressible('random.bin', io.BytesIO(os.urandom(1000)))
+
+
+def test_compression_override():
+    cpatterns = [('*.txt', 0), ('data/*', 1)]
+    assert compression_override('data/a.txt', cpatterns) == 0
+    assert compression_override('data/a.bin', cpatterns) == 1
+    assert compression_override('a.bin', cpatterns) is None
+
+
+def test_carchive_stores_incompressible(tmpdir, carchive_toc):
+    pkg = tmpdir.join('test.pkg')
+    CArchiveWriter(pkg.strpath, carchive_toc, pylib_name='libpython.so')
+    reader = CArchiveReader(pkg.strpath)
+    for dpos, dlen, ulen, flag, typcd, nm in reader.toc.data:
+        assert dlen <= ulen
+        if typcd != 'o' and ulen and ulen == dlen:
+            assert flag == 0
+
+
+def test_pyz_stores_incompressible(tmpdir):
+    contents = {
+        'random.bin': os.urandom(100000),
+        'text.txt': b'compressible ' * 10000,
+        'image.png': b'compressible ' * 10000,
+        'forced.png': b'compressible ' * 10000,
+    }
+    toc = []
+    for name, content in sorted(contents.items()):
+        path = tmpdir.join(name)
+        path.write_binary(content)
+        toc.append((name, path.strpath, 'DATA'))
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, toc, cpatterns=[('forced.*', 1)],
+                      skip_incompressible=True)
+    reader = ZlibArchiveReader(pyz.strpath)
+    compressed = dict((name, entry[3]) for name, entry in reader.toc.items())
+    assert compressed == {'random.bin': 0, 'text.txt': 1, 'image.png': 0,
+                          'forced.png': 1}
+    for name, content in contents.items():
+        assert reader.extract(name) == (PYZ_TYPE_DATA, content)
+
+
+@pytest.fixture
+def pyz_modules(tmpdir):
+    toc = []
+    code_dict = {}
+    for i in range(50):
+        name = 'mod%02d' % i
+        source = 'import os\n\n'
+        for j in range(i % 5 + 1):
+            source += ('def function_%d_%d(path, *args):\n'
+                       '    """Return the joined path."""\n'
+                       '    return os.path.join(path, *args) + %r\n\n'
+                       % (i, j, name))
+        path = tmpdir.join(name + '.py')
+        path.write(source)
+        toc.append((name, path.strpath, 'PYMODULE'))
+        code_dict[name] = compile(source, path.strpath, 'exec')
+    return toc, code_dict
+
+
+@pytest.mark.parametrize('mapped', [True, False])
+def test_pyz_reader(tmpdir, pyz_modules, monkeypatch, mapped):
+    if mapped and is_win:
+        pytest.skip('The PYZ is not mapped on Windows')
+    toc, code_dict = pyz_modules
+    data = tmpdir.join('data.txt')
+    data.write_binary(b'data ' * 1000)
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, toc + [('data.txt', data.strpath, 'DATA')],
+                      code_dict=code_dict)
+    # Embed the PYZ into another file, like into an executable.
+    exe = tmpdir.join('test.exe')
+    exe.write_binary(b'exe' * 100 + pyz.read_binary() + b'more' * 100)
+    if not mapped:
+        monkeypatch.setattr(ZlibArchiveReader, '_map_file', lambda self, path: None)
+    reader = ZlibArchiveReader('%s?%d' % (exe.strpath, 300))
+    assert (reader._mmap is not None) == mapped
+    assert reader.extract('data.txt') == (PYZ_TYPE_DATA, b'data ' * 1000)
+    for name, path, typ in toc:
+        assert reader.extract(name) == (PYZ_TYPE_MODULE, code_dict[name])
+    assert reader.extract('missing') is None
+
+
+def test_lru_cache():
+    cache = LRUCache(10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+    # Drops 'b', the least recently used entry.
+    cache.put('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('c') == b'cccc'
+    assert cache.get('a') == b'aaaa'
+    # Too large for the cache.
+    cache.put('d', b'd' * 11)
+    assert cache.get('d') is None
+    assert (len(cache), cache.size, cache.hits, cache.misses) == (2, 8, 3, 2)
+
+
+def test_pyz_cache(tmpdir, pyz_modules):
+    toc, code_dict = pyz_modules
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, toc, code_dict=code_dict)
+    assert ZlibArchiveReader(pyz.strpath).cache is None
+
+    ZlibArchiveWriter(pyz.strpath, toc, code_dict=code_dict,
+                      options={'cache_size': 100000})
+    reader = ZlibArchiveReader(pyz.strpath)
+    for name in ('mod01', 'mod02', 'mod01'):
+        assert reader.extract(name) == (PYZ_TYPE_MODULE, code_dict[name])
+    assert (reader.cache.hits, reader.cache.misses) == (1, 2)
+
+
+def test_train_zdict():
+    samples = [b'common prefix ' * 10 + os.urandom(100) for i in range(100)]
+    zdict = train_zdict(samples)
+    assert 0 < len(zdict) <= ZDICT_SIZE
+    assert b'common prefix ' in zdict
+    # Segments found in one sample only are no use.
+    assert train_zdict([os.urandom(1000)]) == b''
+
+
+def test_load_or_train_zdict(tmpdir):
+    filename = tmpdir.join('test.zdict').strpath
+    names = ['mod%02d' % i for i in range(10)]
+    samples = [b'common prefix ' * 10 + os.urandom(100) for name in names]
+    zdict = load_or_train_zdict(filename, names, samples)
+    assert zdict == train_zdict(samples)
+
+    def no_training():
+        raise AssertionError('zdict trained again')
+        yield
+    # A few changed modules keep the saved dictionary.
+    assert load_or_train_zdict(filename, names[1:] + ['new'], no_training()) == zdict
+    other = [b'other prefix ' * 10 + os.urandom(100) for name in names]
+    assert load_or_train_zdict(filename, names[:5] + ['new'], other) == \
+        train_zdict(other)
+    tmpdir.join('test.zdict').write('garbage')
+    assert load_or_train_zdict(filename, names, samples) == zdict
+
+
+@pytest.mark.skipif(is_py2, reason='zdict requires Python 3')
+def test_pyz_zdict(tmpdir, pyz_modules):
+    import marshal
+    toc, code_dict = pyz_modules
+    zdict = train_zdict([marshal.dumps(code) for code in code_dict.values()])
+    plain = tmpdir.join('plain.pyz')
+    ZlibArchiveWriter(plain.strpath, toc, code_dict=code_dict)
+    with_zdict = tmpdir.join('zdict.pyz')
+    ZlibArchiveWriter(with_zdict.strpath, toc, code_dict=code_dict,
+                      zdict=zdict)
+
+    reader = ZlibArchiveReader(plain.strpath)
+    assert reader.zdict is None
+    reader = ZlibArchiveReader(with_zdict.strpath)
+    assert reader.zdict == zdict
+    entries_size = lambda r: sum(entry[2] for entry in r.toc.values())
+    assert entries_size(reader) < entries_size(ZlibArchiveReader(plain.strpath))
+    for name, code in code_dict.items():
+        assert reader.extract(name) == (PYZ_TYPE_MODULE, code)
+
+
+def test_carchive_dedup(tmpdir, carchive_toc):
+    toc = carchive_toc + [('copy/' + nm, path, flag, typcd)
+                          for nm, path, flag, typcd in carchive_toc[:10]]
+    # Same content, but stored uncompressed.
+    assert carchive_toc[3][2] == 1
+    toc.append(('copy/other.dat', carchive_toc[3][1], 0, 'x'))
+    single = tmpdir.join('single.pkg')
+    CArchiveWriter(single.strpath, carchive_toc, pylib_name='libpython.so')
+    pkg = tmpdir.join('test.pkg')
+    CArchiveWriter(pkg.strpath, toc, pylib_name='libpython.so')
+    reader = CArchiveReader(pkg.strpath)
+    positions = dict((nm, (dpos, dlen)) for dpos, dlen, ulen, flag, typcd, nm
+                     in reader.toc.data)
+    for nm, path, flag, typcd in carchive_toc[:10]:
+        assert positions['copy/' + nm] == positions[nm]
+        with open(path, 'rb') as fh:
+            assert reader.extract('copy/' + nm) == (False, fh.read())
+    assert positions['copy/other.dat'] != positions[carchive_toc[3][0]]
+    assert reader.extract('copy/other.dat') == \
+        reader.extract(carchive_toc[3][0])
+    # Only the uncompressed copy and the TOC entries add to the size.
+    assert pkg.size() - single.size() < \
+        os.path.getsize(carchive_toc[3][1]) + 100 * (len(toc) - len(carchive_toc))
+
+
+def test_pyz_dedup(tmpdir):
+    toc = []
+    for name in ('a.dat', 'b.dat', 'c.dat'):
+        path = tmpdir.join(name)
+        path.write_binary(b'c' * 1000 if name == 'c.dat' else b'same' * 1000)
+        toc.append((name, path.strpath, 'DATA'))
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, toc)
+    reader = ZlibArchiveReader(pyz.strpath)
+    assert reader.toc['a.dat'] == reader.toc['b.dat']
+    assert reader.toc['a.dat'] != reader.toc['c.dat']
+    assert reader.extract('b.dat') == (PYZ_TYPE_DATA, b'same' * 1000)
+
+
+def test_pyz_blob_cache(tmpdir, pyz_modules, monkeypatch):
+    toc, code_dict = pyz_modules
+    first = tmpdir.join('first.pyz')
+    writer = ZlibArchiveWriter(first.strpath, toc, code_dict=code_dict,
+                               blob_cache={})
+    blob_cache = writer.new_blob_cache
+    assert len(blob_cache) == len(toc)
+
+    # Change one module. Only this one is compressed again.
+    code_dict = dict(code_dict)
+    code_dict['mod00'] = compile('x = 1', toc[0][1], 'exec')
+    compressed = []
+    compress = ZlibArchiveWriter.compress
+    def counting_compress(self, data):
+        compressed.append(data)
+        return compress(self, data)
+    monkeypatch.setattr(ZlibArchiveWriter, 'compress', counting_compress)
+    second = tmpdir.join('second.pyz')
+    writer = ZlibArchiveWriter(second.strpath, toc, code_dict=code_dict,
+                               blob_cache=blob_cache)
+    assert len(compressed) == 1
+    assert len(writer.new_blob_cache) == len(toc)
+
+    uncached = tmpdir.join('uncached.pyz')
+    ZlibArchiveWriter(uncached.strpath, toc, code_dict=code_dict)
+    assert second.read_binary() == uncached.read_binary()
+
+
+def test_carchive_blob_cache(tmpdir, carchive_toc, monkeypatch):
+    import zlib
+    first = tmpdir.join('first.pkg')
+    writer = CArchiveWriter(first.strpath, carchive_toc,
+                            pylib_name='libpython.so',
+                            blob_cache={'blobs': {}, 'stats': {},
+                                        'incompressible': set()})
+    blob_cache = writer.new_blob_cache
+
+    # Change one compressed file.
+    changed = carchive_toc[5][1]
+    assert carchive_toc[5][2] == 1
+    with open(changed, 'ab') as fh:
+        fh.write(b'changed')
+    compressobj = zlib.compressobj
+    compressed = []
+    def counting_compressobj(*args):
+        compressed.append(args)
+        return compressobj(*args)
+    monkeypatch.setattr(zlib, 'compressobj', counting_compressobj)
+    second = tmpdir.join('second.pkg')
+    CArchiveWriter(second.strpath, carchive_toc, pylib_name='libpython.so',
+                   blob_cache=blob_cache, previous_archive=first.strpath)
+    assert len(compressed) == 1
+
+    uncached = tmpdir.join('uncached.pkg')
+    CArchiveWriter(uncached.strpath, carchive_toc, pylib_name='libpython.so')
+    assert second.read_binary() == uncached.read_binary()
+
+
+def test_pyz_preload(tmpdir, pyz_modules):
+    toc, code_dict = pyz_modules
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, toc, code_dict=code_dict,
+                      options={'preload': ['mod03', 'missing', 'mod01']})
+    reader = ZlibArchiveReader(pyz.strpath)
+    reader.start_preload()
+    deadline = time.time() + 10
+    while len(reader._preloaded) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sorted(reader._preloaded) == ['mod01', 'mod03']
+    for name in ('mod01', 'mod02', 'mod03'):
+        assert reader.extract(name) == (PYZ_TYPE_MODULE, code_dict[name])
+    assert reader._preloaded == {}
+
+
+@pytest.mark.parametrize('mapped', [True, False])
+def test_pyz_open_entry(tmpdir, monkeypatch, mapped):
+    content = ''.join('%d\n' % i for i in range(20000)).encode('ascii')
+    data = tmpdir.join('data.txt')
+    data.write_binary(content)
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, [('data.txt', data.strpath, 'DATA')])
+    if not mapped:
+        monkeypatch.setattr(ZlibArchiveReader, '_map_file', lambda self, path: None)
+    reader = ZlibArchiveReader(pyz.strpath)
+    assert reader.toc['data.txt'][3]
+    if not is_py2:
+        # Decompress in many small chunks.
+        monkeypatch.setattr(pyimod02_archive.EntryStream, 'CHUNK_SIZE', 1000)
+    fp = reader.open_entry('data.txt')
+    assert fp.readline() == b'0\n'
+    assert fp.read(4) == b'1\n2\n'
+    assert fp.read() == content[6:]
+    assert fp.read() == b''
+    assert reader.open_entry('missing') is None
+
+
+def test_pyz_page_align(tmpdir, pyz_modules):
+    toc, code_dict = pyz_modules
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, toc, code_dict=code_dict,
+                      cpatterns=[('mod0*', 1), ('*', 0)], page_align=True)
+    reader = ZlibArchiveReader(pyz.strpath)
+    for name, path, typ in toc:
+        typ, pos, length, compressed = reader.toc[name]
+        assert compressed == name.startswith('mod0')
+        assert compressed or pos % PAGE_SIZE == 0
+        assert reader.extract(name) == (PYZ_TYPE_MODULE, code_dict[name])
+
+
+def test_carchive_page_aligns_pyz(tmpdir):
+    data = tmpdir.join('data.txt')
+    data.write('data')
+    pyz = tmpdir.join('test.pyz')
+    pyz.write('pyz')
+    carchive = tmpdir.join('test.pkg')
+    SerialCArchiveWriter(carchive.strpath,
+                         [('data.txt', data.strpath, 0, 'x'),
+                          ('PYZ-00.pyz', pyz.strpath, 0, 'z')],
+                         pylib_name='libpython.so', page_align=True)
+    reader = CArchiveReader(carchive.strpath)
+    dpos = reader.toc.get(reader.toc.find('PYZ-00.pyz'))[0]
+    assert dpos % PAGE_SIZE == 0
+    assert reader.extract('PYZ-00.pyz')[1] == b'pyz'
+    # Without page-aligned PYZs the archive is not padded.
+    SerialCArchiveWriter(carchive.strpath,
+                         [('data.txt', data.strpath, 0, 'x'),
+                          ('PYZ-00.pyz', pyz.strpath, 0, 'z')],
+                         pylib_name='libpython.so')
+    reader = CArchiveReader(carchive.strpath)
+    assert reader.toc.get(reader.toc.find('PYZ-00.pyz'))[0] < PAGE_SIZE
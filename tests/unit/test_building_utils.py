@@ -0,0 +1,102 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+import errno
+import marshal
+import os
+
+import pytest
+
+from PyInstaller.building import utils
+
+
+@pytest.fixture(params=['kernel', 'python', 'fallback'])
+def copy_mode(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(utils, '_kernel_copy_function', lambda: None)
+    elif request.param == 'fallback':
+        def copy_range(infd, outfd, count):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        monkeypatch.setattr(utils, '_kernel_copy_function', lambda: copy_range)
+    return request.param
+
+
+def test_copy_file_data(tmpdir, copy_mode):
+    data = os.urandom(3 * utils.COPY_BUFSIZE + 123)
+    src = tmpdir.join('src')
+    src.write_binary(data)
+    dst = tmpdir.join('dst')
+    with open(src.strpath, 'rb') as infh:
+        with open(dst.strpath, 'wb') as outfh:
+            outfh.write(b'head')
+            infh.read(10)
+            assert utils.copy_file_data(infh, outfh, 1000) == 1000
+            assert infh.tell() == 1010
+            assert utils.copy_file_data(infh, outfh) == len(data) - 1010
+            outfh.write(b'tail')
+    assert dst.read_binary() == b'head' + data[10:] + b'tail'
+
+
+def test_strip_paths_in_code(tmpdir, monkeypatch):
+    from PyInstaller.config import CONF
+    lib = os.path.join(tmpdir.strpath, 'lib')
+    site_packages = os.path.join(lib, 'site-packages')
+    monkeypatch.setattr('sys.path', [lib, site_packages])
+    monkeypatch.setitem(CONF, 'pathex', [])
+    filename = os.path.join(site_packages, 'pkg', 'mod.py')
+    co = compile('def f():\n    pass\n', filename, 'exec')
+
+    stripped = utils.strip_paths_in_code(co)
+    # The longest matching path is removed.
+    expected = os.path.join('pkg', 'mod.py')
+    assert stripped.co_filename == expected
+    nested = [c for c in stripped.co_consts if hasattr(c, 'co_filename')]
+    assert [c.co_filename for c in nested] == [expected]
+
+    other = compile('pass', os.path.join(tmpdir.strpath, 'mod.py'), 'exec')
+    assert utils.strip_paths_in_code(other) is other
+
+
+def test_sort_by_import_order(tmpdir):
+    order_file = tmpdir.join('import-order.txt')
+    order_file.write('# recorded\nzlib\nmain\n\nos\nzlib\nmissing\n')
+    order = utils.load_import_order(order_file.strpath)
+    assert order == ['zlib', 'main', 'os', 'zlib', 'missing']
+    assert utils.load_import_order(tmpdir.join('none.txt').strpath) == []
+    entries = [('abc', 2), ('main', 0), ('os', 1), ('abc', 1), ('zlib', 3)]
+    # The others are sorted by name, then by the other items.
+    assert utils.sort_by_import_order(entries, order) == \
+        [('zlib', 3), ('main', 0), ('os', 1), ('abc', 1), ('abc', 2)]
+    assert utils.sort_by_import_order(entries, [], key=lambda e: e[1]) == \
+        [('main', 0), ('os', 1), ('abc', 1), ('abc', 2), ('zlib', 3)]
+
+
+def test_extension_index(tmpdir):
+    ext = utils.EXTENSION_SUFFIXES[0]
+    toc = [('pkg.fast', '/build/fast' + ext, 'EXTENSION'),
+           ('other' + ext, '/build/other' + ext, 'EXTENSION'),
+           # Added by the user as a binary.
+           ('extra' + ext, '/build/extra' + ext, 'BINARY'),
+           ('../dist/app:shared' + ext, '/build/shared' + ext, 'DEPENDENCY'),
+           ('libz.so.1', '/lib/libz.so.1', 'BINARY'),
+           (os.path.join('sub', 'nested' + ext), '/build/nested' + ext, 'DATA'),
+           ('mod', '/build/mod.py', 'PYMODULE')]
+    # Like add_suffix_to_extensions(), use the extension of the file.
+    fast = 'pkg.fast' + os.path.splitext(ext)[1]
+    index = utils.extension_index(toc)
+    assert index['pkg.fast'] == fast
+    assert index['other'] == 'other' + ext
+    assert index['extra'] == 'extra' + ext
+    assert index['shared'] == 'shared' + ext
+    assert not [name for name in index if name.startswith(('libz', 'sub', 'mod'))]
+    filename = tmpdir.join('index').strpath
+    assert utils.write_extension_index(toc, filename) == \
+        (utils.EXTENSION_INDEX_NAME, filename, 'DATA')
+    with open(filename, 'rb') as fh:
+        assert marshal.load(fh) == index
@@ -0,0 +1,78 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+import os
+import shutil
+import struct
+import sys
+
+import pytest
+
+from PyInstaller import HOMEPATH
+from PyInstaller.compat import is_linux
+from PyInstaller.utils import elf
+from PyInstaller.utils.elf import add_section
+
+
+ELF_FILES = [os.path.join(HOMEPATH, 'PyInstaller', 'bootloader',
+                          'Linux-32bit', 'run')]
+if is_linux:
+    ELF_FILES.append(os.path.realpath(sys.executable))
+
+
+def _read_sections(content):
+    """
+    Return the sections of the ELF file CONTENT as a dict mapping the name
+    to (sh_offset, sh_size, sh_addralign).
+    """
+    elf_class = bytearray(content[4:5])[0]
+    byte_order = {elf.ELFDATA2LSB: '<', elf.ELFDATA2MSB: '>'}[bytearray(content[5:6])[0]]
+    ehdr = struct.unpack_from(byte_order + elf._EHDR_FORMAT[elf_class], content)
+    shoff, shentsize, shnum, shstrndx = ehdr[6], ehdr[11], ehdr[12], ehdr[13]
+    shdr_format = byte_order + elf._SHDR_FORMAT[elf_class]
+    sections = [struct.unpack_from(shdr_format, content, shoff + i * shentsize)
+                for i in range(shnum)]
+    strtab = sections[shstrndx]
+    strings = content[strtab[4]:strtab[4] + strtab[5]]
+    result = {}
+    for section in sections:
+        name = strings[section[0]:strings.index(b'\0', section[0])]
+        result[name.decode('ascii')] = (section[4], section[5], section[8])
+    return result
+
+
+@pytest.mark.parametrize('align', [1, 4096])
+@pytest.mark.parametrize('elf_file', ELF_FILES)
+def test_add_section(tmpdir, elf_file, align):
+    if not os.path.exists(elf_file):
+        pytest.skip('%s does not exist' % elf_file)
+    exe = tmpdir.join('exe').strpath
+    shutil.copy(elf_file, exe)
+    data = tmpdir.join('data')
+    data.write_binary(os.urandom(100001))
+    add_section(exe, 'pydata', data.strpath, align=align)
+
+    content = tmpdir.join('exe').read_binary()
+    # The existing sections are kept.
+    assert set(_read_sections(content)) >= \
+        set(_read_sections(open(elf_file, 'rb').read()))
+    offset, size, addralign = _read_sections(content)['pydata']
+    assert content[offset:offset + size] == data.read_binary()
+    assert offset % align == 0
+    assert addralign == align
+    # Only the section headers follow the data, the bootloader searches
+    # the last 4096 bytes for the end of the archive.
+    assert len(content) - 4096 < offset + size
+
+
+def test_add_section_not_elf(tmpdir):
+    exe = tmpdir.join('exe')
+    exe.write_binary(b'MZ' + b'\0' * 100)
+    with pytest.raises(ValueError):
+        add_section(exe.strpath, 'pydata', exe.strpath)
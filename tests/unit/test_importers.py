@@ -0,0 +1,258 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2005-2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+# This contains tests for the importers used by frozen apps.
+
+import marshal
+import os
+import sys
+import time
+
+import pytest
+
+from PyInstaller import HOMEPATH
+from PyInstaller.archive.writers import ZlibArchiveWriter
+
+
+@pytest.fixture
+def frozen_importer(tmpdir, monkeypatch, request):
+    """
+    Return a FrozenImporter for a PYZ with a package, two modules and
+    data files of the package.
+    """
+    meipass = tmpdir.join('meipass').ensure(dir=True)
+    sources = {
+        'pkg': 'value = "pkg"\n',
+        'pkg.mod': 'from . import other\nvalue = other.value + "mod"\n',
+        'pkg.other': 'value = "other"\n',
+    }
+    toc = []
+    code_dict = {}
+    for name, source in sorted(sources.items()):
+        path = tmpdir.join(name + '.py')
+        path.write(source)
+        toc.append((name, path.strpath, 'PYMODULE'))
+        code_dict[name] = compile(source, path.strpath, 'exec')
+    # Make 'pkg' a package.
+    toc[0] = ('pkg', tmpdir.join('pkg', '__init__.py').strpath, 'PYMODULE')
+    tmpdir.join('pkg', '__init__.py').write(sources['pkg'], ensure=True)
+    for name in ('data.txt', 'sub/more.txt'):
+        path = tmpdir.join('data', name)
+        path.write_binary(name.encode('ascii') * 100, ensure=True)
+        toc.append((os.path.join('pkg', *name.split('/')), path.strpath, 'DATA'))
+    pyz = tmpdir.join('test.pyz')
+    ZlibArchiveWriter(pyz.strpath, toc, code_dict=code_dict)
+
+    # The loader modules expect to run in a frozen app.
+    monkeypatch.setattr(sys, '_MEIPASS', meipass.strpath, raising=False)
+    monkeypatch.syspath_prepend(os.path.join(HOMEPATH, 'PyInstaller', 'loader'))
+
+    def unload():
+        for name in ('pyimod01_os_path', 'pyimod02_archive',
+                     'pyimod03_importers', 'pkg', 'pkg.mod', 'pkg.other'):
+            sys.modules.pop(name, None)
+    request.addfinalizer(unload)
+
+    import pyimod03_importers
+    monkeypatch.syspath_prepend(pyz.strpath)
+    return pyimod03_importers.FrozenImporter()
+
+
+def test_metadata_from_toc(frozen_importer, monkeypatch):
+    def extract(name):
+        raise AssertionError('%s extracted' % name)
+    monkeypatch.setattr(frozen_importer._pyz_archive, 'extract', extract)
+    assert frozen_importer.is_package('pkg')
+    assert not frozen_importer.is_package('pkg.mod')
+    assert frozen_importer.get_filename('pkg') == \
+        os.path.join(sys._MEIPASS, 'pkg', '__init__.pyc')
+    assert frozen_importer.get_filename('pkg.mod') == \
+        os.path.join(sys._MEIPASS, 'pkg', 'mod.pyc')
+    with pytest.raises(ImportError):
+        frozen_importer.is_package('missing')
+    if sys.version_info >= (3, 4):
+        spec = frozen_importer.find_spec('pkg')
+        assert spec.submodule_search_locations == [os.path.join(sys._MEIPASS, 'pkg')]
+        assert frozen_importer.find_spec('missing') is None
+
+
+@pytest.mark.skipif(sys.version_info < (3, 4), reason='PEP 451 requires Python 3.4')
+def test_find_spec_exec_module(frozen_importer, monkeypatch):
+    monkeypatch.setattr(sys, 'meta_path', [frozen_importer] + sys.meta_path)
+    import importlib
+    mod = importlib.import_module('pkg.mod')
+    assert mod.value == 'othermod'
+    assert mod.__file__ == os.path.join(sys._MEIPASS, 'pkg', 'mod.pyc')
+    assert mod.__loader__ is frozen_importer
+    assert mod.__package__ == 'pkg'
+    pkg = sys.modules['pkg']
+    assert pkg.__path__ == [os.path.join(sys._MEIPASS, 'pkg')]
+    assert pkg.__spec__.origin == pkg.__file__
+
+
+def test_path_hook(frozen_importer):
+    with pytest.raises(ImportError):
+        frozen_importer(sys._MEIPASS)
+    finder = frozen_importer(os.path.join(sys._MEIPASS, 'pkg'))
+    assert finder.find_module('pkg.mod') is frozen_importer
+    assert finder.find_module('pkg.missing') is None
+    if sys.version_info >= (3, 4):
+        # Path entry finders get the module to reload instead of a path.
+        spec = finder.find_spec('pkg.mod', sys)
+        assert spec.loader is frozen_importer
+        assert spec.origin == os.path.join(sys._MEIPASS, 'pkg', 'mod.pyc')
+        assert finder.find_spec('pkg.missing') is None
+
+
+def _dump(profiler):
+    class Stream(list):
+        write = list.append
+    stream = Stream()
+    profiler.dump(stream)
+    return ''.join(stream).splitlines()
+
+
+def test_import_profile(frozen_importer, monkeypatch):
+    import pyimod03_importers
+    ImportProfiler = pyimod03_importers.ImportProfiler
+    monkeypatch.setattr(pyimod03_importers.pyi_os_path, 'os_environ', {})
+    assert ImportProfiler.create({}) is None
+    profiler = ImportProfiler.create({'import_profile': 'report'})
+    monkeypatch.setattr(pyimod03_importers, 'profiler', profiler)
+    monkeypatch.setattr(frozen_importer._pyz_archive, 'profiler', profiler)
+    monkeypatch.setattr(sys, 'meta_path', [frozen_importer] + sys.meta_path)
+    import importlib
+    importlib.import_module('pkg.mod')
+
+    assert [(depth, name) for depth, name, self_time, cumulative
+            in profiler.imports] == [(0, 'pkg'), (1, 'pkg.other'), (0, 'pkg.mod')]
+    mod = profiler.imports[-1]
+    assert mod[3] >= mod[2] + profiler.imports[1][3]
+    assert sorted(profiler.phases['pkg.mod']) == ['decompress', 'read', 'unmarshal']
+
+    report = _dump(profiler)
+    assert report[0].startswith('# PyInstaller import profile')
+    assert report[2].endswith('  pkg.mod') and report[-1].endswith('  pkg.other')
+
+    # The environment overrides the option of the archive.
+    monkeypatch.setattr(pyimod03_importers.pyi_os_path, 'os_environ',
+                        {ImportProfiler.ENV_VAR: 'importtime'})
+    profiler.mode = ImportProfiler.create({'import_profile': 'report'}).mode
+    report = _dump(profiler)
+    assert report[0] == 'import time: self [us] | cumulative | imported package'
+    assert report[2].endswith('|   pkg.other')
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5),
+                    reason='changing the class of a module requires Python 3.5')
+def test_time_runtime_hooks(frozen_importer, monkeypatch):
+    import types
+    import pyimod03_importers
+    profiler = pyimod03_importers.ImportProfiler('report', time.time)
+    monkeypatch.setattr(pyimod03_importers, 'profiler', profiler)
+    main = types.ModuleType('__main__')
+    monkeypatch.setitem(sys.modules, '__main__', main)
+    tracer = sys.gettrace()
+    profiler.time_runtime_hooks()
+    assert sys.gettrace() is tracer
+    # Like the bootloader runs the scripts.
+    for name in ('pyi_rth_one', 'pyi_rth_two', 'main', 'pyi_rth_late'):
+        main.__file__ = name + '.py'
+        exec('import time\ntime.sleep(0.01)', main.__dict__)
+    assert [name for name, seconds in profiler.runtime_hooks] == \
+        ['pyi_rth_one', 'pyi_rth_two']
+    assert all(seconds >= 0.01 for name, seconds in profiler.runtime_hooks)
+    assert type(main) is types.ModuleType
+    assert _dump(profiler)[-1].endswith('  pyi_rth_two')
+
+
+def test_import_order(frozen_importer, monkeypatch, tmpdir):
+    import pyimod03_importers
+    ImportProfiler = pyimod03_importers.ImportProfiler
+    order_file = tmpdir.join('import-order.txt')
+    monkeypatch.setattr(pyimod03_importers.pyi_os_path, 'os_environ',
+                        {ImportProfiler.ORDER_ENV_VAR: order_file.strpath})
+    profiler = ImportProfiler.create({})
+    assert profiler.mode is None
+    monkeypatch.setattr(pyimod03_importers, 'profiler', profiler)
+    monkeypatch.setattr(frozen_importer._pyz_archive, 'profiler', profiler)
+    monkeypatch.setattr(sys, 'meta_path', [frozen_importer] + sys.meta_path)
+    import importlib
+    importlib.import_module('pkg.mod')
+    importlib.import_module('pkg.other')
+    profiler.at_exit()
+    assert order_file.read().splitlines() == ['pkg', 'pkg.mod', 'pkg.other']
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason='requires Python 3.5')
+def test_lazy_modules(frozen_importer, monkeypatch):
+    monkeypatch.setattr(frozen_importer, '_lazy_modules', set(['pkg.other']))
+    monkeypatch.setattr(sys, 'meta_path', [frozen_importer] + sys.meta_path)
+    import importlib
+    other = importlib.import_module('pkg.other')
+    assert 'value' not in object.__getattribute__(other, '__dict__')
+    assert 'pkg.other' in frozen_importer._lazy_states
+    # The first access to an attribute executes the module.
+    assert other.value == 'other'
+    assert type(other) is type(sys)
+    assert other.__name__ == 'pkg.other'
+    assert frozen_importer._lazy_states == {}
+    # A module importing a lazy module gets the executed module.
+    assert importlib.import_module('pkg.mod').value == 'othermod'
+
+
+def test_extension_index(frozen_importer, monkeypatch):
+    import pyimod03_importers
+    suffixes = list(pyimod03_importers.EXTENSION_SUFFIXES)
+    meipass = sys._MEIPASS
+    for name in ('pkg.fast' + suffixes[0], 'slow' + suffixes[-1], 'data.txt'):
+        open(os.path.join(meipass, name), 'w').close()
+    importer = pyimod03_importers.CExtensionImporter()
+    assert importer.find_module('pkg.fast') is importer
+    assert importer.find_module('slow') is importer
+    assert importer.find_module('data') is None
+    # With an index, sys.prefix is not listed.
+    CExtensionImporter = pyimod03_importers.CExtensionImporter
+    with open(os.path.join(meipass, CExtensionImporter.EXTENSION_INDEX_NAME),
+              'wb') as fp:
+        marshal.dump({'pkg.fast': 'fast.so'}, fp)
+    monkeypatch.setattr(pyimod03_importers.pyi_os_path, 'os_listdir', None)
+    importer = CExtensionImporter()
+    assert importer.find_module('pkg.fast') is importer
+    assert importer.find_module('slow') is None
+    assert importer.get_filename('pkg.fast') == os.path.join(meipass, 'fast.so')
+    with pytest.raises(ImportError):
+        importer.get_code('slow')
+
+
+def test_resource_reader(frozen_importer):
+    assert frozen_importer.get_resource_reader('pkg.mod') is None
+    reader = frozen_importer.get_resource_reader('pkg')
+    # A loose data file next to the ones in the PYZ.
+    sys_prefix = sys._MEIPASS
+    os.mkdir(os.path.join(sys_prefix, 'pkg'))
+    with open(os.path.join(sys_prefix, 'pkg', 'loose.txt'), 'wb') as fp:
+        fp.write(b'loose')
+    assert sorted(reader.contents()) == ['data.txt', 'loose.txt', 'sub']
+    assert reader.is_resource('data.txt')
+    assert reader.is_resource('loose.txt')
+    assert not reader.is_resource('sub')
+    assert not reader.is_resource('missing.txt')
+    with reader.open_resource('data.txt') as fp:
+        assert fp.read(8) == b'data.txt'
+        assert fp.read() == b'data.txt' * 99
+    with reader.open_resource('loose.txt') as fp:
+        assert fp.read() == b'loose'
+    assert frozen_importer._list_resources(
+        os.path.join(sys_prefix, 'pkg', 'sub')) == ['more.txt']
+    if sys.version_info[0] > 2:
+        assert reader.resource_path('loose.txt') == \
+            os.path.join(sys_prefix, 'pkg', 'loose.txt')
+        with pytest.raises(FileNotFoundError):
+            reader.resource_path('data.txt')
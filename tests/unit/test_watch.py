@@ -0,0 +1,112 @@
+#-----------------------------------------------------------------------------
+# Copyright (c) 2016, PyInstaller Development Team.
+#
+# Distributed under the terms of the GNU General Public License with exception
+# for distributing bootloader.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+# This contains tests for waiting for changes with `--watch`.
+
+import os
+import threading
+import time
+
+import pytest
+
+from PyInstaller.building import watch
+from PyInstaller.building.build_main import _drop_stale_modgraphs
+from PyInstaller.compat import is_linux
+
+
+watchers = [watch.PollingWatcher]
+if is_linux:
+    watchers.append(watch.InotifyWatcher)
+
+
+@pytest.fixture(params=watchers)
+def watcher_class(request):
+    return request.param
+
+
+def _later(func, *args):
+    timer = threading.Timer(0.3, func, args)
+    timer.start()
+    return timer
+
+
+def test_watch_file(tmpdir, watcher_class):
+    script = tmpdir.join('script.py')
+    script.write('print(1)')
+    tmpdir.join('data.txt').write('data')
+    watcher = watcher_class([script.strpath])
+    try:
+        assert watcher.wait(timeout=0.5) == []
+        # Unwatched files are ignored.
+        _later(tmpdir.join('data.txt').write, 'changed')
+        assert watcher.wait(timeout=1) == []
+        _later(script.write, 'print(2)')
+        assert watcher.wait(timeout=5) == [script.strpath]
+    finally:
+        watcher.close()
+
+
+def test_watch_busy_directory(tmpdir, watcher_class):
+    script = tmpdir.join('script.py')
+    script.write('print(1)')
+    stop = threading.Event()
+
+    def write_log():
+        # Unwatched files changing all the time do not delay the report.
+        end = time.time() + 5
+        while not stop.is_set() and time.time() < end:
+            tmpdir.join('build.log').write('log')
+            time.sleep(0.02)
+
+    watcher = watcher_class([script.strpath])
+    writer = threading.Thread(target=write_log)
+    writer.start()
+    try:
+        _later(script.write, 'print(2)')
+        start = time.time()
+        assert watcher.wait(timeout=5) == [script.strpath]
+        assert time.time() - start < 2
+    finally:
+        stop.set()
+        writer.join()
+        watcher.close()
+
+
+def test_watch_directory(tmpdir, watcher_class):
+    watcher = watcher_class([tmpdir.strpath])
+    try:
+        _later(tmpdir.join('notes.txt').write, 'not a module')
+        assert watcher.wait(timeout=1) == []
+        _later(tmpdir.join('new.py').write, 'print(1)')
+        assert watcher.wait(timeout=5) == [tmpdir.join('new.py').strpath]
+    finally:
+        watcher.close()
+
+
+def test_drop_stale_modgraphs(tmpdir):
+    hooks = tmpdir.join('hooks').strpath
+    cache = {((), ()): 'plain', ((), (hooks,)): 'hooks',
+             (('tkinter',), (hooks,)): 'hooks without tkinter'}
+    _drop_stale_modgraphs(cache, [tmpdir.join('script.py').strpath])
+    assert len(cache) == 3
+    # A new pre_safe_import_module hook.
+    _drop_stale_modgraphs(cache, [os.path.join(hooks, 'pre_safe_import_module',
+                                               'hook-foo.py')])
+    assert cache == {((), ()): 'plain'}
+
+
+def test_changed_since(tmpdir):
+    old = tmpdir.join('old.py')
+    old.write('')
+    old.setmtime(time.time() - 100)
+    new = tmpdir.join('pkg', 'new.py')
+    new.write('', ensure=True)
+    since = time.time() - 50
+    assert watch.changed_since([old.strpath, tmpdir.join('pkg').strpath],
+                               since) == [new.strpath]